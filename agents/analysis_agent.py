@@ -1,19 +1,49 @@
-def calculate_exposure(market_data, sector=None, region=None):
-    # If market_data is present, use it for dynamic reporting.
-    if market_data:
-        # Try to extract exposure information from data if available (customize as needed)
-        return {
-            "region": region,
-            "sector": sector,
-            "exposure_percent": None,  # Only fill if you have real data
-            "change_percent": None
-        }
-    return {
+import logging
+from agents import risk_engine
+from agents.lazy import lazy_import
+pd = lazy_import("pandas")
+
+logger = logging.getLogger("analysis_agent")
+logger.setLevel(logging.INFO)
+
+def calculate_exposure(market_data, sector=None, region=None, holdings=None, logs=None):
+    # market_data: a dates x symbols price matrix covering the holdings (and
+    # optionally the risk benchmark); fetched from the history store when
+    # not given. Holdings default to the configured portfolio.
+    result = {
         "region": region,
         "sector": sector,
         "exposure_percent": None,
         "change_percent": None
     }
+    holdings = risk_engine.load_holdings() if holdings is None else holdings
+    if holdings is None or holdings.empty:
+        return result
+    try:
+        prices = market_data if isinstance(market_data, pd.DataFrame) and not market_data.empty else None
+        if prices is None:
+            from agents.api_agent import fetch_price_matrix
+            symbols = list(dict.fromkeys(holdings["symbol"].astype(str).str.upper()))
+            prices = fetch_price_matrix(symbols + [risk_engine.RISK_BENCHMARK], logs=logs)
+        benchmark = prices[risk_engine.RISK_BENCHMARK] if risk_engine.RISK_BENCHMARK in prices else None
+        risk = risk_engine.compute_risk(holdings, prices, benchmark=benchmark, sector=sector, region=region)
+    except Exception as e:
+        logger.error("Exposure calculation failed: %s", e)
+        if logs is not None:
+            logs.append(f"Exposure calculation failed: {e}")
+        return result
+    selection = risk["selection"]
+    result["exposure_percent"] = selection["exposure_percent"]
+    result["change_percent"] = selection.get("change_percent")
+    result.update({k: v for k, v in selection.items() if k not in result})
+    result["portfolio"] = risk["portfolio"]
+    result["by_region"] = risk.get("by_region", {})
+    result["by_sector"] = risk.get("by_sector", {})
+    result["top_risk_contributors"] = risk["top_risk_contributors"]
+    if logs is not None:
+        logs.append(f"Exposure: {result['exposure_percent']}% of {risk['positions']} positions "
+                    f"(sector={sector}, region={region})")
+    return result
 
 def analyze_earnings(earnings_data):
     if not earnings_data:
@@ -0,0 +1,217 @@
+"""
+ann_index.py
+
+FAISS index construction for the vector store. Supports exact ("flat") search
+and two approximate families, IVF and HNSW, each optionally compressed with
+product quantization. Everything is configured through IndexConfig, whose
+defaults come from VECTOR_INDEX_* environment variables, so the same settings
+drive both agents.retriever_agent.VectorStore and benchmarks.ann_benchmark.
+
+Indexes that need training (IVF, and anything with PQ) are only built once
+enough vectors exist to train them well; until then callers should keep using
+a flat index (see IndexConfig.min_train_size).
+"""
+
+import os
+from agents.lazy import lazy_import
+faiss = lazy_import("faiss")
+np = lazy_import("numpy")
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat")
+VECTOR_INDEX_NLIST = int(os.getenv("VECTOR_INDEX_NLIST", "256"))
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "16"))
+VECTOR_INDEX_HNSW_M = int(os.getenv("VECTOR_INDEX_HNSW_M", "32"))
+VECTOR_INDEX_EF_CONSTRUCTION = int(os.getenv("VECTOR_INDEX_EF_CONSTRUCTION", "80"))
+VECTOR_INDEX_EF_SEARCH = int(os.getenv("VECTOR_INDEX_EF_SEARCH", "64"))
+# Number of PQ sub-quantizers; 0 disables product quantization.
+VECTOR_INDEX_PQ_M = int(os.getenv("VECTOR_INDEX_PQ_M", "0"))
+VECTOR_INDEX_PQ_BITS = int(os.getenv("VECTOR_INDEX_PQ_BITS", "8"))
+# Filters matching at most this many vectors are answered by an exact scan of
+# just those vectors; approximate indexes can miss matches entirely when the
+# filter is that selective.
+VECTOR_INDEX_FILTER_EXACT_MAX = int(os.getenv("VECTOR_INDEX_FILTER_EXACT_MAX", "4096"))
+
+INDEX_TYPES = ("flat", "ivf", "hnsw")
+# k-means wants roughly this many training points per centroid; FAISS warns
+# below it and cluster quality drops off quickly.
+TRAIN_POINTS_PER_CENTROID = 39
+
+
+def as_matrix(vectors):
+    return np.ascontiguousarray(np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1))
+
+
+def index_kind(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    return "flat"
+
+
+def supports_selector(index):
+    return index_kind(index) != "flat" or isinstance(faiss.downcast_index(index), faiss.IndexFlat)
+
+
+def ensure_direct_map(index):
+    # IVF indexes need an id -> list map before vectors can be reconstructed.
+    # Ids are always sequential here (see remove_ids), so the array map works
+    # and is kept up to date by add().
+    if index_kind(index) == "ivf":
+        ivf = faiss.extract_index_ivf(index)
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.set_direct_map_type(faiss.DirectMap.Array)
+
+
+def remove_ids(index, ids):
+    # Remove ids and renumber the remaining vectors 0..n-1 in their original
+    # order, which is what the vector store's position -> docstore id map
+    # assumes. Flat indexes compact themselves; IVF keeps the old ids and
+    # HNSW can't drop nodes at all, so those are rebuilt from the vectors
+    # they already hold, reusing the trained quantizers.
+    ids = np.asarray(ids, dtype=np.int64)
+    if index_kind(index) == "flat":
+        index.remove_ids(ids)
+        return index
+    ensure_direct_map(index)
+    keep = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), ids)
+    vectors = index.reconstruct_batch(keep) if len(keep) else None
+    rebuilt = faiss.clone_index(index)
+    rebuilt.reset()
+    if vectors is not None:
+        rebuilt.add(vectors)
+    return rebuilt
+
+
+class IndexConfig:
+    def __init__(self, index_type=None, nlist=None, nprobe=None, hnsw_m=None,
+                 ef_construction=None, ef_search=None, pq_m=None, pq_bits=None, filter_exact_max=None):
+        self.index_type = (index_type or VECTOR_INDEX_TYPE).lower()
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type {self.index_type!r}; expected one of {INDEX_TYPES}")
+        self.nlist = nlist or VECTOR_INDEX_NLIST
+        self.nprobe = nprobe or VECTOR_INDEX_NPROBE
+        self.hnsw_m = hnsw_m or VECTOR_INDEX_HNSW_M
+        self.ef_construction = ef_construction or VECTOR_INDEX_EF_CONSTRUCTION
+        self.ef_search = ef_search or VECTOR_INDEX_EF_SEARCH
+        self.pq_m = VECTOR_INDEX_PQ_M if pq_m is None else pq_m
+        self.pq_bits = pq_bits or VECTOR_INDEX_PQ_BITS
+        self.filter_exact_max = VECTOR_INDEX_FILTER_EXACT_MAX if filter_exact_max is None else filter_exact_max
+
+    def __repr__(self):
+        name = self.index_type + (f"+pq{self.pq_m}x{self.pq_bits}" if self.pq_m else "")
+        if self.index_type == "ivf":
+            return f"{name}(nlist={self.nlist}, nprobe={self.nprobe})"
+        if self.index_type == "hnsw":
+            return f"{name}(M={self.hnsw_m}, efSearch={self.ef_search})"
+        return name
+
+    def min_train_size(self):
+        needed = 0
+        if self.index_type == "ivf":
+            needed = self.nlist * TRAIN_POINTS_PER_CENTROID
+        if self.pq_m:
+            needed = max(needed, (1 << self.pq_bits) * TRAIN_POINTS_PER_CENTROID)
+        return needed
+
+    def build(self, dim):
+        # Returns an empty, untrained index for vectors of size dim.
+        if self.pq_m and dim % self.pq_m:
+            raise ValueError(f"PQ sub-quantizers ({self.pq_m}) must divide the embedding size ({dim})")
+        if self.index_type == "ivf":
+            quantizer = faiss.IndexFlatL2(dim)
+            if self.pq_m:
+                index = faiss.IndexIVFPQ(quantizer, dim, self.nlist, self.pq_m, self.pq_bits)
+            else:
+                index = faiss.IndexIVFFlat(quantizer, dim, self.nlist)
+        elif self.index_type == "hnsw":
+            if self.pq_m:
+                index = faiss.IndexHNSWPQ(dim, self.pq_m, self.hnsw_m, self.pq_bits)
+            else:
+                index = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+            index.hnsw.efConstruction = self.ef_construction
+        elif self.pq_m:
+            index = faiss.IndexPQ(dim, self.pq_m, self.pq_bits)
+        else:
+            index = faiss.IndexFlatL2(dim)
+        self.apply_search_params(index)
+        ensure_direct_map(index)
+        return index
+
+    def build_trained(self, vectors):
+        # Build an index and train it on vectors, or return None if there
+        # aren't enough of them yet.
+        vectors = as_matrix(vectors)
+        if len(vectors) < self.min_train_size():
+            return None
+        index = self.build(vectors.shape[1])
+        if not index.is_trained:
+            index.train(vectors)
+        return index
+
+    def apply_search_params(self, index):
+        # Default search-time knobs, used by callers that search the index
+        # directly (e.g. LangChain's FAISS wrapper) rather than via
+        # search_params().
+        kind = index_kind(index)
+        if kind == "ivf":
+            faiss.extract_index_ivf(index).nprobe = self.nprobe
+        elif kind == "hnsw":
+            faiss.downcast_index(index).hnsw.efSearch = self.ef_search
+
+    def search_params(self, index, allowed_ids=None):
+        sel = None
+        if allowed_ids is not None:
+            sel = faiss.IDSelectorBatch(np.asarray(allowed_ids, dtype=np.int64))
+        kind = index_kind(index)
+        if kind == "ivf":
+            params = faiss.SearchParametersIVF(nprobe=self.nprobe)
+        elif kind == "hnsw":
+            params = faiss.SearchParametersHNSW(efSearch=self.ef_search)
+        elif sel is not None:
+            params = faiss.SearchParameters()
+        else:
+            return None
+        if sel is not None:
+            params.sel = sel
+            # SearchParameters only holds a raw pointer to the selector.
+            params._sel = sel
+        return params
+
+
+def _empty_result(n, k):
+    return np.full((n, k), np.inf, dtype=np.float32), np.full((n, k), -1, dtype=np.int64)
+
+
+def _search_subset(index, queries, k, allowed_ids):
+    # Exact search restricted to allowed_ids, using the vectors stored in the
+    # index (approximate for PQ-compressed indexes).
+    ids = np.asarray(allowed_ids, dtype=np.int64)
+    ensure_direct_map(index)
+    vectors = index.reconstruct_batch(ids)
+    found_d, found_i = faiss.knn(queries, vectors, min(k, len(ids)))
+    distances, labels = _empty_result(len(queries), k)
+    distances[:, :found_d.shape[1]] = found_d
+    labels[:, :found_i.shape[1]] = ids[found_i]
+    return distances, labels
+
+
+def search(index, queries, k, config=None, allowed_ids=None):
+    # Batched k-NN search. Returns (distances, ids) matrices with one row per
+    # query; missing neighbours are reported as id -1.
+    config = config or IndexConfig()
+    queries = as_matrix(queries)
+    if allowed_ids is not None:
+        if len(allowed_ids) == 0:
+            return _empty_result(len(queries), k)
+        if len(allowed_ids) <= config.filter_exact_max or not supports_selector(index):
+            return _search_subset(index, queries, k, allowed_ids)
+    params = config.search_params(index, allowed_ids)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+
+def index_bytes(index):
+    return int(faiss.serialize_index(index).nbytes)
@@ -1,10 +1,20 @@
+import os
 import logging
-import yfinance as yf
-from agents.language_agent import extract_entities
+from agents.cache import yahoo_cache
+from agents.resilience import upstream
+from agents.language_agent import extract_entities, extract_entities_batch
+from data_ingestion.history_store import history_store, as_frame_columns
+from agents.lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+yf = lazy_import("yfinance")
 
 logger = logging.getLogger("api_agent")
 logger.setLevel(logging.INFO)
 
+# Ticker lists at least this long are fetched with a single bulk download.
+BATCH_MIN_TICKERS = int(os.getenv("BATCH_MIN_TICKERS", "5"))
+
 def extract_market_entities(query, gemini_api_key, logs=None):
     entities = extract_entities(query, gemini_api_key)
     logger.info("Entities extracted: %s", entities)
@@ -12,20 +22,40 @@ def extract_market_entities(query, gemini_api_key, logs=None):
         logs.append(f"Entities extracted: {entities}")
     return entities
 
-def fetch_ticker_data(ticker, logs=None):
+def extract_market_entities_batch(queries, gemini_api_key, logs=None):
+    entities = extract_entities_batch(queries, gemini_api_key)
+    if logs is not None:
+        logs.append(f"Entities extracted for {len(queries)} queries")
+    return entities
+
+def _history_key(symbol, period, interval):
+    # The default intraday view keeps the plain symbol as its cache key.
+    return symbol if (period, interval) == ('1d', '1m') else f"{symbol}:{period}:{interval}"
+
+def fetch_history(ticker, period='1d', interval='1m', yf_ticker=None):
+    # Columnar bars from the local history store, which only downloads bars
+    # newer than what it already holds.
+    symbol = str(ticker).upper()
+    return yahoo_cache.get_or_load("history", _history_key(symbol, period, interval),
+                                   lambda: history_store.sync(symbol, interval, period, ticker=yf_ticker))
+
+def fetch_ticker_data(ticker, logs=None, period='1d', interval='1m'):
     try:
         t = yf.Ticker(ticker)
-        info = t.info
-        hist = t.history(period='1d', interval='1m')
-        price = hist['Close'][-1] if not hist.empty else info.get('regularMarketPrice')
+        key = str(ticker).upper()
+        info = yahoo_cache.get_or_load("info", key, lambda: t.info)
+        hist = fetch_history(key, period, interval, yf_ticker=t)
+        news = yahoo_cache.get_or_load("ticker_news", key, lambda: t.news)
+        has_bars = hist is not None and len(hist["close"]) > 0
+        price = float(hist["close"][-1]) if has_bars else info.get('regularMarketPrice')
         logger.info("Fetched yfinance data for %s: price=%s", ticker, price)
         if logs is not None:
             logs.append(f"Fetched yfinance data for {ticker}: price={price}")
         return {
             "info": info,
             "latest_price": price,
-            "history": hist.reset_index().to_dict("records") if not hist.empty else [],
-            "news": t.news,
+            "history": as_frame_columns(hist) if has_bars else {},
+            "news": news,
         }
     except Exception as e:
         logger.error("Failed to fetch yfinance data for %s: %s", ticker, e)
@@ -33,68 +63,166 @@ def fetch_ticker_data(ticker, logs=None):
             logs.append(f"Failed to fetch yfinance data for {ticker}: {e}")
         return {}
 
-def fetch_multiple_tickers_data(tickers, logs=None):
-    data = {}
-    for ticker in tickers:
-        data[ticker] = fetch_ticker_data(ticker, logs)
-    return data
+def _download(symbols, logs=None, **kwargs):
+    # One bulk download; returns {symbol: frame} for the symbols it covered.
+    bulk = upstream("yahoo").call(lambda: yf.download(symbols, group_by="ticker", threads=True, progress=False,
+                                                       auto_adjust=True, **kwargs))
+    frames = {}
+    for sym in symbols:
+        if bulk.columns.nlevels > 1 and sym in bulk.columns.get_level_values(0):
+            frames[sym] = bulk[sym].dropna(how="all")
+        elif bulk.columns.nlevels == 1 and len(symbols) == 1:
+            frames[sym] = bulk.dropna(how="all")
+    return frames
+
+def fetch_batch_history(tickers, period='1d', interval='1m', logs=None):
+    # History for many symbols with at most two bulk downloads: a delta
+    # download for symbols the history store already covers for this period,
+    # then one full download for the rest and for any the delta shows Yahoo
+    # has readjusted since. Returns {symbol: store columns}.
+    symbols = list(dict.fromkeys(str(t).upper() for t in tickers))
+    history = {}
+    for sym in symbols:
+        cached = yahoo_cache.peek("history", _history_key(sym, period, interval))
+        if cached is not None and len(cached["close"]):
+            history[sym] = cached
+    pending = [sym for sym in symbols if sym not in history]
+    # Hold the store locks of every pending symbol, as sync() does for one,
+    # so a concurrent sync or batch can't interleave its plan and writes.
+    with history_store.locked(pending, interval):
+        plans = {sym: history_store.plan(sym, interval, period) for sym in pending}
+        full = [sym for sym, p in plans.items() if p is not None and p[0] == "full"]
+        delta = [sym for sym, p in plans.items() if p is not None and p[0] == "delta"]
+        readjusted = []
+        for group, kwargs in ((delta, {"start": min((plans[s][1] for s in delta), default=None)}),
+                              (full, {"period": period})):
+            if not group:
+                continue
+            try:
+                frames = _download(group, interval=interval, **kwargs)
+            except Exception as e:
+                logger.error("Bulk download failed for %s: %s", group, e)
+                if logs is not None:
+                    logs.append(f"Bulk download failed for {len(group)} tickers: {e}")
+                continue
+            for sym, frame in frames.items():
+                if group is delta and history_store.readjusted(sym, interval, frame):
+                    readjusted.append(sym)
+                    full.append(sym)
+                    continue
+                history_store.ingest(sym, interval, period, frame, full=group is full)
+    # read() takes each symbol's lock shared, so it runs once they are released.
+    for sym in plans:
+        columns = history_store.read(sym, interval, period)
+        if columns is not None and len(columns["close"]):
+            history[sym] = columns
+            yahoo_cache.put("history", _history_key(sym, period, interval), columns)
+    cached = len(symbols) - len(plans)
+    logger.info("Fetched batch history for %d tickers (%d cached, %d full, %d delta downloads, %d readjusted)",
+                len(symbols), cached, len(full), len(delta), len(readjusted))
+    if logs is not None:
+        logs.append(f"Fetched batch history for {len(symbols)} tickers ({cached} cached, {len(full)} full, "
+                    f"{len(delta)} delta downloads, {len(readjusted)} readjusted)")
+    return {sym: history[sym] for sym in symbols if sym in history}
+
+def fetch_multiple_tickers_data(tickers, logs=None, batched=None):
+    if batched is None:
+        batched = len(tickers) >= BATCH_MIN_TICKERS
+    if not batched:
+        data = {}
+        for ticker in tickers:
+            data[ticker] = fetch_ticker_data(ticker, logs)
+        return data
+    history = fetch_batch_history(tickers, logs=logs)
+    latest_price = {sym: float(columns["close"][-1]) for sym, columns in history.items()}
+    # Company info is only included when already cached; the batch path never
+    # makes per-ticker round trips.
+    info = {}
+    for sym in latest_price:
+        cached_info = yahoo_cache.peek("info", sym)
+        if cached_info:
+            info[sym] = cached_info
+    return {
+        "symbols": list(latest_price),
+        "latest_price": latest_price,
+        "history": {sym: as_frame_columns(columns) for sym, columns in history.items()},
+        "info": info,
+    }
+
+def fetch_price_matrix(tickers, period='3mo', interval='1d', field='close', logs=None):
+    # Dates x symbols matrix of one price field, built from the history
+    # store. Daily bars are stamped at local midnight, so shift by 12h before
+    # taking the date to line up exchanges on either side of UTC.
+    history = fetch_batch_history(tickers, period=period, interval=interval, logs=logs)
+    series = {}
+    for sym, columns in history.items():
+        ts = columns["ts"].view("datetime64[s]")
+        if interval in ('1d', '5d', '1wk', '1mo', '3mo'):
+            ts = (ts + np.timedelta64(12, "h")).astype("datetime64[D]")
+        series[sym] = pd.Series(np.asarray(columns[field]), index=pd.DatetimeIndex(ts))
+    if not series:
+        return pd.DataFrame()
+    matrix = pd.DataFrame({sym: s[~s.index.duplicated(keep="last")] for sym, s in series.items()})
+    return matrix.sort_index()
+
+def _load_sector(sector_key):
+    sector = yf.Sector(sector_key)
+    return {
+        "overview": sector.overview,
+        "top_etfs": sector.top_etfs,
+        "top_mutual_funds": sector.top_mutual_funds,
+        "industries": sector.industries,
+        "top_companies": sector.top_companies,
+    }
 
 def fetch_sector_data(sector_key, logs=None):
     try:
-        sector = yf.Sector(sector_key)
-        overview = sector.overview
-        top_etfs = sector.top_etfs
-        top_mutual_funds = sector.top_mutual_funds
-        industries = sector.industries
-        top_companies = sector.top_companies
+        data = yahoo_cache.get_or_load("sector", sector_key, lambda: _load_sector(sector_key))
         logger.info("Fetched sector data for %s", sector_key)
         if logs is not None:
             logs.append(f"Fetched sector data for {sector_key}")
-        return {
-            "overview": overview,
-            "top_etfs": top_etfs,
-            "top_mutual_funds": top_mutual_funds,
-            "industries": industries,
-            "top_companies": top_companies,
-        }
+        return data
     except Exception as e:
         logger.error("Failed to fetch sector data for %s: %s", sector_key, e)
         if logs is not None:
             logs.append(f"Failed to fetch sector data for {sector_key}: {e}")
         return {}
 
+def _load_industry(industry_key):
+    industry = yf.Industry(industry_key)
+    return {
+        "overview": industry.overview,
+        "top_performing": industry.top_performing_companies,
+        "top_growth": industry.top_growth_companies,
+    }
+
 def fetch_industry_data(industry_key, logs=None):
     try:
-        industry = yf.Industry(industry_key)
-        overview = industry.overview
-        top_performing = industry.top_performing_companies
-        top_growth = industry.top_growth_companies
+        data = yahoo_cache.get_or_load("industry", industry_key, lambda: _load_industry(industry_key))
         logger.info("Fetched industry data for %s", industry_key)
         if logs is not None:
             logs.append(f"Fetched industry data for {industry_key}")
-        return {
-            "overview": overview,
-            "top_performing": top_performing,
-            "top_growth": top_growth,
-        }
+        return data
     except Exception as e:
         logger.error("Failed to fetch industry data for %s: %s", industry_key, e)
         if logs is not None:
             logs.append(f"Failed to fetch industry data for {industry_key}: {e}")
         return {}
 
+def _load_market(region):
+    market = yf.Market(region)
+    return {
+        "summary": market.summary,
+        "status": market.status,
+    }
+
 def fetch_market_summary(region, logs=None):
     try:
-        market = yf.Market(region)
-        summary = market.summary
-        status = market.status
+        data = yahoo_cache.get_or_load("market", region, lambda: _load_market(region))
         logger.info("Fetched market summary for %s", region)
         if logs is not None:
             logs.append(f"Fetched market summary for {region}")
-        return {
-            "summary": summary,
-            "status": status,
-        }
+        return data
     except Exception as e:
         logger.error("Failed to fetch market summary for %s: %s", region, e)
         if logs is not None:
@@ -103,7 +231,7 @@ def fetch_market_summary(region, logs=None):
 
 def fetch_news(query, count=10, logs=None):
     try:
-        news = yf.Search(query, news_count=count).news
+        news = yahoo_cache.get_or_load("news", (query, count), lambda: yf.Search(query, news_count=count).news)
         logger.info("Fetched news for '%s'", query)
         if logs is not None:
             logs.append(f"Fetched news for '{query}'")
@@ -113,3 +241,6 @@ def fetch_news(query, count=10, logs=None):
         if logs is not None:
             logs.append(f"Failed to fetch news for '{query}': {e}")
         return []
+
+def get_cache_stats():
+    return yahoo_cache.stats()
@@ -0,0 +1,163 @@
+"""
+audio_cache.py
+
+Content-addressed, size-bounded on-disk cache for synthesized speech.
+
+Entries are keyed by a SHA-256 of the normalized text together with every
+setting that changes the audio (voice, model, output format, voice settings,
+and the neighbouring text sent for prosody context), so repeated answers and canned fallback lines are served from local disk
+instead of a fresh ElevenLabs synthesis. Writes go to a temporary file that
+is atomically renamed into place, so readers never see partial audio. Files
+are evicted least-recently-used first (by mtime, refreshed on every hit) once
+the directory grows past its byte cap.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+import unicodedata
+
+logger = logging.getLogger("audio_cache")
+logger.setLevel(logging.INFO)
+
+TTS_CACHE_DIR = os.path.expanduser(os.getenv("TTS_CACHE_DIR", "~/.cache/finance_assistant/tts"))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "1") == "1"
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def audio_key(text, voice_id, model_id, voice_settings, output_format=None, previous_text=None, next_text=None):
+    material = {
+        "text": normalize_text(text),
+        "voice_id": voice_id,
+        "model_id": model_id,
+        "voice_settings": voice_settings,
+        "output_format": output_format,
+    }
+    # Context is only part of the key when sent, so context-free entries
+    # keep their keys.
+    if previous_text:
+        material["previous_text"] = normalize_text(previous_text)
+    if next_text:
+        material["next_text"] = normalize_text(next_text)
+    material = json.dumps(material, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class DiskAudioCache:
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES, suffix=".mp3"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._bytes = None
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(self.suffix):
+                    path = os.path.join(root, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, st.st_size, st.st_mtime
+
+    def _total_bytes(self):
+        if self._bytes is None:
+            self._bytes = sum(size for _, size, _ in self._files())
+        return self._bytes
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.counters["misses"] += 1
+            return None
+        except OSError as e:
+            logger.warning("Audio cache read failed for %s: %s", key, e)
+            with self._lock:
+                self.counters["errors"] += 1
+            return None
+        with self._lock:
+            self.counters["hits"] += 1
+        return data
+
+    def contains(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with self._lock:
+                    # Size the directory before the new file lands in it,
+                    # and swap it in under the lock so the running total
+                    # moves by exactly the difference.
+                    self._total_bytes()
+                    try:
+                        old_size = os.stat(path).st_size
+                    except FileNotFoundError:
+                        old_size = 0
+                    os.replace(tmp_path, path)
+                    self._bytes += len(data) - old_size
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning("Audio cache write failed for %s: %s", key, e)
+            with self._lock:
+                self.counters["errors"] += 1
+            return
+        with self._lock:
+            self.counters["writes"] += 1
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Oldest-used first, down to 90% of the cap to avoid evicting on
+        # every write once full.
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in sorted(self._files(), key=lambda f: f[2]):
+            if self._bytes <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            self._bytes -= size
+            self.counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return dict(
+                self.counters,
+                bytes=self._total_bytes() if os.path.isdir(self.directory) else 0,
+                max_bytes=self.max_bytes,
+                hit_rate=round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            )
+
+
+tts_cache = DiskAudioCache()
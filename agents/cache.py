@@ -0,0 +1,228 @@
+"""
+cache.py
+
+Shared in-process cache for upstream market data (Yahoo Finance).
+
+Each data kind has its own TTL (quotes expire in seconds, sector overviews in
+hours). Entries past their TTL but still inside the kind's stale window are
+served immediately while a background refresh fetches a new copy
+(stale-while-revalidate). The cache is LRU-evicted against an approximate
+memory cap, and concurrent misses for the same key are coalesced into a single
+upstream call. When a load fails, the last value is served instead for up to
+CACHE_STALE_IF_ERROR seconds past its stale window, so an upstream outage
+degrades answers rather than emptying them.
+"""
+
+import os
+import sys
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from agents.resilience import upstream
+
+logger = logging.getLogger("cache")
+logger.setLevel(logging.INFO)
+
+# kind -> (ttl seconds, extra seconds a stale entry may still be served)
+DEFAULT_POLICIES = {
+    "history": (30, 30),
+    "info": (900, 900),
+    "ticker_news": (300, 300),
+    "news": (300, 300),
+    "market": (60, 120),
+    "sector": (6 * 3600, 6 * 3600),
+    "industry": (6 * 3600, 6 * 3600),
+}
+
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+CACHE_STALE_IF_ERROR = float(os.getenv("CACHE_STALE_IF_ERROR", "3600"))
+
+
+def estimate_size(value, _depth=0):
+    # Rough deep size; exact accounting isn't needed to enforce the cap.
+    if _depth > 4:
+        return sys.getsizeof(value)
+    if hasattr(value, "memory_usage") and hasattr(value, "shape"):
+        try:
+            usage = value.memory_usage(deep=True)
+            return int(usage.sum() if hasattr(usage, "sum") else usage)
+        except Exception:
+            return sys.getsizeof(value)
+    if isinstance(value, (str, bytes, bytearray)):
+        return sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v, _depth + 1) for v in value)
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "stored_at")
+
+    def __init__(self, value, size, stored_at):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+
+
+class TTLCache:
+    def __init__(self, policies=None, max_bytes=CACHE_MAX_BYTES, refresh_workers=4, call=None,
+                 stale_if_error=CACHE_STALE_IF_ERROR):
+        # call(loader), when given, runs every load (e.g. through an
+        # agents.resilience Upstream).
+        self.policies = dict(policies or DEFAULT_POLICIES)
+        self.max_bytes = max_bytes
+        self.call = call
+        self.stale_if_error = stale_if_error
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._refresher = ThreadPoolExecutor(max_workers=refresh_workers, thread_name_prefix="cache-refresh")
+        self._counters = {}
+        self._tracked = threading.local()
+
+    def _count(self, kind, name):
+        counters = self._counters.setdefault(kind, {
+            "hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0,
+            "refreshes": 0, "evictions": 0, "errors": 0, "stale_on_error": 0,
+        })
+        counters[name] += 1
+
+    def _policy(self, kind):
+        return self.policies.get(kind, (60, 0))
+
+    def _note(self, kind, outcome):
+        lookups = getattr(self._tracked, "lookups", None)
+        if lookups is not None:
+            lookups.append((kind, outcome))
+
+    @contextmanager
+    def track(self):
+        # Collects (kind, outcome) for every get_or_load made by this thread
+        # inside the block; outcome is "hit", "stale_hit", "miss" or
+        # "coalesced".
+        outer = getattr(self._tracked, "lookups", None)
+        self._tracked.lookups = lookups = []
+        try:
+            yield lookups
+        finally:
+            self._tracked.lookups = outer
+            if outer is not None:
+                outer.extend(lookups)
+
+    def get_or_load(self, kind, key, loader):
+        cache_key = (kind, key)
+        ttl, stale_window = self._policy(kind)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                age = time.monotonic() - entry.stored_at
+                if age < ttl:
+                    self._entries.move_to_end(cache_key)
+                    self._count(kind, "hits")
+                    self._note(kind, "hit")
+                    return entry.value
+                if age < ttl + stale_window:
+                    self._entries.move_to_end(cache_key)
+                    self._count(kind, "stale_hits")
+                    self._note(kind, "stale_hit")
+                    if cache_key not in self._inflight:
+                        self._inflight[cache_key] = Future()
+                        self._count(kind, "refreshes")
+                        self._refresher.submit(self._load, cache_key, loader)
+                    return entry.value
+            future = self._inflight.get(cache_key)
+            if future is not None:
+                self._count(kind, "coalesced")
+                self._note(kind, "coalesced")
+                owner = False
+            else:
+                future = self._inflight[cache_key] = Future()
+                self._count(kind, "misses")
+                self._note(kind, "miss")
+                owner = True
+        if owner:
+            self._load(cache_key, loader)
+        return future.result()
+
+    def _load(self, cache_key, loader):
+        future = self._inflight[cache_key]
+        try:
+            value = loader() if self.call is None else self.call(loader)
+        except Exception as e:
+            ttl, stale_window = self._policy(cache_key[0])
+            with self._lock:
+                self._count(cache_key[0], "errors")
+                self._inflight.pop(cache_key, None)
+                entry = self._entries.get(cache_key)
+                usable = entry is not None and \
+                    time.monotonic() - entry.stored_at < ttl + stale_window + self.stale_if_error
+                if usable:
+                    self._count(cache_key[0], "stale_on_error")
+            if usable:
+                logger.warning("Cache load failed for %s, serving last value: %s", cache_key, e)
+                future.set_result(entry.value)
+            else:
+                logger.warning("Cache load failed for %s: %s", cache_key, e)
+                future.set_exception(e)
+            return
+        self._store(cache_key, value)
+        with self._lock:
+            self._inflight.pop(cache_key, None)
+        future.set_result(value)
+
+    def _store(self, cache_key, value):
+        size = estimate_size(value)
+        with self._lock:
+            old = self._entries.pop(cache_key, None)
+            if old is not None:
+                self._bytes -= old.size
+            if size > self.max_bytes:
+                return
+            self._entries[cache_key] = _Entry(value, size, time.monotonic())
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                evicted_key, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self._count(evicted_key[0], "evictions")
+
+    def peek(self, kind, key):
+        # Fresh value if present, without touching counters or triggering loads.
+        ttl, _ = self._policy(kind)
+        with self._lock:
+            entry = self._entries.get((kind, key))
+            if entry is not None and time.monotonic() - entry.stored_at < ttl:
+                return entry.value
+        return None
+
+    def put(self, kind, key, value):
+        self._store((kind, key), value)
+
+    def invalidate(self, kind=None, key=None):
+        with self._lock:
+            for cache_key in list(self._entries):
+                if (kind is None or cache_key[0] == kind) and (key is None or cache_key[1] == key):
+                    self._bytes -= self._entries.pop(cache_key).size
+
+    def stats(self):
+        with self._lock:
+            kinds = {kind: dict(counters) for kind, counters in self._counters.items()}
+            for counters in kinds.values():
+                lookups = counters["hits"] + counters["stale_hits"] + counters["misses"] + counters["coalesced"]
+                counters["hit_rate"] = round((counters["hits"] + counters["stale_hits"]) / lookups, 4) if lookups else 0.0
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "kinds": kinds,
+            }
+
+
+yahoo_cache = TTLCache(call=upstream("yahoo").call)
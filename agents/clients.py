@@ -0,0 +1,137 @@
+"""
+clients.py
+
+Shared upstream clients, so repeated requests reuse connections and client
+objects instead of paying TCP/TLS setup and construction on every call:
+
+- http_session(): one requests.Session for all sync HTTP (ElevenLabs, the
+  web scraper, APIClient), with keep-alive pools sized by HTTP_POOL_* ;
+- gemini_model(api_key, name): GenerativeModel handles cached per API key
+  and model. Each key gets its own Gemini client rather than going through
+  genai.configure(), which is process-global and would race between
+  concurrent requests carrying different keys.
+
+Per-key objects live in KeyedClients, which keeps only the
+CLIENT_CACHE_KEYS most recently used keys: users bring their own keys, so
+neither memory nor the set of keys held should grow with every new one.
+
+close_clients() releases the pools on shutdown.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from agents.lazy import lazy_import
+requests = lazy_import("requests")
+genai = lazy_import("google.generativeai")
+genai_client = lazy_import("google.generativeai.client")
+
+logger = logging.getLogger("clients")
+logger.setLevel(logging.INFO)
+
+# Hosts kept in the pool, and connections kept per host. Size the latter for
+# the peak number of concurrent calls to one service (orchestrate workers x
+# pipelined TTS window).
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "16"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
+CLIENT_CACHE_KEYS = int(os.getenv("CLIENT_CACHE_KEYS", "64"))
+
+HTTP_TIMEOUT = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+
+# google-generativeai releases whose internals _bind_gemini_client relies on.
+GENAI_PER_KEY_VERSIONS = ("0.7.", "0.8.")
+
+_lock = threading.Lock()
+_session = None
+
+
+class KeyedClients:
+    # build(key) results for the max_keys most recently used keys.
+    def __init__(self, build, max_keys=CLIENT_CACHE_KEYS):
+        self.build = build
+        self.max_keys = max_keys
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+            value = self._items[key] = self.build(key)
+            while len(self._items) > self.max_keys:
+                self._items.popitem(last=False)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+def http_session():
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS,
+                                                        pool_maxsize=HTTP_POOL_MAXSIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+_per_key_warned = False
+
+
+def _bind_gemini_client(model, api_key):
+    # GenerativeModel has no public way to take a client, so this is the one
+    # place that uses genai internals: a client from genai's own factory,
+    # configured for this key only, set as the model's client (it otherwise
+    # binds the process-wide default on first use). On releases it hasn't
+    # been checked against, fall back to the global genai.configure().
+    global _per_key_warned
+    if genai.__version__.startswith(GENAI_PER_KEY_VERSIONS) and hasattr(genai_client, "_ClientManager"):
+        manager = genai_client._ClientManager()
+        manager.configure(api_key=api_key)
+        model._client = manager.get_default_client("generative")
+        return model
+    if not _per_key_warned:
+        _per_key_warned = True
+        logger.warning("google-generativeai %s is not one of %s; using genai.configure(), which is shared by "
+                       "every API key", genai.__version__, ", ".join(GENAI_PER_KEY_VERSIONS))
+    genai.configure(api_key=api_key)
+    return model
+
+
+_gemini_models = KeyedClients(lambda key: _bind_gemini_client(genai.GenerativeModel(key[1]), key[0]))
+
+
+def gemini_model(api_key, model_name=GEMINI_MODEL):
+    return _gemini_models.get((api_key, model_name))
+
+
+def close_clients():
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is not None:
+        session.close()
+    _gemini_models.clear()
+
+
+def stats():
+    return {
+        "http_session": _session is not None,
+        "gemini_models": len(_gemini_models),
+        "gemini_models_max": _gemini_models.max_keys,
+    }
@@ -0,0 +1,368 @@
+"""
+earnings_screener.py
+
+Universe-wide earnings surprise screener. Keeps a precomputed table of
+reported vs estimated EPS for a configurable universe of companies, seeded
+from the top companies of yfinance sectors and their industries, and
+refreshed in the background every EARNINGS_REFRESH_INTERVAL seconds.
+
+The table has one row per company and fiscal quarter. At refresh time it is
+sorted and position indexes are built for sector, industry, region and
+fiscal period, so a screen such as "Asian semiconductors that beat estimates
+last quarter" is a few index lookups and array comparisons over the table
+rather than one Yahoo call (or LLM turn) per company.
+
+Sector and industry values are yfinance keys ("technology",
+"semiconductors"); regions use the entity extractor's codes (US, ASIA,
+EUROPE, GB, ...). Fiscal periods are labelled by the calendar quarter their
+fiscal quarter ends in ("2025Q2"); "latest" selects each company's most
+recently reported quarter.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agents.cache import yahoo_cache
+from agents.resilience import upstream
+from agents.lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger("earnings_screener")
+logger.setLevel(logging.INFO)
+
+DEFAULT_SECTORS = (
+    "technology", "financial-services", "healthcare", "consumer-cyclical", "communication-services",
+    "industrials", "consumer-defensive", "energy", "basic-materials", "real-estate", "utilities",
+)
+EARNINGS_UNIVERSE_SECTORS = [s.strip() for s in os.getenv("EARNINGS_UNIVERSE_SECTORS", ",".join(DEFAULT_SECTORS)).split(",")
+                             if s.strip()]
+# Also take the top companies of every industry in those sectors.
+EARNINGS_UNIVERSE_INDUSTRIES = os.getenv("EARNINGS_UNIVERSE_INDUSTRIES", "1") == "1"
+# Extra comma-separated symbols to always include.
+EARNINGS_UNIVERSE_EXTRA = [s.strip().upper() for s in os.getenv("EARNINGS_UNIVERSE_EXTRA", "").split(",") if s.strip()]
+EARNINGS_REFRESH_INTERVAL = float(os.getenv("EARNINGS_REFRESH_INTERVAL", str(6 * 3600)))
+EARNINGS_REFRESH_WORKERS = int(os.getenv("EARNINGS_REFRESH_WORKERS", "8"))
+EARNINGS_SCREENER_PATH = os.path.expanduser(
+    os.getenv("EARNINGS_SCREENER_PATH", "~/.cache/finance_assistant/earnings.pkl"))
+
+INDEX_LEVELS = ("sector", "industry", "region", "period")
+
+_COUNTRY_REGIONS = {
+    "United States": "US", "United Kingdom": "GB",
+    **dict.fromkeys(["China", "Japan", "South Korea", "Korea", "Taiwan", "Hong Kong", "India", "Singapore",
+                     "Indonesia", "Malaysia", "Thailand", "Philippines", "Vietnam", "Macau"], "ASIA"),
+    **dict.fromkeys(["Germany", "France", "Netherlands", "Switzerland", "Ireland", "Italy", "Spain", "Sweden",
+                     "Denmark", "Norway", "Finland", "Belgium", "Austria", "Luxembourg", "Portugal",
+                     "Poland"], "EUROPE"),
+}
+_SUFFIX_REGIONS = {
+    **dict.fromkeys(["T", "HK", "SS", "SZ", "KS", "KQ", "TW", "TWO", "NS", "BO", "SI", "JK", "KL", "BK"], "ASIA"),
+    **dict.fromkeys(["DE", "F", "PA", "AS", "MI", "SW", "MC", "ST", "CO", "OL", "HE", "BR", "VI", "IR",
+                     "LS"], "EUROPE"),
+    "L": "GB",
+}
+
+
+def region_for(symbol, country=None):
+    if country:
+        return _COUNTRY_REGIONS.get(country, country.upper())
+    suffix = symbol.rsplit(".", 1)[1] if "." in symbol else None
+    return _SUFFIX_REGIONS.get(suffix, "US" if suffix is None else "UNKNOWN")
+
+
+def fiscal_period(quarter_end):
+    # Fiscal quarter end dates -> calendar quarter labels ("2025Q2").
+    dates = pd.DatetimeIndex(quarter_end)
+    return (dates.year.astype(str) + "Q" + dates.quarter.astype(str)).to_numpy()
+
+
+def _as_list(value):
+    if value is None or value == "":
+        return None
+    return [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+
+
+def _symbols(frame):
+    return [] if frame is None or getattr(frame, "empty", True) else [str(s).upper() for s in frame.index]
+
+
+def load_universe(sectors=None, with_industries=None, extra=None):
+    # symbol -> {"name", "sector", "industry"}, from the cached sector and
+    # industry endpoints. Industry is filled in only where it is known.
+    from agents.api_agent import fetch_sector_data, fetch_industry_data
+    sectors = EARNINGS_UNIVERSE_SECTORS if sectors is None else sectors
+    with_industries = EARNINGS_UNIVERSE_INDUSTRIES if with_industries is None else with_industries
+    universe = {}
+    for sector in sectors:
+        data = fetch_sector_data(sector)
+        top = data.get("top_companies")
+        for sym in _symbols(top):
+            universe.setdefault(sym, {"name": top.loc[sym, "name"] if sym in top.index else None,
+                                      "sector": sector, "industry": None})
+        industries = data.get("industries")
+        if not with_industries or industries is None or getattr(industries, "empty", True):
+            continue
+        for industry in industries.index:
+            industry_data = fetch_industry_data(industry)
+            for key in ("top_performing", "top_growth"):
+                frame = industry_data.get(key)
+                for sym in _symbols(frame):
+                    entry = universe.setdefault(sym, {"name": frame.loc[sym, "name"] if "name" in frame else None,
+                                                      "sector": sector, "industry": None})
+                    entry["industry"] = entry["industry"] or industry
+    for sym in extra if extra is not None else EARNINGS_UNIVERSE_EXTRA:
+        universe.setdefault(sym, {"name": None, "sector": None, "industry": None})
+    return universe
+
+
+def fetch_company_earnings(symbol, meta):
+    # Rows for one company: its reported quarters with estimate, actual and
+    # surprise. Company info (cached) fills in region and missing fields.
+    import yfinance as yf
+    ticker = yf.Ticker(symbol)
+    try:
+        info = yahoo_cache.get_or_load("info", symbol, lambda: ticker.info) or {}
+    except Exception:
+        info = {}
+    history = upstream("yahoo").call(ticker.get_earnings_history)
+    if history is None or history.empty or "epsActual" not in history:
+        return None
+    history = history.dropna(subset=["epsActual"]).sort_index()
+    if history.empty:
+        return None
+    estimate = history["epsEstimate"].to_numpy(dtype=np.float64) if "epsEstimate" in history \
+        else np.full(len(history), np.nan)
+    actual = history["epsActual"].to_numpy(dtype=np.float64)
+    if "surprisePercent" in history:
+        surprise = history["surprisePercent"].to_numpy(dtype=np.float64) * 100
+    else:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            surprise = (actual - estimate) / np.abs(estimate) * 100
+    return pd.DataFrame({
+        "symbol": symbol,
+        "name": meta.get("name") or info.get("shortName"),
+        "sector": meta.get("sector") or info.get("sectorKey") or "UNKNOWN",
+        "industry": meta.get("industry") or info.get("industryKey") or "UNKNOWN",
+        "region": region_for(symbol, info.get("country")),
+        "period": fiscal_period(history.index),
+        "quarter_end": pd.DatetimeIndex(history.index).tz_localize(None),
+        "eps_estimate": estimate,
+        "eps_actual": actual,
+        "surprise_percent": surprise,
+        "latest": np.arange(len(history)) == len(history) - 1,
+    })
+
+
+class EarningsScreener:
+    def __init__(self, path=EARNINGS_SCREENER_PATH, refresh_interval=EARNINGS_REFRESH_INTERVAL):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.table = None
+        self.indexes = {}
+        self.refreshed_at = None
+        self._refresh_lock = threading.Lock()
+        self._refreshing = None
+        self.counters = {"refreshes": 0, "refresh_failures": 0, "screens": 0}
+        self._loaded = False
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        # The saved table is read on first use rather than at import time,
+        # which would pull pandas into worker boot.
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            saved = pd.read_pickle(self.path)
+            if self.table is not None:
+                return
+            self._install(saved["table"], saved["refreshed_at"])
+            logger.info("Loaded earnings table (%d rows) from %s", len(self.table), self.path)
+        except Exception as e:
+            logger.error("Could not load earnings table from %s: %s", self.path, e)
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        pd.to_pickle({"table": self.table, "refreshed_at": self.refreshed_at}, self.path + ".tmp")
+        os.replace(self.path + ".tmp", self.path)
+
+    def _install(self, table, refreshed_at):
+        # Sort once and precompute, per index level, value -> row positions.
+        # The table and indexes are replaced together, so readers holding the
+        # old pair keep a consistent view while a refresh lands.
+        # Each level also keeps its per-row codes, to test candidate rows
+        # against that level without touching the rest of the table.
+        table = table.sort_values(["sector", "industry", "region", "period", "symbol"]).reset_index(drop=True)
+        indexes = {}
+        for level in INDEX_LEVELS:
+            codes, values = pd.factorize(table[level])
+            positions = {key: np.asarray(rows) for key, rows in table.groupby(level, sort=False).indices.items()}
+            indexes[level] = (positions, codes, {value: code for code, value in enumerate(values)})
+        latest = table["latest"].to_numpy(dtype=bool)
+        indexes["latest"] = ({True: np.flatnonzero(latest)}, latest.astype(np.intp), {True: 1})
+        self.table, self.indexes, self.refreshed_at = table, indexes, refreshed_at
+
+    def build(self, universe=None):
+        # Download earnings for every company in the universe and build the
+        # table; returns it without installing it.
+        universe = load_universe() if universe is None else universe
+        frames, failed = [], 0
+        with ThreadPoolExecutor(max_workers=EARNINGS_REFRESH_WORKERS, thread_name_prefix="earnings") as pool:
+            futures = {sym: pool.submit(fetch_company_earnings, sym, meta) for sym, meta in universe.items()}
+            for sym, future in futures.items():
+                try:
+                    frame = future.result()
+                except Exception as e:
+                    logger.warning("Earnings unavailable for %s: %s", sym, e)
+                    failed += 1
+                    continue
+                if frame is not None:
+                    frames.append(frame)
+        logger.info("Built earnings table for %d of %d companies (%d failed)", len(frames), len(universe), failed)
+        return pd.concat(frames, ignore_index=True) if frames else None
+
+    def refresh(self, universe=None):
+        with self._refresh_lock:
+            start = time.monotonic()
+            try:
+                table = self.build(universe)
+            except Exception as e:
+                self.counters["refresh_failures"] += 1
+                logger.error("Earnings table refresh failed: %s", e)
+                return False
+            if table is None or table.empty:
+                self.counters["refresh_failures"] += 1
+                return False
+            self._install(table, time.time())
+            self.counters["refreshes"] += 1
+            try:
+                self._save()
+            except Exception as e:
+                logger.error("Could not save earnings table to %s: %s", self.path, e)
+            logger.info("Earnings table refreshed: %d rows in %.1fs", len(table), time.monotonic() - start)
+            return True
+
+    def is_stale(self):
+        return self.refreshed_at is None or time.time() - self.refreshed_at > self.refresh_interval
+
+    def ensure_fresh(self):
+        # Starts a background refresh if the table is missing or old; never
+        # blocks the caller.
+        self.load()
+        if not self.is_stale() or (self._refreshing is not None and self._refreshing.is_alive()):
+            return
+        self._refreshing = threading.Thread(target=self.refresh, name="earnings-refresh", daemon=True)
+        self._refreshing.start()
+
+    @staticmethod
+    def _rows_for(index, values):
+        positions, _, _ = index
+        found = [positions[v] for v in values if v in positions]
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return found[0] if len(found) == 1 else np.sort(np.concatenate(found))
+
+    def screen(self, sector=None, industry=None, region=None, period="latest", min_surprise=None,
+               max_surprise=None, sort="surprise_percent", ascending=False, limit=None):
+        # Rows matching every given filter; each filter takes one value or a
+        # list. period is a label ("2025Q2"), a list of them, "latest" or None
+        # for every quarter.
+        self.load()
+        table, indexes = self.table, self.indexes
+        if table is None:
+            return pd.DataFrame()
+        self.counters["screens"] += 1
+        filters = {"sector": _as_list(sector), "industry": _as_list(industry), "region": _as_list(region),
+                   "period": [True] if period == "latest" else _as_list(period)}
+        filters = {
+            ("latest" if level == "period" and period == "latest" else level):
+                [v.upper() for v in values] if level == "region"
+                else [v.lower().replace(" ", "-") for v in values] if level in ("sector", "industry") else values
+            for level, values in filters.items() if values is not None
+        }
+        # Start from the most selective index, then check the candidate rows'
+        # codes for every other filter.
+        sizes = {level: sum(len(indexes[level][0].get(v, ())) for v in values) for level, values in filters.items()}
+        rows = np.arange(len(table))
+        for level in sorted(filters, key=sizes.get):
+            if len(rows) == len(table):
+                rows = self._rows_for(indexes[level], filters[level])
+                continue
+            _, codes, lookup = indexes[level]
+            wanted = [lookup[v] for v in filters[level] if v in lookup]
+            rows = rows[np.isin(codes[rows], wanted)]
+        surprise = table["surprise_percent"].to_numpy()
+        keep = np.ones(len(rows), dtype=bool)
+        if min_surprise is not None:
+            keep &= surprise[rows] >= min_surprise
+        if max_surprise is not None:
+            keep &= surprise[rows] <= max_surprise
+        rows = rows[keep]
+        if sort:
+            values = table[sort].to_numpy()[rows]
+            if values.dtype.kind == "f":
+                order = np.argsort(values if ascending else -values, kind="stable")
+            else:
+                order = np.argsort(values, kind="stable")
+                order = order if ascending else order[::-1]
+            rows = rows[order]
+        if limit is not None:
+            rows = rows[:limit]
+        return table.iloc[rows]
+
+    def summary(self, sector=None, industry=None, region=None, period="latest", top_n=10):
+        # Compact answer-ready view: counts plus the biggest beats and misses.
+        matches = self.screen(sector=sector, industry=industry, region=region, period=period)
+        if matches.empty:
+            return {}
+        surprise = matches["surprise_percent"].to_numpy()
+        columns = ["symbol", "name", "region", "period", "eps_estimate", "eps_actual", "surprise_percent"]
+        as_records = lambda frame: frame[columns].round(4).replace({np.nan: None}).to_dict("records")
+        return {
+            "sector": sector, "industry": industry, "region": region, "period": period,
+            "companies": int(len(matches)),
+            "beat": int((surprise > 0).sum()),
+            "missed": int((surprise < 0).sum()),
+            "median_surprise_percent": round(float(np.nanmedian(surprise)), 4) if np.isfinite(surprise).any() else None,
+            "top_beats": as_records(matches[surprise > 0].head(top_n)),
+            "top_misses": as_records(matches[surprise < 0].iloc[::-1].head(top_n)),
+            "as_of": self.refreshed_at,
+        }
+
+    def stats(self):
+        return dict(self.counters, rows=0 if self.table is None else len(self.table),
+                    companies=0 if self.table is None else int(self.table["symbol"].nunique()),
+                    refreshed_at=self.refreshed_at, refreshing=bool(self._refreshing and self._refreshing.is_alive()))
+
+
+earnings_screener = EarningsScreener()
+
+
+def screen_earnings(sector=None, industry=None, region=None, logs=None):
+    # Fetch-stage entry point: serves the current table (refreshing it in
+    # the background when due) and never waits for Yahoo.
+    earnings_screener.ensure_fresh()
+    if earnings_screener.table is None:
+        if logs is not None:
+            logs.append("Earnings screener table not built yet; refreshing in the background")
+        return {}
+    start = time.monotonic()
+    result = earnings_screener.summary(sector=sector, industry=industry, region=region)
+    elapsed = (time.monotonic() - start) * 1000
+    logger.info("Earnings screen sector=%s industry=%s region=%s: %d companies in %.1fms",
+                sector, industry, region, result.get("companies", 0), elapsed)
+    if logs is not None:
+        logs.append(f"Earnings screen: {result.get('companies', 0)} companies in {elapsed:.1f}ms")
+    return result
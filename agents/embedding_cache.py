@@ -0,0 +1,146 @@
+"""
+embedding_cache.py
+
+Content-hash keyed cache for embedding vectors, persisted in a single SQLite
+file. CachedEmbeddings wraps any LangChain Embeddings object so unchanged
+texts (e.g. news articles seen on an earlier request) are never sent to the
+embedding API again; only cache misses are embedded, in one batch. Given an
+upstream (agents.resilience), every call to the model goes through it, under
+the rate limits, retry budget and circuit breaker for the caller's key.
+"""
+
+import os
+import asyncio
+import hashlib
+import sqlite3
+import logging
+import threading
+from agents.lazy import lazy_import
+np = lazy_import("numpy")
+
+logger = logging.getLogger("embedding_cache")
+logger.setLevel(logging.INFO)
+
+EMBEDDING_CACHE_PATH = os.path.expanduser(
+    os.getenv("EMBEDDING_CACHE_PATH", "~/.cache/finance_assistant/embeddings.sqlite3")
+)
+
+
+def content_hash(text, namespace=""):
+    return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=EMBEDDING_CACHE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+_registered = False
+
+
+def _register_as_embeddings():
+    # CachedEmbeddings implements LangChain's Embeddings interface but only
+    # registers as a (virtual) subclass once one is built: importing the base
+    # class pulls in langchain_core's callback machinery, which is slow.
+    global _registered
+    if not _registered:
+        from langchain_core.embeddings import Embeddings
+        Embeddings.register(CachedEmbeddings)
+        _registered = True
+
+
+class CachedEmbeddings:
+    def __init__(self, underlying, cache=None, namespace="", upstream=None, api_key=None):
+        _register_as_embeddings()
+        self.underlying = underlying
+        self.cache = cache or EmbeddingCache()
+        # Separate models (and query vs document embeddings) must not share keys.
+        self.namespace = namespace or getattr(underlying, "model", type(underlying).__name__)
+        self.upstream = upstream
+        self.api_key = api_key
+
+    def _call(self, fn):
+        return fn() if self.upstream is None else self.upstream.call(fn, key=self.api_key)
+
+    def embed_documents(self, texts):
+        keys = [content_hash(t, f"{self.namespace}:doc") for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in found))
+        if missing:
+            vectors = self._call(lambda: self.underlying.embed_documents(missing))
+            new = {content_hash(t, f"{self.namespace}:doc"): v for t, v in zip(missing, vectors)}
+            self.cache.put_many(new.items())
+            found.update(new)
+        logger.info("Embedded %d texts (%d from cache)", len(texts), len(texts) - len(missing))
+        return [found[k] for k in keys]
+
+    def embed_query(self, text):
+        key = content_hash(text, f"{self.namespace}:query")
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self._call(lambda: self.underlying.embed_query(text))
+        self.cache.put_many([(key, vector)])
+        return vector
+
+    def embed_queries(self, texts):
+        # Batched embed_query: cache misses go to the model in one call where
+        # it supports query-typed batch embedding (Gemini does).
+        keys = [content_hash(t, f"{self.namespace}:query") for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(t for t, k in zip(texts, keys) if k not in found))
+        if missing:
+            try:
+                vectors = self._call(lambda: self.underlying.embed_documents(missing, task_type="retrieval_query"))
+            except TypeError:
+                vectors = self._call(lambda: [self.underlying.embed_query(t) for t in missing])
+            new = {content_hash(t, f"{self.namespace}:query"): v for t, v in zip(missing, vectors)}
+            self.cache.put_many(new.items())
+            found.update(new)
+        return [found[k] for k in keys]
+
+    async def aembed_documents(self, texts):
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    async def aembed_query(self, text):
+        return await asyncio.to_thread(self.embed_query, text)
@@ -0,0 +1,353 @@
+"""
+entity_index.py
+
+Local fast path for entity extraction. A prebuilt dictionary of ticker
+symbols, company names, indices, sectors, industries, regions and currencies
+is loaded into a word-level trie; a query is scanned once with longest-match
+lookups, which resolves common questions ("how is TSMC doing", "Asia tech
+exposure") in microseconds without a Gemini round trip.
+
+Each result carries a confidence score. Any word left over that is neither
+a dictionary match nor ordinary query vocabulary (_STOPWORDS) may be an
+entity the dictionary lacks, whatever its case or position, so such queries
+score low and the caller falls back to the LLM. Aliases that are also common
+English words ("arm", "visa", "shell") only resolve when written as a name
+or next to a finance cue ("ARM shares"); otherwise they count as unresolved
+too. The dictionary can be extended with a JSON file of the same shape as
+DEFAULT_DICTIONARY via ENTITY_DICTIONARY_PATH.
+"""
+
+import os
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger("entity_index")
+logger.setLevel(logging.INFO)
+
+ENTITY_FIELDS = (
+    "ticker", "index_name", "sector", "industry", "region",
+    "asset_type", "market", "from_currency", "to_currency",
+)
+
+# field -> {alias: canonical value}. Sector, industry and region values are
+# the keys yfinance's Sector/Industry/Market endpoints expect.
+DEFAULT_DICTIONARY = {
+    "ticker": {
+        "apple": "AAPL", "microsoft": "MSFT", "nvidia": "NVDA", "amazon": "AMZN",
+        "alphabet": "GOOGL", "google": "GOOGL", "meta": "META", "facebook": "META",
+        "tesla": "TSLA", "netflix": "NFLX", "amd": "AMD", "advanced micro devices": "AMD",
+        "intel": "INTC", "qualcomm": "QCOM", "broadcom": "AVGO", "micron": "MU",
+        "oracle": "ORCL", "salesforce": "CRM", "adobe": "ADBE", "ibm": "IBM",
+        "cisco": "CSCO", "texas instruments": "TXN", "applied materials": "AMAT",
+        "asml": "ASML", "arm": "ARM", "palantir": "PLTR", "uber": "UBER",
+        "jpmorgan": "JPM", "jp morgan": "JPM", "goldman sachs": "GS",
+        "morgan stanley": "MS", "bank of america": "BAC", "citigroup": "C",
+        "wells fargo": "WFC", "berkshire hathaway": "BRK-B", "visa": "V",
+        "mastercard": "MA", "paypal": "PYPL", "walmart": "WMT", "costco": "COST",
+        "coca cola": "KO", "pepsico": "PEP", "mcdonalds": "MCD", "nike": "NKE",
+        "disney": "DIS", "exxon": "XOM", "exxonmobil": "XOM", "chevron": "CVX",
+        "pfizer": "PFE", "johnson & johnson": "JNJ", "eli lilly": "LLY",
+        "novo nordisk": "NVO", "unitedhealth": "UNH", "boeing": "BA",
+        "tsmc": "TSM", "taiwan semiconductor": "TSM", "samsung": "005930.KS",
+        "samsung electronics": "005930.KS", "sk hynix": "000660.KS",
+        "sony": "SONY", "toyota": "TM", "alibaba": "BABA", "tencent": "0700.HK",
+        "baidu": "BIDU", "jd.com": "JD", "pdd": "PDD", "xiaomi": "1810.HK",
+        "infosys": "INFY", "tokyo electron": "8035.T", "softbank": "9984.T",
+        "keyence": "6861.T", "mediatek": "2454.TW", "foxconn": "2317.TW",
+        "hon hai": "2317.TW", "reliance": "RELIANCE.NS", "sap": "SAP",
+        "shell": "SHEL", "bp": "BP", "hsbc": "HSBC", "nestle": "NESN.SW",
+        "lvmh": "MC.PA", "bitcoin": "BTC-USD", "ethereum": "ETH-USD",
+    },
+    "index_name": {
+        "s&p 500": "^GSPC", "s&p": "^GSPC", "sp500": "^GSPC", "nasdaq": "^IXIC",
+        "nasdaq 100": "^NDX", "dow": "^DJI", "dow jones": "^DJI",
+        "russell 2000": "^RUT", "vix": "^VIX", "ftse": "^FTSE", "ftse 100": "^FTSE",
+        "dax": "^GDAXI", "cac 40": "^FCHI", "nikkei": "^N225", "nikkei 225": "^N225",
+        "hang seng": "^HSI", "kospi": "^KS11", "taiex": "^TWII", "sensex": "^BSESN",
+        "nifty": "^NSEI", "nifty 50": "^NSEI", "shanghai composite": "000001.SS",
+    },
+    "sector": {
+        "tech": "technology", "technology": "technology",
+        "financials": "financial-services", "financial": "financial-services",
+        "financial services": "financial-services", "banks": "financial-services",
+        "banking": "financial-services", "healthcare": "healthcare",
+        "health care": "healthcare", "pharma": "healthcare", "energy": "energy",
+        "oil and gas": "energy", "industrials": "industrials",
+        "consumer discretionary": "consumer-cyclical", "consumer cyclical": "consumer-cyclical",
+        "consumer staples": "consumer-defensive", "consumer defensive": "consumer-defensive",
+        "materials": "basic-materials", "basic materials": "basic-materials",
+        "real estate": "real-estate", "reits": "real-estate", "utilities": "utilities",
+        "communication services": "communication-services", "telecom": "communication-services",
+        "media": "communication-services",
+    },
+    "industry": {
+        "semiconductors": "semiconductors", "semis": "semiconductors",
+        "chips": "semiconductors", "chipmakers": "semiconductors",
+        "semiconductor equipment": "semiconductor-equipment-materials",
+        "software": "software-infrastructure", "cloud": "software-infrastructure",
+        "saas": "software-application", "consumer electronics": "consumer-electronics",
+        "biotech": "biotechnology", "biotechnology": "biotechnology",
+        "auto": "auto-manufacturers", "autos": "auto-manufacturers", "evs": "auto-manufacturers",
+        "electric vehicles": "auto-manufacturers", "airlines": "airlines",
+        "insurance": "insurance-diversified", "regional banks": "banks-regional",
+        "oil": "oil-gas-integrated", "gold": "gold", "retail": "internet-retail",
+        "e-commerce": "internet-retail", "ecommerce": "internet-retail",
+    },
+    "region": {
+        "asia": "ASIA", "asian": "ASIA", "apac": "ASIA", "asia pacific": "ASIA",
+        "china": "ASIA", "chinese": "ASIA", "japan": "ASIA", "japanese": "ASIA",
+        "korea": "ASIA", "korean": "ASIA", "taiwan": "ASIA", "taiwanese": "ASIA",
+        "hong kong": "ASIA", "india": "ASIA", "indian": "ASIA",
+        "u.s.": "US", "usa": "US", "united states": "US", "america": "US",
+        "american": "US", "wall street": "US", "europe": "EUROPE", "european": "EUROPE",
+        "eurozone": "EUROPE", "germany": "EUROPE", "france": "EUROPE",
+        "uk": "GB", "britain": "GB", "british": "GB", "united kingdom": "GB",
+    },
+    "asset_type": {
+        "stock": "equity", "stocks": "equity", "equities": "equity", "shares": "equity",
+        "etf": "etf", "etfs": "etf", "mutual fund": "mutualfund", "mutual funds": "mutualfund",
+        "bond": "bond", "bonds": "bond", "treasuries": "bond", "crypto": "cryptocurrency",
+        "cryptocurrency": "cryptocurrency", "forex": "currency", "fx": "currency",
+        "commodities": "commodity", "futures": "future", "options": "option",
+    },
+    "market": {
+        "nyse": "NYSE", "nasdaq exchange": "NASDAQ", "lse": "LSE", "tse": "TSE",
+        "tokyo stock exchange": "TSE", "hkex": "HKEX", "bursa": "BURSA",
+        "rates": "RATES", "commodities market": "COMMODITIES",
+        "currencies": "CURRENCIES", "crypto market": "CRYPTOCURRENCIES",
+    },
+    "currency": {
+        "usd": "USD", "dollar": "USD", "dollars": "USD", "eur": "EUR", "euro": "EUR",
+        "euros": "EUR", "gbp": "GBP", "pound": "GBP", "sterling": "GBP", "jpy": "JPY",
+        "yen": "JPY", "cny": "CNY", "yuan": "CNY", "renminbi": "CNY", "inr": "INR",
+        "rupee": "INR", "krw": "KRW", "twd": "TWD", "chf": "CHF",
+        "franc": "CHF", "hkd": "HKD", "aud": "AUD", "cad": "CAD",
+    },
+}
+
+# Upper-case words that look like tickers but usually aren't.
+_NON_TICKERS = {
+    "A", "I", "AI", "CEO", "CFO", "ETF", "ETFS", "IPO", "EPS", "GDP", "CPI", "FED",
+    "FOMC", "PE", "YOY", "QOQ", "USD", "EUR", "GBP", "JPY", "US", "UK", "EU", "IT",
+    "OK", "ESG", "M&A", "Q1", "Q2", "Q3", "Q4", "FY", "AM", "PM", "TODAY", "WHAT",
+}
+
+# Aliases that only count when written in this exact case ("US" vs "us").
+_CASE_SENSITIVE = {"US": ("region", "US"), "IT": ("sector", "technology")}
+
+# Ticker aliases that are also everyday words: they resolve only when
+# capitalized mid-sentence, written in upper case, or next to a finance cue.
+_AMBIGUOUS = {"arm", "sap", "visa", "shell", "meta", "oracle", "reliance", "uber"}
+_FINANCE_CUES = {"stock", "stocks", "share", "shares", "ticker", "earnings", "price", "$"}
+
+# Query vocabulary that never names an entity. Any other word the dictionary
+# doesn't match leaves the query unresolved.
+_STOPWORDS = {
+    "what", "whats", "what's", "how", "is", "are", "the", "a", "an", "our", "my", "in",
+    "on", "of", "for", "and", "or", "to", "today", "doing", "do", "does", "give", "me",
+    "tell", "about", "show", "latest", "news", "risk", "exposure", "any", "this", "week",
+    "quarter", "earnings", "price", "performance", "market", "markets", "update",
+    "brief", "morning", "should", "we", "i", "us", "vs", "versus", "compare", "with",
+    "can", "you", "please", "summary", "outlook", "from", "into", "at", "by",
+    # Function words.
+    "was", "were", "be", "been", "being", "has", "have", "had", "did", "will", "would",
+    "could", "it", "its", "their", "they", "them", "there", "these", "those", "that",
+    "which", "who", "why", "when", "where", "than", "then", "so", "if", "not", "no",
+    "all", "some", "more", "most", "less", "much", "many", "very", "just", "now", "up",
+    "down", "over", "under", "against", "between", "after", "before", "since", "during",
+    "here", "your", "get", "got", "see", "look", "looking", "like", "think", "know",
+    "need", "want", "let", "lets", "let's", "going", "happen", "happened", "happening",
+    # Time.
+    "yesterday", "tomorrow", "day", "days", "daily", "weekly", "month", "months",
+    "monthly", "year", "years", "annual", "ytd", "current", "currently", "recent",
+    "recently", "close", "closed", "open", "opened", "session", "overnight",
+    # Finance vocabulary.
+    "stock", "stocks", "share", "shares", "portfolio", "holdings", "holding", "position",
+    "positions", "allocation", "exposed", "returns", "return", "growth", "revenue",
+    "sales", "profit", "profits", "guidance", "results", "report", "reports", "analysis",
+    "analyst", "analysts", "rating", "ratings", "forecast", "forecasts", "valuation",
+    "dividend", "dividends", "volatility", "trend", "trends", "move", "moves", "moving",
+    "moved", "rally", "selloff", "sell-off", "drop", "dropped", "rise", "rose", "fall",
+    "fell", "gain", "gains", "loss", "losses", "high", "low", "buy", "sell", "hold",
+    "invest", "investing", "investment", "investments", "trading", "trade", "traded",
+    "performing", "performed", "outperforming", "underperforming", "surprise",
+    "surprises", "sector", "sectors", "industry", "index", "indices", "ticker",
+    "tickers", "company", "companies", "firm", "firms", "name", "names", "cap", "caps",
+    "top", "best", "worst", "big", "biggest", "large", "small", "key", "overview",
+    "highlights", "impact", "affect", "affected", "explain", "summarize", "summarise",
+    "convert", "rate", "exchange", "value", "worth", "estimate", "estimates",
+    "beat", "miss", "missed", "ceo", "cfo", "eps", "gdp", "cpi", "ipo", "etf", "pe",
+}
+
+_TOKEN_RE = re.compile(r"[\w&.^$'-]+")
+_SYMBOL_RE = re.compile(r"^\$?[A-Z]{1,5}(?:[.-][A-Z]{1,2})?$")
+
+LOCAL_CONFIDENCE_THRESHOLD = float(os.getenv("ENTITY_LOCAL_CONFIDENCE", "0.8"))
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "4096"))
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", re.sub(r"[?!,;:\"]+", " ", (query or "").lower())).strip().rstrip(".")
+
+
+def _tokens(text):
+    tokens = []
+    for t in _TOKEN_RE.findall(text):
+        t = re.sub(r"'s$", "", t)
+        tokens.append(t.strip(".'-") or t)
+    return tokens
+
+
+class EntityIndex:
+    def __init__(self, dictionary=None):
+        self._root = {}
+        self.symbols = set()
+        self.add_dictionary(dictionary or DEFAULT_DICTIONARY)
+        path = os.getenv("ENTITY_DICTIONARY_PATH")
+        if dictionary is None and path and os.path.exists(path):
+            with open(path) as f:
+                self.add_dictionary(json.load(f))
+
+    def add_dictionary(self, dictionary):
+        for field, aliases in dictionary.items():
+            for alias, value in aliases.items():
+                self.add(alias, field, value)
+            if field == "ticker":
+                self.symbols.update(v.upper() for v in aliases.values())
+
+    def add(self, alias, field, value):
+        node = self._root
+        for token in _tokens(alias.lower()):
+            node = node.setdefault(token, {})
+        node.setdefault("\0", []).append((field, value))
+
+    def _longest_match(self, tokens, start):
+        node, match, end = self._root, None, start
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            if "\0" in node:
+                match, end = node["\0"], i + 1
+        return match, end
+
+    @staticmethod
+    def _cued(raw_tokens, tokens, i, end):
+        # An ambiguous alias at tokens[i:end] reads as a company name.
+        raw = raw_tokens[i]
+        if raw.isupper() or (i > 0 and raw[:1].isupper()):
+            return True
+        neighbours = tokens[max(i - 1, 0):i] + tokens[end:end + 1]
+        return any(t in _FINANCE_CUES for t in neighbours)
+
+    def extract(self, query):
+        raw_tokens = _tokens(query or "")
+        tokens = [t.lower() for t in raw_tokens]
+        found = {field: [] for field in ENTITY_FIELDS}
+        currencies = []
+        unknown = []
+        i = 0
+        while i < len(tokens):
+            match, end = self._longest_match(tokens, i)
+            raw = raw_tokens[i]
+            symbol = raw.lstrip("$").upper()
+            explicit_symbol = raw.startswith("$") or (
+                _SYMBOL_RE.match(raw) and raw.isupper() and symbol not in _NON_TICKERS
+            )
+            if explicit_symbol and (symbol in self.symbols or raw.startswith("$")):
+                found["ticker"].append(symbol)
+                i += 1
+                continue
+            if not match and raw in _CASE_SENSITIVE:
+                match, end = [_CASE_SENSITIVE[raw]], i + 1
+            if match and end == i + 1 and tokens[i] in _AMBIGUOUS and not self._cued(raw_tokens, tokens, i, end):
+                # "the arm of", "visa applications": maybe not the company;
+                # leave it to the LLM.
+                unknown.append(raw)
+                i += 1
+                continue
+            if match:
+                for field, value in match:
+                    if field == "currency":
+                        currencies.append(value)
+                    else:
+                        found[field].append(value)
+                i = end
+                continue
+            # Any other word may be an entity the dictionary is missing
+            # ("exposure to rivian", "Snowflake shares"), whatever its case
+            # or position. Numbers and single letters don't name one.
+            if explicit_symbol or (tokens[i] not in _STOPWORDS and len(tokens[i]) > 1
+                                   and any(c.isalpha() for c in tokens[i])):
+                unknown.append(raw)
+            i += 1
+
+        if len(currencies) >= 2:
+            found["from_currency"], found["to_currency"] = [currencies[0]], [currencies[1]]
+
+        result = {}
+        hits = 0
+        for field in ENTITY_FIELDS:
+            values = list(dict.fromkeys(found[field]))
+            hits += len(values)
+            result[field] = None if not values else values[0] if len(values) == 1 else values
+        if hits == 0:
+            confidence = 0.0
+        elif unknown:
+            confidence = 0.5
+        else:
+            confidence = 1.0
+        return result, confidence, unknown
+
+
+class EntityCache:
+    def __init__(self, max_entries=ENTITY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "local": 0, "llm": 0}
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return dict(self._entries[key])
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, key, entities, source):
+        with self._lock:
+            self._entries[key] = dict(entities)
+            self._entries.move_to_end(key)
+            self.counters[source] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return dict(
+                self.counters,
+                entries=len(self._entries),
+                hit_rate=round(self.counters["hits"] / lookups, 4) if lookups else 0.0,
+            )
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = EntityIndex()
+    return _index
+
+
+entity_cache = EntityCache()
@@ -1,21 +1,18 @@
+import os
 import re
 import json
 import logging
-import google.generativeai as genai
+from agents.entity_index import get_index, entity_cache, normalize_query, LOCAL_CONFIDENCE_THRESHOLD
+from agents.clients import gemini_model
+from agents.resilience import upstream, UpstreamUnavailable
 
 logger = logging.getLogger("language_agent")
 logger.setLevel(logging.INFO)
 
-def extract_entities(query, gemini_api_key):
-    if not gemini_api_key:
-        logger.error("GEMINI_API_KEY not provided.")
-        raise RuntimeError("GEMINI_API_KEY not provided.")
-    genai.configure(api_key=gemini_api_key)
-    from google.generativeai import GenerativeModel
-    gemini = GenerativeModel("gemini-1.5-flash")
-    prompt = f"""
-Extract the following entities from the user query for financial analysis:
-- ticker (list or str)
+# Queries sent to Gemini in one entity-extraction prompt by extract_entities_batch.
+ENTITY_BATCH_SIZE = int(os.getenv("ENTITY_BATCH_SIZE", "20"))
+
+_ENTITY_FIELDS = """- ticker (list or str)
 - index_name
 - sector
 - industry
@@ -23,12 +20,87 @@ Extract the following entities from the user query for financial analysis:
 - asset_type
 - market
 - from_currency
-- to_currency
+- to_currency"""
+
+def extract_entities(query, gemini_api_key):
+    # Cached result, then the local dictionary, then Gemini for anything the
+    # dictionary can't resolve confidently.
+    key = normalize_query(query)
+    cached = entity_cache.get(key)
+    if cached is not None:
+        logger.info("Entity cache hit for '%s'", key)
+        return cached
+    local, confidence, unknown = get_index().extract(query)
+    if confidence >= LOCAL_CONFIDENCE_THRESHOLD:
+        logger.info("Extracted entities locally (confidence %.2f): %s", confidence, local)
+        entity_cache.put(key, local, "local")
+        return local
+    logger.info("Local extraction confidence %.2f (unresolved: %s); falling back to Gemini", confidence, unknown)
+    try:
+        result = extract_entities_llm(query, gemini_api_key)
+    except UpstreamUnavailable as e:
+        # Degrade to the local result; it isn't cached, so the next request
+        # tries Gemini again.
+        logger.warning("Gemini unavailable for entity extraction (%s); using local result", e)
+        return local
+    if result:
+        entity_cache.put(key, result, "llm")
+    return result
+
+def extract_entities_batch(queries, gemini_api_key):
+    # extract_entities for many queries, with one Gemini call per
+    # ENTITY_BATCH_SIZE queries the cache and the local dictionary can't
+    # resolve. Returns one entities dict per query, in order.
+    keys = [normalize_query(q) for q in queries]
+    resolved = {}
+    unresolved = {}
+    for query, key in zip(queries, keys):
+        if key in resolved or key in unresolved:
+            continue
+        cached = entity_cache.get(key)
+        if cached is not None:
+            resolved[key] = cached
+            continue
+        local, confidence, _ = get_index().extract(query)
+        if confidence >= LOCAL_CONFIDENCE_THRESHOLD:
+            entity_cache.put(key, local, "local")
+            resolved[key] = local
+        else:
+            unresolved[key] = (query, local)
+    logger.info("Batch entity extraction: %d unique queries, %d resolved without Gemini",
+                len(resolved) + len(unresolved), len(resolved))
+    pending = list(unresolved.items())
+    for start in range(0, len(pending), ENTITY_BATCH_SIZE):
+        chunk = pending[start:start + ENTITY_BATCH_SIZE]
+        try:
+            results = extract_entities_llm_batch([query for _, (query, _) in chunk], gemini_api_key)
+        except UpstreamUnavailable as e:
+            logger.warning("Gemini unavailable for batch entity extraction (%s); using local results", e)
+            results = [None] * len(chunk)
+        for (key, (_, local)), result in zip(chunk, results):
+            if result:
+                entity_cache.put(key, result, "llm")
+                resolved[key] = result
+            else:
+                resolved[key] = local
+    return [resolved[key] for key in keys]
+
+def get_entity_cache_stats():
+    return entity_cache.stats()
+
+def extract_entities_llm(query, gemini_api_key):
+    if not gemini_api_key:
+        logger.error("GEMINI_API_KEY not provided.")
+        raise RuntimeError("GEMINI_API_KEY not provided.")
+    gemini = gemini_model(gemini_api_key)
+    prompt = f"""
+Extract the following entities from the user query for financial analysis:
+{_ENTITY_FIELDS}
 
 Return a JSON object with these fields (use null if not found).
 Query: "{query}"
 """
-    resp = gemini.generate_content(prompt)
+    resp = upstream("gemini").call(lambda: gemini.generate_content(prompt), key=gemini_api_key)
     try:
         match = re.search(r"\{.*\}", resp.text, re.DOTALL)
         result = json.loads(match.group(0)) if match else {}
@@ -37,3 +109,34 @@ Query: "{query}"
         logger.error("Failed to extract entities: %s", e)
         result = {}
     return result
+
+def extract_entities_llm_batch(queries, gemini_api_key):
+    # One prompt for several queries; returns a list aligned with queries,
+    # with None where the model's answer couldn't be matched up.
+    if not gemini_api_key:
+        logger.error("GEMINI_API_KEY not provided.")
+        raise RuntimeError("GEMINI_API_KEY not provided.")
+    gemini = gemini_model(gemini_api_key)
+    numbered = "\n".join(f'{i}. "{query}"' for i, query in enumerate(queries, 1))
+    prompt = f"""
+Extract the following entities from each numbered user query for financial analysis:
+{_ENTITY_FIELDS}
+
+Return a JSON array with one object per query, in the same order, each with these fields (use null if not found).
+Queries:
+{numbered}
+"""
+    resp = upstream("gemini").call(lambda: gemini.generate_content(prompt), key=gemini_api_key)
+    try:
+        match = re.search(r"\[.*\]", resp.text, re.DOTALL)
+        parsed = json.loads(match.group(0)) if match else []
+    except Exception as e:
+        logger.error("Failed to extract batch entities: %s", e)
+        parsed = []
+    if not isinstance(parsed, list) or len(parsed) != len(queries):
+        logger.error("Batch entity extraction returned %s results for %d queries",
+                     len(parsed) if isinstance(parsed, list) else "no", len(queries))
+        return [None] * len(queries)
+    results = [item if isinstance(item, dict) else None for item in parsed]
+    logger.info("Extracted entities for %d queries in one call", len(queries))
+    return results
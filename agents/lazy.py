@@ -0,0 +1,91 @@
+"""
+lazy.py
+
+Deferred imports for the heavy third-party packages (pandas, yfinance,
+Gemini, langchain, FAISS). lazy_import(name) returns a stand-in module that
+imports the real one the first time any of its attributes is used, so
+importing the app - and booting a new worker - doesn't pay for packages a
+request may not need yet.
+
+Every attribute access is forwarded to the real module, so patches applied
+to it after the fact are seen through the stand-in. The time spent on each
+deferred import is recorded for /health and the import profile benchmark;
+preload() imports everything registered so far (the warm-up hook uses it).
+"""
+
+import sys
+import time
+import logging
+import importlib
+import threading
+
+logger = logging.getLogger("lazy")
+logger.setLevel(logging.INFO)
+
+_modules = {}
+_load_times = {}
+_lock = threading.Lock()
+
+
+class LazyModule:
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_module = None
+
+    def _lazy_load(self):
+        module = self._lazy_module
+        if module is None:
+            # Always go through the import system, even when the module is
+            # already in sys.modules: another thread may still be running
+            # its first import, and import_module waits for that to finish
+            # where sys.modules would hand out the half-initialized module.
+            first = self._lazy_name not in sys.modules
+            start = time.perf_counter()
+            module = importlib.import_module(self._lazy_name)
+            elapsed = time.perf_counter() - start
+            if first:
+                with _lock:
+                    if self._lazy_name not in _load_times:
+                        _load_times[self._lazy_name] = elapsed
+                        logger.info("Imported %s on first use in %.0fms", self._lazy_name, elapsed * 1000)
+            self._lazy_module = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._lazy_load(), attr)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        state = "loaded" if self._lazy_module is not None else "not loaded"
+        return f"<lazy module '{self._lazy_name}' ({state})>"
+
+
+def lazy_import(name):
+    with _lock:
+        if name not in _modules:
+            _modules[name] = LazyModule(name)
+        return _modules[name]
+
+
+def preload(names=None):
+    # Import the given (default: every registered) module now; returns the
+    # seconds each one took, 0.0 for those already imported.
+    timings = {}
+    for name in names or list(_modules):
+        start = time.perf_counter()
+        lazy_import(name)._lazy_load()
+        timings[name] = round(time.perf_counter() - start, 4)
+    return timings
+
+
+def stats():
+    with _lock:
+        return {
+            name: {
+                "loaded": module._lazy_module is not None or name in sys.modules,
+                "import_ms": round(_load_times[name] * 1000, 1) if name in _load_times else None,
+            }
+            for name, module in sorted(_modules.items())
+        }
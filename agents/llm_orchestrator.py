@@ -1,7 +1,10 @@
 import re
 import json
 import logging
-import google.generativeai as genai
+import itertools
+from agents.prompt_compactor import compact_fetched_data, estimate_tokens, to_json
+from agents.clients import gemini_model
+from agents.resilience import upstream
 
 logger = logging.getLogger("llm_orchestrator")
 logger.setLevel(logging.INFO)
@@ -27,29 +30,106 @@ Instructions:
 - Return a JSON object with fields: "plan" (steps/agents used), "response" (final answer), and "logs" (your reasoning steps).
 """
 
-def llm_orchestrate(query, entities, fetched_data, gemini_api_key):
+class ResponseFieldStreamer:
+    # Incrementally decodes the "response" string of the JSON object Gemini
+    # is streaming back, so answer text can be forwarded as it is generated.
+    _START = re.compile(r'"response"\s*:\s*"')
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = None
+        self.done = False
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        if self.done:
+            return ""
+        if self.pos is None:
+            match = self._START.search(self.buffer)
+            if not match:
+                return ""
+            self.pos = match.end()
+        out = []
+        buf, i = self.buffer, self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if ch == '"':
+                self.done = True
+                i += 1
+                break
+            if ch == "\\":
+                if i + 1 >= len(buf):
+                    break
+                esc = buf[i + 1]
+                if esc == "u":
+                    if i + 6 > len(buf):
+                        break
+                    try:
+                        out.append(chr(int(buf[i + 2:i + 6], 16)))
+                    except ValueError:
+                        pass
+                    i += 6
+                    continue
+                out.append(self._ESCAPES.get(esc, esc))
+                i += 2
+                continue
+            out.append(ch)
+            i += 1
+        self.pos = i
+        return "".join(out)
+
+def _parse_result(text):
+    try:
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        result = json.loads(match.group(0)) if match else {"plan": [], "response": text.strip(), "logs": []}
+        logger.info("LLM orchestrator result: %s", result)
+    except Exception as e:
+        logger.error("LLM orchestrator parsing error: %s", e)
+        result = {"plan": [], "response": text.strip(), "logs": [f"LLM parsing error: {e}"]}
+    return result
+
+def _start_stream(gemini, prompt):
+    # Reads the first chunk here so throttling and connection errors (raised
+    # on first read) happen inside the retried call, before any token has
+    # reached the caller.
+    chunks = iter(gemini.generate_content(prompt, stream=True))
+    first = next(chunks, None)
+    return chunks if first is None else itertools.chain([first], chunks)
+
+def llm_orchestrate(query, entities, fetched_data, gemini_api_key, logs=None, token_budget=None, on_token=None):
     if not gemini_api_key:
         logger.error("GEMINI_API_KEY not provided.")
         raise RuntimeError("GEMINI_API_KEY not provided.")
-    genai.configure(api_key=gemini_api_key)
-    from google.generativeai import GenerativeModel
-    gemini = GenerativeModel("gemini-1.5-flash")
+    gemini = gemini_model(gemini_api_key)
+    compact_data = to_json(compact_fetched_data(fetched_data, token_budget))
     user_prompt = f"""
 User query: {query}
 Extracted entities: {entities}
-Fetched data (if any): {fetched_data}
+Fetched data (if any): {compact_data}
 Please:
 1. Output a JSON object with a "plan" field (list of agents to use and in which order, with parameters), and a "response" field (the final answer to the user).
 2. Output a "logs" field summarizing which agents you used and why, including fallback to web search if needed.
 3. If structured data is missing, synthesize a confident, informative answer from the latest news headlines and summaries. Do not mention any lack of data, API failure, or suggest the user look elsewhere in your answer. Do not use placeholders or bracketed text. Do not hedge or express uncertainty. Always answer as if you are the expert and this is the best available synthesis.
 """
     full_prompt = SYSTEM_PROMPT.strip() + "\n\n" + user_prompt.strip()
-    response = gemini.generate_content(full_prompt)
-    try:
-        match = re.search(r"\{.*\}", response.text, re.DOTALL)
-        result = json.loads(match.group(0)) if match else {"plan": [], "response": response.text.strip(), "logs": []}
-        logger.info("LLM orchestrator result: %s", result)
-    except Exception as e:
-        logger.error("LLM orchestrator parsing error: %s", e)
-        result = {"plan": [], "response": response.text.strip(), "logs": [f"LLM parsing error: {e}"]}
-    return result
+    prompt_tokens = estimate_tokens(full_prompt)
+    logger.info("Prompt size: ~%d tokens (%d chars, fetched data %d chars)", prompt_tokens, len(full_prompt), len(compact_data))
+    if logs is not None:
+        logs.append(f"Prompt size: ~{prompt_tokens} tokens ({len(full_prompt)} chars, fetched data {len(compact_data)} chars)")
+    # Throttling (429) and an open circuit raise UpstreamUnavailable rather
+    # than reaching the JSON parser.
+    gemini_upstream = upstream("gemini")
+    if on_token is None:
+        response = gemini_upstream.call(lambda: gemini.generate_content(full_prompt), key=gemini_api_key)
+        return _parse_result(response.text)
+    # Streaming: forward the answer text as it arrives.
+    streamer = ResponseFieldStreamer()
+    chunks = []
+    for chunk in gemini_upstream.call(lambda: _start_stream(gemini, full_prompt), key=gemini_api_key):
+        text = chunk.text
+        chunks.append(text)
+        delta = streamer.feed(text)
+        if delta:
+            on_token(delta)
+    return _parse_result("".join(chunks))
@@ -0,0 +1,235 @@
+"""
+prompt_compactor.py
+
+Shrinks orchestrate's fetched_data to fit a token budget before it is put in
+the Gemini prompt. Intraday history is summarized into OHLC/VWAP/return stats,
+company info is reduced to a whitelist of useful fields, DataFrames are cut to
+their top rows and news to the fields an analyst reads. The budget is split
+fairly across entities: small entities keep what they need and the remainder
+is shared among the large ones, which are compacted harder until they fit.
+"""
+
+import os
+import json
+import math
+import logging
+
+logger = logging.getLogger("prompt_compactor")
+logger.setLevel(logging.INFO)
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+
+INFO_FIELDS = (
+    "symbol", "shortName", "longName", "quoteType", "exchange", "currency",
+    "sector", "industry", "country", "marketCap", "regularMarketPrice",
+    "previousClose", "open", "dayLow", "dayHigh", "fiftyTwoWeekLow",
+    "fiftyTwoWeekHigh", "fiftyDayAverage", "twoHundredDayAverage", "volume",
+    "averageVolume", "trailingPE", "forwardPE", "trailingEps", "forwardEps",
+    "priceToBook", "dividendYield", "beta", "profitMargins", "revenueGrowth",
+    "earningsGrowth", "recommendationKey", "targetMeanPrice",
+    "numberOfAnalystOpinions",
+)
+
+NEWS_FIELDS = ("title", "publisher", "providerPublishTime", "pubDate", "summary", "link", "relatedTickers")
+
+# Progressively harsher limits: (rows, list items, string chars)
+_LEVELS = [(10, 10, 400), (5, 6, 200), (3, 4, 120), (1, 2, 80), (0, 1, 40)]
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English text and JSON.
+    return len(text) // 4 + 1
+
+
+def to_json(value):
+    return json.dumps(value, default=str, separators=(",", ":"), ensure_ascii=False)
+
+
+def to_plain(value):
+    # JSON-safe copy of fetched_data for API responses: frames become column
+    # lists, arrays lists, NumPy scalars plain numbers, NaN null and
+    # timestamps strings.
+    if _is_frame(value):
+        return to_plain({str(c): v for c, v in value.reset_index().to_dict("list").items()})
+    if isinstance(value, dict):
+        return {str(k): to_plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_plain(v) for v in value]
+    if hasattr(value, "tolist") and hasattr(value, "dtype"):
+        if value.dtype.kind == "M":
+            return to_plain(value.astype(str).tolist())
+        return to_plain(value.tolist())
+    if isinstance(value, float):
+        return None if math.isnan(value) or math.isinf(value) else value
+    if value is None or isinstance(value, (str, int, bool)):
+        return value
+    return str(value)
+
+
+def _is_frame(value):
+    return hasattr(value, "to_dict") and hasattr(value, "columns") and hasattr(value, "head")
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(value) else value
+
+
+def _history_columns(history):
+    if _is_frame(history):
+        frame = history.reset_index()
+        return {str(c): frame[c].tolist() for c in frame.columns}
+    if isinstance(history, dict):
+        return {k: list(v) for k, v in history.items() if hasattr(v, "__len__") and not isinstance(v, str)}
+    if isinstance(history, list) and history and isinstance(history[0], dict):
+        return {k: [row.get(k) for row in history] for k in history[0]}
+    return {}
+
+
+def summarize_history(history):
+    columns = _history_columns(history)
+    closes = [_number(v) for v in columns.get("Close", [])]
+    if not any(c is not None for c in closes):
+        return {}
+    opens = [_number(v) for v in columns.get("Open", closes)]
+    highs = [_number(v) for v in columns.get("High", closes)]
+    lows = [_number(v) for v in columns.get("Low", closes)]
+    volumes = [_number(v) or 0.0 for v in columns.get("Volume", [0.0] * len(closes))]
+    rows = [i for i, c in enumerate(closes) if c is not None]
+    first, last = rows[0], rows[-1]
+    open_price = opens[first] if opens[first] is not None else closes[first]
+
+    turnover = volume_total = 0.0
+    for i in rows:
+        high = highs[i] if highs[i] is not None else closes[i]
+        low = lows[i] if lows[i] is not None else closes[i]
+        turnover += (high + low + closes[i]) / 3 * volumes[i]
+        volume_total += volumes[i]
+
+    times = next((columns[k] for k in ("Datetime", "Date", "index") if k in columns), [])
+    summary = {
+        "bars": len(rows),
+        "open": round(open_price, 4),
+        "high": round(max(h for h in (highs[i] for i in rows) if h is not None), 4),
+        "low": round(min(lo for lo in (lows[i] for i in rows) if lo is not None), 4),
+        "close": round(closes[last], 4),
+        "volume": volume_total,
+        "vwap": round(turnover / volume_total, 4) if volume_total else None,
+        "return_pct": round((closes[last] / open_price - 1) * 100, 3) if open_price else None,
+    }
+    if len(times):
+        summary["start"] = str(times[first])
+        summary["end"] = str(times[last])
+    return summary
+
+
+def _compact_value(value, level, key=None):
+    rows, items, chars = _LEVELS[level]
+    if key == "history":
+        return summarize_history(value)
+    if key == "info" and isinstance(value, dict):
+        return {k: value[k] for k in INFO_FIELDS if value.get(k) is not None}
+    if _is_frame(value):
+        if rows == 0:
+            return {"rows": len(value)}
+        return [_compact_value(r, level) for r in value.head(rows).reset_index().to_dict("records")]
+    if key == "news" and isinstance(value, list):
+        return [_compact_news(n, chars) for n in value[: max(items, 1) * 2]]
+    if isinstance(value, dict):
+        return {k: _compact_value(v, level, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_compact_value(v, level) for v in list(value)[:items]]
+    if isinstance(value, str) and len(value) > chars:
+        return value[:chars] + "…"
+    if isinstance(value, float):
+        return None if math.isnan(value) else round(value, 6)
+    return value
+
+
+def _compact_news(item, chars):
+    if not isinstance(item, dict):
+        return item
+    content = item.get("content") if isinstance(item.get("content"), dict) else item
+    out = {}
+    for field in NEWS_FIELDS:
+        value = item.get(field, content.get(field))
+        if value:
+            out[field] = value[:chars] + "…" if isinstance(value, str) and len(value) > chars else value
+    if "link" not in out:
+        url = (content.get("canonicalUrl") or {}).get("url")
+        if url:
+            out["link"] = url
+    if "publisher" not in out and isinstance(content.get("provider"), dict):
+        out["publisher"] = content["provider"].get("displayName")
+    return out
+
+
+def _split_units(fetched_data):
+    # One unit per entity: each ticker (single, listed or batched), each
+    # sector/industry/market block, and the merged news list.
+    units = []
+    for key, value in fetched_data.items():
+        if key == "ticker_data" and isinstance(value, dict):
+            if "history" in value and "symbols" in value:
+                for sym in value["symbols"]:
+                    history = value["history"]
+                    history = history.get(sym) if isinstance(history, dict) else history[sym] if _is_frame(history) else None
+                    units.append((("ticker_data", sym), {
+                        "latest_price": value.get("latest_price", {}).get(sym),
+                        "info": value.get("info", {}).get(sym, {}),
+                        "history": history,
+                    }))
+            elif "info" in value or "history" in value:
+                units.append((("ticker_data",), value))
+            else:
+                for sym, data in value.items():
+                    units.append((("ticker_data", sym), data))
+        else:
+            units.append(((key,), value))
+    return units
+
+
+def _fit(value, budget, key):
+    for level in range(len(_LEVELS)):
+        compact = _compact_value(value, level, key)
+        text = to_json(compact)
+        if estimate_tokens(text) <= budget:
+            return compact
+    limit = max(budget * 4, 16)
+    return text[:limit] + "…" if len(text) > limit else compact
+
+
+def compact_fetched_data(fetched_data, token_budget=None):
+    token_budget = PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    units = _split_units(fetched_data or {})
+    if not units:
+        return {}
+
+    # Water-fill the budget: smallest units first, each capped at a fair
+    # share of what remains so large units can't starve the others.
+    first_pass = {path: _compact_value(value, 0, path[-1] if path[0] != "ticker_data" else None)
+                  for path, value in units}
+    sizes = {path: estimate_tokens(to_json(c)) for path, c in first_pass.items()}
+    remaining = token_budget
+    allocation = {}
+    order = sorted(units, key=lambda u: sizes[u[0]])
+    for i, (path, _) in enumerate(order):
+        share = remaining // (len(order) - i)
+        allocation[path] = min(sizes[path], share)
+        remaining -= allocation[path]
+
+    compacted = {}
+    for path, value in units:
+        key = path[-1] if path[0] != "ticker_data" else None
+        if sizes[path] <= allocation[path]:
+            compact = first_pass[path]
+        else:
+            compact = _fit(value, allocation[path], key)
+        if len(path) == 1:
+            compacted[path[0]] = compact
+        else:
+            compacted.setdefault(path[0], {})[path[1]] = compact
+    return compacted
@@ -0,0 +1,400 @@
+"""
+resilience.py
+
+Scheduling layer in front of the upstream services (Yahoo, Gemini,
+ElevenLabs). Every call goes through an Upstream, which combines:
+
+- token-bucket rate limits for the service as a whole and per API key. The
+  service-wide rate adapts: a throttling response (HTTP 429, quota
+  exhausted) halves it, and it creeps back up while calls succeed;
+- retries with full-jitter exponential backoff for throttling and transient
+  errors, bounded per call (RETRY_MAX_ATTEMPTS) and across calls by a retry
+  budget, so retries can add at most RETRY_BUDGET_RATIO extra load when an
+  upstream is struggling;
+- a circuit breaker that opens after BREAKER_FAILURES consecutive failed
+  calls and then fails fast for BREAKER_RESET_SECONDS before letting one
+  probe call through.
+
+Calls that can't be made - circuit open, no rate-limit token within
+RATE_LIMIT_MAX_WAIT, or still throttled after retries - raise
+UpstreamUnavailable, so callers can serve cached or degraded data instead of
+queueing behind a sick upstream. Other errors are re-raised unchanged.
+
+Per-upstream settings are read from <NAME>_RATE / <NAME>_BURST (service-wide,
+requests per second; 0 = unlimited until throttled) and <NAME>_KEY_RATE /
+<NAME>_KEY_BURST (per API key).
+"""
+
+import os
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger("resilience")
+logger.setLevel(logging.INFO)
+
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))
+# Retries always allowed per window, so a quiet upstream can still retry.
+RETRY_BUDGET_MIN = int(os.getenv("RETRY_BUDGET_MIN", "3"))
+RETRY_BUDGET_WINDOW = float(os.getenv("RETRY_BUDGET_WINDOW", "10"))
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "2"))
+# Adaptive rate: factor applied on throttling, floor, and how often (seconds
+# without throttling) the rate is raised again by RATE_RECOVERY_FACTOR.
+RATE_THROTTLE_FACTOR = 0.5
+RATE_MIN = float(os.getenv("RATE_MIN", "0.5"))
+RATE_RECOVERY_INTERVAL = float(os.getenv("RATE_RECOVERY_INTERVAL", "5"))
+RATE_RECOVERY_FACTOR = 1.25
+
+DEFAULT_LIMITS = {
+    # name: (rate, burst, key_rate, key_burst)
+    "yahoo": (20, 40, 0, 0),
+    "gemini": (0, 0, 0, 0),
+    "elevenlabs": (0, 0, 0, 0),
+}
+
+_TRANSIENT_ERRORS = {
+    "ConnectionError", "TimeoutError", "Timeout", "ReadTimeout", "ConnectTimeout", "DeadlineExceeded",
+    "ServiceUnavailable", "InternalServerError", "BadGateway", "GatewayTimeout", "ServerError",
+}
+_THROTTLE_ERRORS = {"TooManyRequests", "ResourceExhausted", "YFRateLimitError"}
+
+
+class UpstreamUnavailable(RuntimeError):
+    def __init__(self, upstream, reason, retry_after=None):
+        # reason: "circuit_open", "rate_limited" or "throttled".
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+        detail = {
+            "circuit_open": "is failing; not calling it for now",
+            "rate_limited": "is at its request rate limit",
+            "throttled": "is throttling requests",
+        }[reason]
+        super().__init__(f"{upstream} {detail}" + (f" (retry in {retry_after:.0f}s)" if retry_after else ""))
+
+
+def status_code(error):
+    response = getattr(error, "response", None)
+    for value in (getattr(error, "status_code", None), getattr(error, "code", None),
+                  getattr(response, "status_code", None)):
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def _error_names(error):
+    return {cls.__name__ for cls in type(error).__mro__}
+
+
+def is_throttle(error):
+    if status_code(error) == 429 or _error_names(error) & _THROTTLE_ERRORS:
+        return True
+    text = str(error)
+    return "Too Many Requests" in text or "Rate limited" in text
+
+
+def is_transient(error):
+    status = status_code(error)
+    return (status is not None and status >= 500) or bool(_error_names(error) & _TRANSIENT_ERRORS)
+
+
+def retry_after(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    # rate tokens per second up to burst (default: two seconds' worth); rate
+    # None means unlimited.
+    def __init__(self, rate, burst=None):
+        self.rate = rate or None
+        self.max_burst = burst or None
+        self.burst = self._burst_for(self.rate)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _burst_for(self, rate):
+        burst = max(1, int((rate or 0) * 2))
+        return min(burst, self.max_burst) if self.max_burst else burst
+
+    def _refill(self, now):
+        if self.rate is None:
+            self.tokens = float(self.burst)
+        else:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            self.burst = self._burst_for(rate)
+            self.tokens = min(self.tokens, self.burst)
+
+    def acquire(self, timeout):
+        # True once a token is taken; False if none frees up within timeout.
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.rate is None:
+                    return True
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class RetryBudget:
+    # Retries in the last window may not exceed minimum + ratio x calls.
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, minimum=RETRY_BUDGET_MIN, window=RETRY_BUDGET_WINDOW):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.window = window
+        self._calls = deque()
+        self._retries = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        for events in (self._calls, self._retries):
+            while events and now - events[0] > self.window:
+                events.popleft()
+
+    def record_call(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._calls.append(now)
+
+    def try_retry(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            if len(self._retries) >= self.minimum + self.ratio * len(self._calls):
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    def __init__(self, failures=BREAKER_FAILURES, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_in(self):
+        with self._lock:
+            if self.state != "open":
+                return None
+            return max(self.reset_seconds - (time.monotonic() - self.opened_at), 0)
+
+    def release(self):
+        # The allowed call was never made.
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    logger.warning("Circuit opened after %d consecutive failures", self.failures)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class Upstream:
+    def __init__(self, name, rate=0, burst=0, key_rate=0, key_burst=0, max_attempts=RETRY_MAX_ATTEMPTS,
+                 budget=None, breaker=None):
+        self.name = name
+        self.ceiling = rate or None
+        self.bucket = TokenBucket(rate, burst)
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.max_attempts = max_attempts
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self._key_buckets = {}
+        self._recent = deque(maxlen=1024)
+        self._adjusted_at = 0.0
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "retries": 0, "failures": 0, "throttled": 0, "short_circuited": 0,
+                         "rate_limited": 0, "retry_budget_exhausted": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _key_bucket(self, key):
+        if not key or not self.key_rate:
+            return None
+        # Keys are held hashed; they never appear in stats.
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        with self._lock:
+            if digest not in self._key_buckets:
+                self._key_buckets[digest] = TokenBucket(self.key_rate, self.key_burst)
+            return self._key_buckets[digest]
+
+    def _acquire(self, key):
+        key_bucket = self._key_bucket(key)
+        if not self.bucket.acquire(RATE_LIMIT_MAX_WAIT) or (key_bucket and not key_bucket.acquire(RATE_LIMIT_MAX_WAIT)):
+            self._count("rate_limited")
+            raise UpstreamUnavailable(self.name, "rate_limited")
+        with self._lock:
+            self._recent.append(time.monotonic())
+
+    def _observed_rate(self):
+        now = time.monotonic()
+        with self._lock:
+            recent = sum(1 for t in self._recent if now - t <= RATE_RECOVERY_INTERVAL)
+        return recent / RATE_RECOVERY_INTERVAL
+
+    def _slow_down(self):
+        # At most one decrease per second: concurrent calls tend to be
+        # throttled together, and one signal shouldn't count many times.
+        if time.monotonic() - self._adjusted_at < 1:
+            return
+        current = self.bucket.rate or max(self._observed_rate(), RATE_MIN)
+        rate = max(current * RATE_THROTTLE_FACTOR, RATE_MIN)
+        self.bucket.set_rate(rate)
+        self._adjusted_at = time.monotonic()
+        logger.warning("%s is throttling; limiting to %.1f requests/s", self.name, rate)
+
+    def _speed_up(self):
+        rate = self.bucket.rate
+        if rate is None or rate == self.ceiling or time.monotonic() - self._adjusted_at < RATE_RECOVERY_INTERVAL:
+            return
+        rate *= RATE_RECOVERY_FACTOR
+        if self.ceiling is not None:
+            rate = min(rate, self.ceiling)
+        elif rate >= self._observed_rate() * 2:
+            # Comfortably above demand again: lift the limit.
+            rate = None
+        self.bucket.set_rate(rate)
+        self._adjusted_at = time.monotonic()
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        hinted = retry_after(error)
+        return delay if hinted is None else max(delay, hinted)
+
+    def call(self, fn, key=None):
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise UpstreamUnavailable(self.name, "circuit_open", self.breaker.retry_in())
+        attempt = 0
+        while True:
+            try:
+                self._acquire(key)
+            except UpstreamUnavailable:
+                self.breaker.release()
+                raise
+            self._count("calls")
+            self.budget.record_call()
+            try:
+                result = fn()
+            except UpstreamUnavailable:
+                # From a nested call to another upstream.
+                self.breaker.release()
+                raise
+            except Exception as e:
+                throttled = is_throttle(e)
+                if not throttled and not is_transient(e):
+                    # The upstream answered; the request itself was bad.
+                    self.breaker.success()
+                    raise
+                self._count("failures")
+                if throttled:
+                    self._count("throttled")
+                    self._slow_down()
+                delay = self._backoff(attempt, e)
+                retry = attempt + 1 < self.max_attempts and delay <= RETRY_MAX_DELAY
+                if retry and not self.budget.try_retry():
+                    self._count("retry_budget_exhausted")
+                    retry = False
+                if not retry:
+                    self.breaker.failure()
+                    if throttled:
+                        raise UpstreamUnavailable(self.name, "throttled", retry_after(e)) from e
+                    raise
+                logger.info("%s call failed (%s); retry %d in %.2fs", self.name, e, attempt + 1, delay)
+                self._count("retries")
+                attempt += 1
+                time.sleep(delay)
+                continue
+            self.breaker.success()
+            self._speed_up()
+            return result
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            keys = len(self._key_buckets)
+        return dict(counters, state=self.breaker.state, consecutive_failures=self.breaker.failures,
+                    rate=self.bucket.rate, ceiling=self.ceiling, api_keys=keys)
+
+
+def _limits(name):
+    rate, burst, key_rate, key_burst = DEFAULT_LIMITS.get(name, (0, 0, 0, 0))
+    prefix = name.upper()
+    return dict(
+        rate=float(os.getenv(f"{prefix}_RATE", rate)),
+        burst=int(os.getenv(f"{prefix}_BURST", burst)),
+        key_rate=float(os.getenv(f"{prefix}_KEY_RATE", key_rate)),
+        key_burst=int(os.getenv(f"{prefix}_KEY_BURST", key_burst)),
+    )
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def upstream(name):
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, **_limits(name))
+        return _upstreams[name]
+
+
+def stats():
+    with _upstreams_lock:
+        upstreams = dict(_upstreams)
+    return {name: u.stats() for name, u in sorted(upstreams.items())}
@@ -1,31 +1,252 @@
-from langchain.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.schema import Document
+from agents.embedding_cache import CachedEmbeddings, content_hash
+from agents.clients import KeyedClients
+from agents.resilience import upstream
+from agents import ann_index
+from agents.ann_index import IndexConfig
+from agents.lazy import lazy_import
+from datetime import datetime
 import os
-from dotenv import load_dotenv
-load_dotenv()
+import pickle
+import logging
+
+# langchain's FAISS wrapper and the Gemini embeddings client take seconds to
+# import; they load on first use.
+faiss = lazy_import("faiss")
+vectorstores = lazy_import("langchain_community.vectorstores")
+docstores = lazy_import("langchain_community.docstore.in_memory")
+google_genai = lazy_import("langchain_google_genai")
+
+logger = logging.getLogger("retriever_agent")
+logger.setLevel(logging.INFO)
+
+VECTOR_STORE_DIR = os.getenv("VECTOR_STORE_DIR")
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.pkl"
+
+# One cached Gemini embeddings client per recently used API key, shared by
+# every store and by anything else that needs query vectors. Calls go
+# through the "gemini" upstream, so they share its limits and breaker with
+# generate_content.
+_embeddings = KeyedClients(lambda api_key: CachedEmbeddings(google_genai.GoogleGenerativeAIEmbeddings(
+    google_api_key=api_key,
+    model="models/embedding-001"
+), upstream=upstream("gemini"), api_key=api_key))
+
+def get_embeddings(api_key=None):
+    if api_key is None:
+        api_key = os.getenv("GEMINI_API_KEY")
+    return _embeddings.get(api_key)
+
+def doc_id(doc):
+    # Explicit IDs win; otherwise identical content maps to the same ID so
+    # re-adding an article is a no-op.
+    return str(doc.get("id") or content_hash(doc["content"], "doc"))
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def _as_set(value):
+    if value is None:
+        return None
+    values = value if isinstance(value, (list, tuple, set)) else [value]
+    return {str(v).upper() for v in values if v}
 
 class VectorStore:
-    def __init__(self, api_key=None):
-        # Use env var if not passed
-        if api_key is None:
-            api_key = os.getenv("GEMINI_API_KEY")
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            google_api_key=api_key,
-            model="models/embedding-001"
-        )
+    def __init__(self, api_key=None, persist_dir=None, embeddings=None, index_config=None):
+        self.embeddings = get_embeddings(api_key) if embeddings is None else CachedEmbeddings(embeddings)
+        self.index_config = index_config or IndexConfig()
+        self.persist_dir = persist_dir or VECTOR_STORE_DIR
         self.vector_store = None
+        self._mmapped = False
+        if self.persist_dir and os.path.exists(os.path.join(self.persist_dir, INDEX_FILE)):
+            self.load()
 
     def create_vector_store(self, docs):
-        # docs: list of dicts with 'content' and 'meta'
-        langchain_docs = [
-            Document(page_content=doc['content'], metadata=doc.get('meta', {}))
-            for doc in docs
-        ]
-        self.vector_store = FAISS.from_documents(langchain_docs, self.embeddings)
+        # docs: list of dicts with 'content', optional 'meta' and 'id'
+        self.vector_store = None
+        self._mmapped = False
+        self.add_documents(docs)
         return self.vector_store
 
-    def retrieve_info(self, query, k=3):
+    def __len__(self):
+        return len(self.vector_store.index_to_docstore_id) if self.vector_store else 0
+
+    def has(self, doc_ids):
+        if not self.vector_store:
+            return set()
+        return set(doc_ids) & set(self.vector_store.index_to_docstore_id.values())
+
+    def _new_index(self, vectors):
+        # Indexes that need training start out flat until there are enough
+        # vectors to train them on (see _maybe_upgrade).
+        index = self.index_config.build_trained(vectors)
+        if index is None:
+            index = IndexConfig("flat", pq_m=0).build(len(vectors[0]))
+        return index
+
+    def _maybe_upgrade(self):
+        index = self.vector_store.index
+        config = self.index_config
+        if config.index_type == "flat" and not config.pq_m:
+            return
+        if not isinstance(faiss.downcast_index(index), faiss.IndexFlat) or index.ntotal < config.min_train_size():
+            return
+        vectors = index.reconstruct_n(0, index.ntotal)
+        upgraded = config.build_trained(vectors)
+        upgraded.add(vectors)
+        self.vector_store.index = upgraded
+        logger.info("Rebuilt flat index as %r with %d vectors", config, upgraded.ntotal)
+
+    def add_documents(self, docs):
+        # Only documents whose ID isn't already indexed are embedded and added.
+        ids, texts, metadatas, seen = [], [], [], self.has(doc_id(d) for d in docs)
+        for doc in docs:
+            did = doc_id(doc)
+            if did in seen:
+                continue
+            seen.add(did)
+            ids.append(did)
+            texts.append(doc["content"])
+            metadatas.append(doc.get("meta", {}))
+        if not texts:
+            return []
+        vectors = self.embeddings.embed_documents(texts)
+        if self.vector_store is None:
+            self.vector_store = vectorstores.FAISS(self.embeddings, self._new_index(vectors),
+                                                   docstores.InMemoryDocstore(), {})
+        else:
+            self._ensure_writable()
+        self.vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas, ids=ids)
+        self._maybe_upgrade()
+        logger.info("Indexed %d new documents (%d total)", len(texts), len(self))
+        return ids
+
+    def delete(self, doc_ids):
+        present = self.has(doc_ids)
+        if not present:
+            return 0
+        self._ensure_writable()
+        store = self.vector_store
+        positions = [pos for pos, did in store.index_to_docstore_id.items() if did in present]
+        store.index = ann_index.remove_ids(store.index, positions)
+        store.docstore.delete(list(present))
+        remaining = [did for _, did in sorted(store.index_to_docstore_id.items()) if did not in present]
+        store.index_to_docstore_id = dict(enumerate(remaining))
+        return len(present)
+
+    def delete_matching(self, tickers=None, start=None, end=None):
+        # Delete every document whose metadata matches the filters (see
+        # _filter_positions), e.g. end=cutoff to expire old articles.
+        if not self.vector_store:
+            return 0
+        id_map = self.vector_store.index_to_docstore_id
+        return self.delete([id_map[pos] for pos in self._filter_positions(tickers, start, end)])
+
+    def save(self, persist_dir=None):
+        persist_dir = persist_dir or self.persist_dir
+        if not persist_dir or not self.vector_store:
+            return
+        os.makedirs(persist_dir, exist_ok=True)
+        # Write both files under temporary names first so a crash never
+        # leaves a half-written index next to a mismatched docstore.
+        index_path = os.path.join(persist_dir, INDEX_FILE)
+        docstore_path = os.path.join(persist_dir, DOCSTORE_FILE)
+        faiss.write_index(self.vector_store.index, index_path + ".tmp")
+        with open(docstore_path + ".tmp", "wb") as f:
+            pickle.dump((self.vector_store.docstore._dict, self.vector_store.index_to_docstore_id), f)
+        os.replace(index_path + ".tmp", index_path)
+        os.replace(docstore_path + ".tmp", docstore_path)
+        logger.info("Saved vector store (%d documents) to %s", len(self), persist_dir)
+
+    def load(self, persist_dir=None, mmap=True):
+        persist_dir = persist_dir or self.persist_dir
+        index_path = os.path.join(persist_dir, INDEX_FILE)
+        index = None
+        if mmap:
+            # Map the vectors from disk instead of reading them into memory;
+            # a writable copy is only loaded if the store is later modified.
+            try:
+                index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            except (AttributeError, RuntimeError):
+                try:
+                    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                except RuntimeError:
+                    index = None
+        self._mmapped = index is not None
+        if index is None:
+            index = faiss.read_index(index_path)
+        self.index_config.apply_search_params(index)
+        with open(os.path.join(persist_dir, DOCSTORE_FILE), "rb") as f:
+            docs, index_to_docstore_id = pickle.load(f)
+        self.vector_store = vectorstores.FAISS(self.embeddings, index, docstores.InMemoryDocstore(docs), index_to_docstore_id)
+        self.persist_dir = persist_dir
+        logger.info("Loaded vector store (%d documents, %s, mmap=%s) from %s",
+                    len(self), ann_index.index_kind(index), self._mmapped, persist_dir)
+        return self.vector_store
+
+    def _ensure_writable(self):
+        if self._mmapped:
+            index = faiss.read_index(os.path.join(self.persist_dir, INDEX_FILE))
+            self.index_config.apply_search_params(index)
+            self.vector_store.index = index
+            self._mmapped = False
+
+    def _filter_positions(self, tickers=None, start=None, end=None, ids=None):
+        # Index positions whose document metadata passes every given filter.
+        # Tickers match the 'tickers' (or 'ticker') metadata field; start/end
+        # bound the 'published' field and accept epoch seconds, ISO strings
+        # or datetimes.
+        tickers, ids = _as_set(tickers), set(ids) if ids is not None else None
+        start, end = _timestamp(start), _timestamp(end)
+        docstore = self.vector_store.docstore
+        positions = []
+        for pos, did in self.vector_store.index_to_docstore_id.items():
+            if ids is not None and did not in ids:
+                continue
+            meta = docstore.search(did).metadata
+            if tickers is not None and not tickers & (_as_set(meta.get("tickers") or meta.get("ticker")) or set()):
+                continue
+            if start is not None or end is not None:
+                published = _timestamp(meta.get("published"))
+                if published is None or (start is not None and published < start) \
+                        or (end is not None and published > end):
+                    continue
+            positions.append(pos)
+        return positions
+
+    def retrieve_many(self, queries, k=3, tickers=None, start=None, end=None, ids=None, with_scores=False):
+        # Embeds all queries in one batch and searches them as a single
+        # matrix. Filters are applied before the nearest-neighbour search, so
+        # each query still gets up to k matching documents.
         if not self.vector_store:
             raise ValueError("Vector store not initialized. Call create_vector_store first.")
-        return self.vector_store.similarity_search(query, k=k)
+        if not queries:
+            return []
+        allowed = None
+        if tickers is not None or start is not None or end is not None or ids is not None:
+            allowed = self._filter_positions(tickers, start, end, ids)
+        vectors = self.embeddings.embed_queries(list(queries))
+        distances, positions = ann_index.search(self.vector_store.index, vectors, k, self.index_config, allowed)
+        results = []
+        for row_d, row_p in zip(distances, positions):
+            hits = []
+            for dist, pos in zip(row_d, row_p):
+                if pos < 0:
+                    continue
+                doc = self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[int(pos)])
+                hits.append((doc, float(dist)) if with_scores else doc)
+            results.append(hits)
+        return results
+
+    def retrieve_info(self, query, k=3, **filters):
+        return self.retrieve_many([query], k=k, **filters)[0]
@@ -0,0 +1,227 @@
+"""
+risk_engine.py
+
+Vectorized portfolio exposure and risk. Takes a holdings table and a price
+matrix (rows = dates, columns = symbols) and computes, in one pass of matrix
+operations with no per-position Python loops:
+
+- market value, weight and exposure by region and sector, plus the exposure
+  of an optional region/sector selection
+- day-over-day change per position, per group and for the portfolio
+- annualized volatility, beta and correlation to a benchmark and to the
+  portfolio
+- historical and parametric value-at-risk
+- correlations between groups, and each position's risk contribution
+
+Work is O(dates x positions), so it scales linearly with the number of
+positions; a full position-by-position correlation matrix (quadratic) is
+never built.
+
+Holdings are a table with a `symbol` column, `quantity` and/or
+`market_value`, and optional `sector` and `region` columns. Region values
+should use the same codes the entity extractor produces (US, ASIA, EUROPE,
+...). They are read from PORTFOLIO_HOLDINGS_PATH (CSV, JSON or Parquet).
+"""
+
+import os
+import math
+import logging
+from statistics import NormalDist
+from agents.lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger("risk_engine")
+logger.setLevel(logging.INFO)
+
+PORTFOLIO_HOLDINGS_PATH = os.getenv("PORTFOLIO_HOLDINGS_PATH")
+RISK_CONFIDENCE = float(os.getenv("RISK_CONFIDENCE", "0.95"))
+RISK_BENCHMARK = os.getenv("RISK_BENCHMARK", "^GSPC")
+TRADING_DAYS = 252
+
+_holdings_cache = {}
+
+
+def load_holdings(path=None):
+    # Holdings table, re-read only when the file changes; None if not set.
+    path = path or PORTFOLIO_HOLDINGS_PATH
+    if not path:
+        return None
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError as e:
+        logger.error("Portfolio holdings unavailable at %s: %s", path, e)
+        return None
+    cached = _holdings_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    if path.endswith(".json"):
+        holdings = pd.read_json(path)
+    elif path.endswith(".parquet"):
+        holdings = pd.read_parquet(path)
+    else:
+        holdings = pd.read_csv(path)
+    holdings = normalize_holdings(holdings)
+    _holdings_cache[path] = (mtime, holdings)
+    logger.info("Loaded %d holdings from %s", len(holdings), path)
+    return holdings
+
+
+def normalize_holdings(holdings):
+    holdings = holdings.rename(columns=lambda c: str(c).strip().lower())
+    if "symbol" not in holdings or not ({"quantity", "market_value"} & set(holdings.columns)):
+        raise ValueError("Holdings need a symbol column and a quantity or market_value column")
+    holdings = holdings.copy()
+    holdings["symbol"] = holdings["symbol"].astype(str).str.strip().str.upper()
+    for column in ("sector", "region"):
+        if column not in holdings:
+            holdings[column] = "UNKNOWN"
+        holdings[column] = holdings[column].fillna("UNKNOWN").astype(str).str.strip()
+    return holdings.reset_index(drop=True)
+
+
+def _matches(values, wanted):
+    # Case-insensitive match of a column against one or more wanted values,
+    # ignoring '-'/'_'/' ' differences ("financial-services" == "Financial Services").
+    if wanted is None:
+        return np.ones(len(values), dtype=bool)
+    wanted = wanted if isinstance(wanted, (list, tuple, set)) else [wanted]
+    norm = lambda s: s.str.upper().str.replace(r"[-_ ]+", " ", regex=True)
+    keys = norm(pd.Series([str(w) for w in wanted if w]))
+    return norm(pd.Series(values)).isin(set(keys)).to_numpy()
+
+
+def _pct(value):
+    if value is None or not np.isfinite(value):
+        return None
+    return round(float(value) * 100, 4)
+
+
+def _num(value, digits=4):
+    if value is None or not np.isfinite(value):
+        return None
+    return round(float(value), digits)
+
+
+def _series_stats(returns, value, z, confidence):
+    # Stats for one return series (portfolio, selection or group).
+    if len(returns) < 2:
+        return {"change_percent": _pct(returns[-1]) if len(returns) else None}
+    daily_vol = returns.std(ddof=1)
+    return {
+        "change_percent": _pct(returns[-1]),
+        "volatility_percent": _pct(daily_vol * math.sqrt(TRADING_DAYS)),
+        "var_historical": _num(-np.quantile(returns, 1 - confidence) * value, 2),
+        "var_parametric": _num(z * daily_vol * value, 2),
+    }
+
+
+def compute_risk(holdings, prices, benchmark=None, sector=None, region=None, confidence=None,
+                 group_by=("region", "sector"), top_n=5, positions=False):
+    confidence = RISK_CONFIDENCE if confidence is None else confidence
+    holdings = normalize_holdings(holdings)
+    symbols = holdings["symbol"].to_numpy()
+    matrix = prices.reindex(columns=symbols).sort_index().ffill()
+    P = matrix.to_numpy(dtype=np.float64)                              # T x N
+    if P.shape[0] < 2:
+        raise ValueError("Need at least two price rows to compute changes")
+
+    last = P[-1]
+    if "quantity" in holdings:
+        values = holdings["quantity"].to_numpy(dtype=np.float64) * last
+        if "market_value" in holdings:
+            values = np.where(np.isfinite(values), values, holdings["market_value"].to_numpy(dtype=np.float64))
+    else:
+        values = holdings["market_value"].to_numpy(dtype=np.float64)
+    values = np.nan_to_num(values)
+    total = values.sum()
+    if total == 0:
+        raise ValueError("Portfolio has no priced positions")
+    w = values / total
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R = np.nan_to_num(P[1:] / P[:-1] - 1.0, nan=0.0, posinf=0.0, neginf=0.0)   # (T-1) x N
+    port = R @ w
+    Rc = R - R.mean(axis=0)
+    pc = port - port.mean()
+    n = max(len(port) - 1, 1)
+    ss = np.sqrt((Rc ** 2).sum(axis=0))
+    pos_vol = ss / math.sqrt(n) * math.sqrt(TRADING_DAYS)
+    cov_port = Rc.T @ pc / n
+    var_port = pc @ pc / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr_port = (Rc.T @ pc) / (ss * math.sqrt(pc @ pc))
+        contribution = w * cov_port / var_port if var_port else np.zeros_like(w)
+
+    z = NormalDist().inv_cdf(confidence)
+    result = {
+        "total_value": _num(total, 2),
+        "positions": int(len(symbols)),
+        "observations": int(len(port)),
+        "confidence": confidence,
+        "portfolio": _series_stats(port, total, z, confidence),
+    }
+
+    beta = corr_bench = None
+    if benchmark is not None:
+        b = benchmark.reindex(matrix.index).ffill().to_numpy(dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            b = np.nan_to_num(b[1:] / b[:-1] - 1.0, nan=0.0, posinf=0.0, neginf=0.0)
+        bc = b - b.mean()
+        bb = bc @ bc
+        if bb:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                beta = Rc.T @ bc / bb
+                corr_bench = (Rc.T @ bc) / (ss * math.sqrt(bb))
+            result["portfolio"]["beta"] = _num(w @ np.nan_to_num(beta))
+            result["portfolio"]["benchmark_correlation"] = _num((pc @ bc) / math.sqrt((pc @ pc) * bb)) if pc @ pc else None
+
+    mask = _matches(holdings["sector"], sector) & _matches(holdings["region"], region)
+    selected = float(w[mask].sum())
+    result["selection"] = {"sector": sector, "region": region, "exposure_percent": _pct(selected)}
+    if selected:
+        sw = np.where(mask, w, 0.0) / selected
+        sel_stats = _series_stats(R @ sw, selected * total, z, confidence)
+        if beta is not None:
+            sel_stats["beta"] = _num(sw @ np.nan_to_num(beta))
+        result["selection"].update(sel_stats)
+
+    for column in group_by:
+        codes, names = pd.factorize(holdings[column].str.upper())
+        G = np.zeros((len(w), len(names)))
+        G[np.arange(len(w)), codes] = w                                   # N x groups
+        exposure = G.sum(axis=0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            group_returns = np.nan_to_num(R @ G / exposure)               # (T-1) x groups
+        groups = {}
+        for j, name in enumerate(names):
+            groups[name] = {"exposure_percent": _pct(exposure[j]),
+                            **_series_stats(group_returns[:, j], exposure[j] * total, z, confidence)}
+        result[f"by_{column}"] = groups
+        if len(names) > 1 and len(port) > 1:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                corr = np.corrcoef(group_returns, rowvar=False)
+            result[f"{column}_correlation"] = {
+                a: {b: _num(corr[i, k]) for k, b in enumerate(names)} for i, a in enumerate(names)
+            }
+
+    top = np.argsort(-np.nan_to_num(contribution))[:top_n]
+    result["top_risk_contributors"] = [
+        {"symbol": symbols[i], "weight_percent": _pct(w[i]), "risk_contribution_percent": _pct(contribution[i])}
+        for i in top
+    ]
+
+    if positions:
+        frame = holdings.copy()
+        frame["price"] = last
+        frame["market_value"] = values
+        frame["weight"] = w
+        frame["change"] = R[-1]
+        frame["volatility"] = pos_vol
+        frame["portfolio_correlation"] = corr_port
+        frame["risk_contribution"] = contribution
+        if beta is not None:
+            frame["beta"] = beta
+            frame["benchmark_correlation"] = corr_bench
+        result["position_metrics"] = frame
+    return result
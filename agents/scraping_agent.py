@@ -1,12 +1,22 @@
+import os
+import re
+import json
+import time
 import logging
-import yfinance as yf
+from datetime import datetime
+from agents.cache import yahoo_cache
+from agents.lazy import lazy_import
+yf = lazy_import("yfinance")
 
 logger = logging.getLogger("scraping_agent")
 logger.setLevel(logging.INFO)
 
+NEWS_TOP_N = int(os.getenv("NEWS_TOP_N", "15"))
+NEWS_HALF_LIFE_HOURS = float(os.getenv("NEWS_HALF_LIFE_HOURS", "24"))
+
 def get_news(query, count=10, logs=None):
     try:
-        news = yf.Search(query, news_count=count).news
+        news = yahoo_cache.get_or_load("news", (query, count), lambda: yf.Search(query, news_count=count).news)
         logger.info("Fetched news for '%s' (scraping_agent)", query)
         if logs is not None:
             logs.append(f"Fetched news for '{query}' (scraping_agent)")
@@ -16,3 +26,85 @@ def get_news(query, count=10, logs=None):
         if logs is not None:
             logs.append(f"Failed to fetch news for '{query}': {e}")
         return []
+
+def _parse_time(value):
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            return None
+    return None
+
+def _news_fields(item):
+    # yfinance has returned both a flat layout (uuid/title/link/
+    # providerPublishTime) and a nested one under "content"; accept either.
+    content = item.get("content") if isinstance(item.get("content"), dict) else item
+    link = item.get("link") or (content.get("canonicalUrl") or {}).get("url") \
+        or (content.get("clickThroughUrl") or {}).get("url")
+    return {
+        "uuid": item.get("uuid") or item.get("id") or content.get("id"),
+        "link": link.split("?")[0] if link else None,
+        "title": content.get("title") or "",
+        "published": _parse_time(item.get("providerPublishTime") or content.get("pubDate")),
+        "tickers": [t.upper() for t in item.get("relatedTickers") or []],
+    }
+
+def _normalize_title(title):
+    return re.sub(r"[^a-z0-9]+", " ", title.lower()).strip()
+
+def _entity_terms(entities):
+    terms = set()
+    for field in ("ticker", "sector", "industry", "region", "index_name", "market"):
+        value = (entities or {}).get(field)
+        for v in value if isinstance(value, (list, tuple, set)) else [value]:
+            if v:
+                terms.add(str(v).lower())
+    return terms
+
+def merge_news(news, entities=None, top_n=None, logs=None):
+    top_n = NEWS_TOP_N if top_n is None else top_n
+    terms = _entity_terms(entities)
+    now = time.time()
+
+    merged = {}
+    aliases = {}
+    for item in news or []:
+        if not isinstance(item, dict):
+            continue
+        fields = _news_fields(item)
+        keys = [k for k in (
+            ("uuid", fields["uuid"]), ("link", fields["link"]), ("title", _normalize_title(fields["title"])),
+        ) if k[1]]
+        existing = next((aliases[k] for k in keys if k in aliases), None)
+        if existing is None:
+            existing = len(merged)
+            merged[existing] = {"item": item, "fields": fields, "seen": 0}
+        merged[existing]["seen"] += 1
+        for k in keys:
+            aliases.setdefault(k, existing)
+
+    def score(entry):
+        fields = entry["fields"]
+        recency = 0.0
+        if fields["published"]:
+            age_hours = max(now - fields["published"], 0) / 3600
+            recency = 0.5 ** (age_hours / NEWS_HALF_LIFE_HOURS)
+        title = fields["title"].lower()
+        matches = sum(1 for term in terms if term.upper() in fields["tickers"] or term in title)
+        return recency + 0.5 * matches + 0.25 * (entry["seen"] - 1)
+
+    ranked = sorted(merged.values(), key=score, reverse=True)
+    kept = [entry["item"] for entry in ranked[:top_n]]
+
+    bytes_in = len(json.dumps(news or [], default=str))
+    bytes_out = len(json.dumps(kept, default=str))
+    duplicates = len(news or []) - len(merged)
+    capped = len(merged) - len(kept)
+    logger.info("News merge: kept %d of %d items (%d duplicates, %d over cap), saved %d bytes",
+                len(kept), len(news or []), duplicates, capped, bytes_in - bytes_out)
+    if logs is not None:
+        logs.append(f"News merge: kept {len(kept)} of {len(news or [])} items "
+                    f"({duplicates} duplicates, {capped} over cap), saved {bytes_in - bytes_out} bytes")
+    return kept
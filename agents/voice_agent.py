@@ -1,39 +1,167 @@
-import requests
+import os
+import re
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agents.audio_cache import tts_cache, audio_key, TTS_CACHE_ENABLED
+from agents.clients import http_session, HTTP_TIMEOUT
+from agents.resilience import upstream
+
+logger = logging.getLogger("voice_agent")
+logger.setLevel(logging.INFO)
+
+# Overridable so the agent can be pointed at a local stand-in server.
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io").rstrip("/")
+TTS_MODEL_ID = "eleven_multilingual_v2"
+TTS_OUTPUT_FORMAT = "mp3_44100_128"
+TTS_VOICE_SETTINGS = {
+    "stability": 0.5,
+    "similarity_boost": 0.7
+}
+TTS_PIPELINE_WINDOW = int(os.getenv("TTS_PIPELINE_WINDOW", "3"))
+TTS_MIN_SENTENCE_CHARS = int(os.getenv("TTS_MIN_SENTENCE_CHARS", "40"))
+
+_tts_pool = ThreadPoolExecutor(max_workers=max(TTS_PIPELINE_WINDOW * 4, 4), thread_name_prefix="tts")
+
+def _post(url, elevenlabs_api_key, **kwargs):
+    # Throttling and server errors raise, so the upstream layer retries them
+    # and counts them against the circuit; other error responses come back
+    # for the caller to report.
+    def send():
+        response = http_session().post(url, timeout=HTTP_TIMEOUT, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            response.raise_for_status()
+        return response
+    return upstream("elevenlabs").call(send, key=elevenlabs_api_key)
 
 def speech_to_text(audio_bytes, elevenlabs_api_key):
     if not elevenlabs_api_key:
-        print("ELEVENLABS_API_KEY not provided.")
+        logger.error("ELEVENLABS_API_KEY not provided.")
         return ""
-    url = "https://api.elevenlabs.io/v1/speech-to-text"
+    url = f"{ELEVENLABS_BASE_URL}/v1/speech-to-text"
     headers = {"xi-api-key": elevenlabs_api_key}
     data = {"model_id": "scribe_v1"}
     files = {"file": ("voice_query.wav", audio_bytes, "audio/wav")}
-    response = requests.post(url, headers=headers, data=data, files=files)
-    print("STT API response:", response.status_code, response.text)  # For debugging
+    try:
+        response = _post(url, elevenlabs_api_key, headers=headers, data=data, files=files)
+    except Exception as e:
+        logger.error("STT request failed: %s", e)
+        return ""
     if response.status_code == 200:
         return response.json().get("text", "")
+    logger.error("STT API error %s: %s", response.status_code, response.text)
     return ""
 
-def text_to_speech(text, elevenlabs_api_key, voice_id="tnSpp4vdxKPjI9w0GnoV"):
+def tts_cache_key(text, voice_id, previous_text=None, next_text=None):
+    return audio_key(text, voice_id, TTS_MODEL_ID, TTS_VOICE_SETTINGS, TTS_OUTPUT_FORMAT,
+                     previous_text=previous_text, next_text=next_text)
+
+def is_tts_cached(text, voice_id, previous_text=None, next_text=None):
+    return TTS_CACHE_ENABLED and tts_cache.contains(tts_cache_key(text, voice_id, previous_text, next_text))
+
+def text_to_speech(text, elevenlabs_api_key, voice_id="tnSpp4vdxKPjI9w0GnoV", previous_text=None, next_text=None):
+    # previous_text/next_text are sent to ElevenLabs as prosody context, and
+    # so are part of the cache key: a sentence synthesized after one
+    # sentence is not served where it follows another.
     if not elevenlabs_api_key:
-        print("ELEVENLABS_API_KEY not provided.")
+        logger.error("ELEVENLABS_API_KEY not provided.")
         return None
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    key = tts_cache_key(text, voice_id, previous_text, next_text)
+    if TTS_CACHE_ENABLED:
+        cached = tts_cache.get(key)
+        if cached is not None:
+            return cached
+    url = f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{voice_id}"
     headers = {
         "xi-api-key": elevenlabs_api_key,
         "Content-Type": "application/json"
     }
     payload = {
         "text": text,
-        "model_id": "eleven_multilingual_v2",
-        "output_format": "mp3_44100_128",
-        "voice_settings": {
-            "stability": 0.5,
-            "similarity_boost": 0.7
-        }
+        "model_id": TTS_MODEL_ID,
+        "output_format": TTS_OUTPUT_FORMAT,
+        "voice_settings": TTS_VOICE_SETTINGS
     }
-    response = requests.post(url, headers=headers, json=payload)
+    # Context from neighbouring segments keeps intonation continuous when a
+    # response is synthesized sentence by sentence.
+    if previous_text:
+        payload["previous_text"] = previous_text
+    if next_text:
+        payload["next_text"] = next_text
+    try:
+        response = _post(url, elevenlabs_api_key, headers=headers, json=payload)
+    except Exception as e:
+        logger.error("TTS request failed: %s", e)
+        return None
     if response.status_code == 200:
+        if TTS_CACHE_ENABLED:
+            tts_cache.put(key, response.content)
         return response.content
-    print("TTS API response:", response.status_code, response.text)  # For debugging
+    logger.error("TTS API error %s: %s", response.status_code, response.text)
     return None
+
+class SentenceSplitter:
+    # Turns streamed text into sentences as soon as each one is complete.
+    # Very short sentences are held back and merged with the next so each
+    # TTS request carries a natural amount of speech.
+    _BOUNDARY = re.compile(r"(?<=[.!?])[\"')\]]*\s+")
+
+    def __init__(self, min_chars=TTS_MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in self._BOUNDARY.finditer(self.buffer):
+            candidate = self.buffer[start:match.end()].strip()
+            if len(candidate) >= self.min_chars:
+                sentences.append(candidate)
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+def split_sentences(text, min_chars=TTS_MIN_SENTENCE_CHARS):
+    splitter = SentenceSplitter(min_chars)
+    return splitter.feed(text) + splitter.flush()
+
+def text_to_speech_pipelined(sentences, elevenlabs_api_key, voice_id="tnSpp4vdxKPjI9w0GnoV", window=TTS_PIPELINE_WINDOW,
+                             synthesize=None):
+    # Synthesizes sentences concurrently, at most `window` in flight, and
+    # yields (seq, mp3_bytes) in order as soon as each segment is ready;
+    # mp3_bytes is None for a failed segment. `sentences` may be a lazy
+    # iterable fed while the LLM is still generating, so it is consumed on a
+    # feeder thread and never delays segments that are already done.
+    # synthesize defaults to text_to_speech and takes the same arguments.
+    synthesize = synthesize or text_to_speech
+    slots = threading.Semaphore(window)
+    submitted = queue.Queue()
+
+    def feed():
+        previous = None
+        try:
+            for seq, sentence in enumerate(sentences):
+                slots.acquire()
+                submitted.put((seq, _tts_pool.submit(synthesize, sentence, elevenlabs_api_key, voice_id, previous)))
+                previous = sentence
+        finally:
+            submitted.put(None)
+
+    threading.Thread(target=feed, name="tts-feed", daemon=True).start()
+    for seq, future in iter(submitted.get, None):
+        try:
+            audio = future.result()
+        except Exception as e:
+            logger.error("TTS segment failed: %s", e)
+            audio = None
+        slots.release()
+        yield seq, audio
+
+def get_tts_cache_stats():
+    return tts_cache.stats()
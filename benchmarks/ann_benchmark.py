@@ -0,0 +1,105 @@
+"""
+ann_benchmark.py
+
+Recall/latency/memory benchmark for the vector store's index modes
+(agents.ann_index). Builds each configured index over synthetic clustered
+vectors, then reports recall@k against exact flat search, single-query p50/p99
+latency, batched throughput, build time and serialized index size.
+
+Usage:
+    python -m benchmarks.ann_benchmark [--n 100000] [--dim 768] [--queries 500]
+        [--k 10] [--configs flat,ivf,hnsw,ivf+pq,hnsw+pq] [--nlist 1024]
+        [--nprobe 16] [--ef-search 64] [--pq-m 96]
+"""
+
+import time
+import argparse
+import numpy as np
+from agents.ann_index import IndexConfig, search, index_bytes
+
+
+def synthetic_vectors(n, dim, queries, clusters=256, seed=0):
+    # Gaussian blobs around random centres, closer to real embedding
+    # distributions than uniform noise; queries are drawn the same way.
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    def draw(count):
+        points = centres[rng.integers(0, clusters, count)]
+        return points + 0.3 * rng.standard_normal((count, dim)).astype(np.float32)
+    return draw(n), draw(queries)
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def recall_at_k(found, truth):
+    k = truth.shape[1]
+    hits = sum(len(set(f[f >= 0]) & set(t)) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def run_config(config, base, queries, k, truth):
+    start = time.perf_counter()
+    index = config.build_trained(base)
+    if index is None:
+        return {"index": repr(config), "skipped": f"needs {config.min_train_size()} vectors to train"}
+    index.add(base)
+    build_s = time.perf_counter() - start
+
+    timings = []
+    for q in queries:
+        start = time.perf_counter()
+        search(index, q[None, :], k, config)
+        timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    _, found = search(index, queries, k, config)
+    batch_s = time.perf_counter() - start
+
+    return {
+        "index": repr(config),
+        "recall@k": round(recall_at_k(found, truth), 4),
+        "p50_ms": round(_percentile(timings, 50) * 1e3, 3),
+        "p99_ms": round(_percentile(timings, 99) * 1e3, 3),
+        "batch_qps": round(len(queries) / batch_s, 1),
+        "build_s": round(build_s, 2),
+        "memory_mb": round(index_bytes(index) / 2 ** 20, 1),
+    }
+
+
+def _parse_config(name, args):
+    index_type, _, pq = name.partition("+")
+    return IndexConfig(index_type, nlist=args.nlist, nprobe=args.nprobe, hnsw_m=args.hnsw_m,
+                       ef_search=args.ef_search, pq_m=args.pq_m if pq else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="number of indexed vectors")
+    parser.add_argument("--dim", type=int, default=768, help="vector size (embedding-001 is 768)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--configs", default="flat,ivf,hnsw,ivf+pq,hnsw+pq",
+                        help="comma-separated index types, '+pq' adds product quantization")
+    parser.add_argument("--nlist", type=int, default=1024)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--pq-m", type=int, default=96, help="PQ sub-quantizers; must divide --dim")
+    args = parser.parse_args()
+
+    base, queries = synthetic_vectors(args.n, args.dim, args.queries)
+    exact = IndexConfig("flat", pq_m=0)
+    truth_index = exact.build(args.dim)
+    truth_index.add(base)
+    _, truth = search(truth_index, queries, args.k, exact)
+
+    print(f"n={args.n} dim={args.dim} queries={args.queries} k={args.k}")
+    for name in args.configs.split(","):
+        print(run_config(_parse_config(name.strip(), args), base, queries, args.k, truth))
+
+
+if __name__ == "__main__":
+    main()
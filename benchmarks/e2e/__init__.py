@@ -0,0 +1,5 @@
+"""
+Offline end-to-end benchmark: the full FastAPI pipeline driven under load
+with local stand-ins for Yahoo Finance, Gemini and ElevenLabs. See
+benchmarks.e2e.driver for usage.
+"""
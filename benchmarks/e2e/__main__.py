@@ -0,0 +1,4 @@
+from benchmarks.e2e.driver import main
+
+if __name__ == "__main__":
+    main()
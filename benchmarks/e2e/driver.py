@@ -0,0 +1,269 @@
+"""
+driver.py
+
+Load driver for the offline end-to-end benchmark. Starts the FastAPI app
+in-process (uvicorn on a local port) with Yahoo, Gemini and ElevenLabs
+replaced by the fakes in benchmarks.e2e.fakes, then drives /process-query/,
+/process-voice/ and (endpoint "batch", --batch-size queries per request)
+/process-batch/ at each concurrency level and reports throughput,
+p50/p95/p99 latency and a per-stage breakdown.
+
+Stages are timed by wrapping the agent entry points orchestrate calls
+(entity extraction, fetch, news retrieval, LLM, TTS, STT) plus every call
+into a fake, so the breakdown separates our own work from simulated service
+time. Caches live in a fresh temporary directory for each run; the response
+cache is bypassed unless --use-cache is given.
+
+Usage:
+    python -m benchmarks.e2e [--endpoints query,voice,batch] [--concurrency 1,4,16]
+        [--requests 40] [--warmup 4] [--batch-size 8] [--yahoo-latency lognormal:80,0.4]
+        [--gemini-latency lognormal:600,0.3] [--tts-latency lognormal:250,0.3]
+        [--save-baseline PATH] [--baseline PATH] [--tolerance 0.2]
+
+Latency specs are milliseconds: "50", "uniform:20,80", "normal:100,20" or
+"lognormal:MEDIAN,SIGMA". With --baseline, exits non-zero if any phase's
+latency percentiles rise (or throughput falls) by more than --tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.entity_extraction import LABELLED_QUERIES
+from benchmarks.e2e.fakes import FakeYahoo, FakeGemini, FakeElevenLabs, fake_audio
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+COMPARED = {"p50_ms": 1, "p95_ms": 1, "p99_ms": 1, "throughput_rps": -1}
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)] if ordered else None
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class StageRecorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(list)
+
+    def wrap(self, target, name, stage):
+        original = getattr(target, name)
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - start)
+
+        setattr(target, name, timed)
+
+    def summary(self):
+        with self._lock:
+            samples = dict(self.samples)
+        return {stage: {"count": len(values), "mean_ms": _ms(sum(values) / len(values)),
+                        "p50_ms": _ms(_percentile(values, 50)), "p95_ms": _ms(_percentile(values, 95))}
+                for stage, values in sorted(samples.items())}
+
+
+def _isolate_caches(root):
+    # Fresh on-disk caches for this run, set before the app is imported.
+    for name, path in (("HISTORY_STORE_DIR", "history"), ("TTS_CACHE_DIR", "tts"),
+                       ("EMBEDDING_CACHE_PATH", "embeddings.sqlite3"), ("EARNINGS_SCREENER_PATH", "earnings.pkl"),
+                       ("JOBS_DB_PATH", "jobs.sqlite3"), ("ARTIFACT_DIR", "artifacts")):
+        os.environ[name] = os.path.join(root, path)
+    os.environ["VECTOR_STORE_DIR"] = ""
+
+
+def _instrument(recorder):
+    from agents import api_agent, llm_orchestrator, voice_agent
+    from orchestrator import fetch_stage, news_rag, main
+    recorder.wrap(api_agent, "extract_market_entities", "entities")
+    recorder.wrap(api_agent, "extract_market_entities_batch", "entities")
+    recorder.wrap(fetch_stage, "fetch_all", "fetch")
+    recorder.wrap(news_rag, "select_news", "news_rag")
+    recorder.wrap(llm_orchestrator, "llm_orchestrate", "llm")
+    recorder.wrap(voice_agent, "text_to_speech", "tts")
+    recorder.wrap(main, "speech_to_text", "stt")
+
+
+def _start_server(app):
+    import uvicorn
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="uvicorn", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def _request(session, base_url, endpoint, query, use_cache, audio_bytes):
+    form = {"gemini_api_key": "bench", "elevenlabs_api_key": "bench", "use_cache": str(use_cache).lower()}
+    start = time.perf_counter()
+    if endpoint == "batch":
+        response = session.post(f"{base_url}/process-batch/", data={**form, "queries": json.dumps(query)})
+        elapsed = time.perf_counter() - start
+        return elapsed, response.status_code == 200 and all(r["audio_url"] for r in response.json()["results"])
+    if endpoint == "voice":
+        response = session.post(f"{base_url}/process-voice/", data=form,
+                                files={"audio": ("query.wav", fake_audio(query, audio_bytes), "audio/wav")})
+    else:
+        response = session.post(f"{base_url}/process-query/", data={**form, "query": query})
+    elapsed = time.perf_counter() - start
+    return elapsed, response.status_code == 200 and bool(response.json().get("audio_url"))
+
+
+def run_phase(base_url, endpoint, concurrency, requests_count, recorder, use_cache=False, audio_bytes=16000,
+              batch_size=8):
+    import requests
+    queries = [q for q, _ in LABELLED_QUERIES]
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        try:
+            if endpoint == "batch":
+                query = [queries[(i * batch_size + j) % len(queries)] for j in range(batch_size)]
+            else:
+                query = queries[i % len(queries)]
+            return _request(local.session, base_url, endpoint, query, use_cache, audio_bytes)
+        except Exception:
+            return None, False
+
+    recorder.reset()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(requests_count)))
+    wall = time.perf_counter() - start
+    latencies = [elapsed for elapsed, ok in outcomes if ok]
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": requests_count,
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "mean_ms": _ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": _ms(_percentile(latencies, 50)),
+        "p95_ms": _ms(_percentile(latencies, 95)),
+        "p99_ms": _ms(_percentile(latencies, 99)),
+        "stages": recorder.summary(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Lines describing each compared metric; the second value is True if
+    # anything regressed beyond tolerance.
+    previous = {(p["endpoint"], p["concurrency"]): p for p in baseline.get("phases", [])}
+    lines, regressed = [], False
+    if baseline.get("config") != results["config"]:
+        lines.append("note: baseline was recorded with a different configuration")
+    for phase in results["phases"]:
+        old = previous.get((phase["endpoint"], phase["concurrency"]))
+        if old is None:
+            continue
+        for metric, direction in COMPARED.items():
+            if not old.get(metric) or phase.get(metric) is None:
+                continue
+            change = (phase[metric] - old[metric]) / old[metric]
+            bad = change * direction > tolerance
+            regressed |= bad
+            lines.append(f"{phase['endpoint']:>5} c={phase['concurrency']:<3} {metric:<15} "
+                         f"{old[metric]:>9} -> {phase[metric]:>9} ({change:+.1%}){'  REGRESSION' if bad else ''}")
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default="query,voice")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=40, help="requests per phase")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--use-cache", action="store_true", help="let repeated queries hit the response cache")
+    parser.add_argument("--yahoo-latency", default="lognormal:80,0.4")
+    parser.add_argument("--gemini-latency", default="lognormal:600,0.3", help="time to first chunk")
+    parser.add_argument("--gemini-chunk-latency", default="const:15")
+    parser.add_argument("--embed-latency", default="lognormal:60,0.3")
+    parser.add_argument("--stt-latency", default="lognormal:300,0.3")
+    parser.add_argument("--tts-latency", default="lognormal:250,0.3")
+    parser.add_argument("--bars", type=int, default=390, help="bars per history download")
+    parser.add_argument("--news-items", type=int, default=10)
+    parser.add_argument("--news-chars", type=int, default=600)
+    parser.add_argument("--answer-sentences", type=int, default=6)
+    parser.add_argument("--audio-bytes", type=int, default=16000, help="size of each voice upload")
+    parser.add_argument("--batch-size", type=int, default=8, help="queries per /process-batch/ request")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--save-baseline", nargs="?", const=DEFAULT_BASELINE, help="save results as the baseline")
+    parser.add_argument("--baseline", nargs="?", const=DEFAULT_BASELINE, help="compare against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output", "save_baseline", "baseline", "tolerance")}
+    if "batch" not in args.endpoints.split(","):
+        config.pop("batch_size")
+    recorder = StageRecorder()
+    with tempfile.TemporaryDirectory(prefix="e2e-bench-") as root:
+        _isolate_caches(root)
+        fakes = [
+            FakeYahoo(args.yahoo_latency, bars=args.bars, news_items=args.news_items, news_chars=args.news_chars,
+                      recorder=recorder).install(),
+            FakeGemini(args.gemini_latency, chunk_latency=args.gemini_chunk_latency, embed_latency=args.embed_latency,
+                       answer_sentences=args.answer_sentences, recorder=recorder).install(),
+            FakeElevenLabs(args.stt_latency, args.tts_latency, recorder=recorder).install(),
+        ]
+        from orchestrator.main import app
+        _instrument(recorder)
+        server, base_url = _start_server(app)
+        try:
+            phases = []
+            for endpoint in args.endpoints.split(","):
+                if args.warmup:
+                    run_phase(base_url, endpoint, 1, args.warmup, recorder, args.use_cache, args.audio_bytes,
+                              args.batch_size)
+                for concurrency in (int(c) for c in args.concurrency.split(",")):
+                    phase = run_phase(base_url, endpoint, concurrency, args.requests, recorder,
+                                      args.use_cache, args.audio_bytes, args.batch_size)
+                    phases.append(phase)
+                    print({k: v for k, v in phase.items() if k != "stages"})
+                    for stage, stats in phase["stages"].items():
+                        print(f"    {stage:<18} n={stats['count']:<5} mean={stats['mean_ms']:>8}ms "
+                              f"p50={stats['p50_ms']:>8}ms p95={stats['p95_ms']:>8}ms")
+        finally:
+            server.should_exit = True
+            for fake in reversed(fakes):
+                fake.uninstall()
+
+    results = {"config": config, "phases": phases}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            lines, regressed = compare(results, json.load(f), args.tolerance)
+        print("\n".join(lines))
+        if regressed:
+            sys.exit(1)
@@ -0,0 +1,404 @@
+"""
+fakes.py
+
+In-process stand-ins for the services orchestrate talks to, so the whole
+pipeline can be exercised without network access:
+
+- FakeYahoo patches the yfinance classes the agents use (Ticker, Sector,
+  Industry, Market, Search, download) with generators of synthetic data.
+- FakeGemini patches google.generativeai.GenerativeModel (entity extraction
+  and the streamed JSON answer) and the langchain_google_genai embeddings
+  client agents.retriever_agent builds.
+- FakeElevenLabs is a local HTTP server implementing the speech-to-text and
+  text-to-speech endpoints voice_agent calls; voice_agent is pointed at it
+  through ELEVENLABS_BASE_URL.
+
+Every fake sleeps for a delay drawn from a Latency model and reports each
+call to an optional recorder (any object with record(stage, seconds)).
+Payload sizes are configurable so prompt, compaction and audio handling see
+realistic volumes.
+"""
+
+import re
+import json
+import time
+import zlib
+import itertools
+import threading
+import numpy as np
+import pandas as pd
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+AUDIO_MARKER = b"FAKEWAV:"
+
+_WORDS = ("revenue guidance margin demand outlook shares analysts quarter growth supply chips cloud "
+          "orders rates inflation yields earnings buyback capex inventory pricing exports").split()
+
+
+class Latency:
+    # Delay model parsed from a spec, in milliseconds:
+    #   "50" or "const:50", "uniform:20,80", "normal:100,20",
+    #   "lognormal:120,0.5" (median, sigma of the underlying normal).
+    def __init__(self, spec="0", seed=0):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(":")
+        if not params:
+            kind, params = "const", kind
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",")]
+        if kind not in ("const", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency model: {spec}")
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        with self._lock:
+            if self.kind == "const":
+                ms = self.params[0]
+            elif self.kind == "uniform":
+                ms = self._rng.uniform(*self.params[:2])
+            elif self.kind == "normal":
+                ms = self._rng.normal(*self.params[:2])
+            else:
+                ms = self.params[0] * np.exp(self._rng.normal(0, self.params[1]))
+        return max(float(ms), 0.0) / 1000
+
+    def sleep(self):
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    def __repr__(self):
+        return self.spec
+
+
+def _seed(*parts):
+    return zlib.crc32("|".join(str(p) for p in parts).encode())
+
+
+def _text(rng, chars):
+    words = []
+    while sum(len(w) + 1 for w in words) < chars:
+        words.append(_WORDS[rng.integers(len(_WORDS))])
+    return " ".join(words)[:chars]
+
+
+class _Fake:
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self._patches = []
+
+    def _call(self, stage, latency):
+        start = time.perf_counter()
+        latency.sleep()
+        if self.recorder is not None:
+            self.recorder.record(stage, time.perf_counter() - start)
+
+    def _patch(self, target, name, value):
+        self._patches.append((target, name, getattr(target, name, None)))
+        setattr(target, name, value)
+
+    def uninstall(self):
+        for target, name, original in reversed(self._patches):
+            setattr(target, name, original)
+        self._patches = []
+
+
+class FakeYahoo(_Fake):
+    def __init__(self, latency="lognormal:80,0.4", bars=390, news_items=10, news_chars=600, recorder=None):
+        super().__init__(recorder)
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency, seed=1)
+        self.bars = bars
+        self.news_items = news_items
+        self.news_chars = news_chars
+
+    def install(self):
+        import yfinance as yf
+        fake = self
+
+        class Ticker:
+            def __init__(self, symbol, *args, **kwargs):
+                self.ticker = str(symbol).upper()
+
+            @property
+            def info(self):
+                fake._call("yahoo.info", fake.latency)
+                return fake.info(self.ticker)
+
+            @property
+            def news(self):
+                fake._call("yahoo.ticker_news", fake.latency)
+                return fake.news(self.ticker, fake.news_items)
+
+            def history(self, period=None, interval="1m", start=None, end=None, **kwargs):
+                fake._call("yahoo.history", fake.latency)
+                return fake.history(self.ticker, interval, start)
+
+            def get_earnings_history(self):
+                fake._call("yahoo.earnings", fake.latency)
+                return fake.earnings(self.ticker)
+
+        class Sector:
+            def __init__(self, key, *args, **kwargs):
+                fake._call("yahoo.sector", fake.latency)
+                self.key = key
+                self.overview = {"name": key, "companies_count": 50, "market_weight": 0.1,
+                                 "description": _text(np.random.default_rng(_seed(key)), fake.news_chars)}
+                self.top_etfs = {f"{key[:3].upper()}ETF{i}": f"{key} ETF {i}" for i in range(5)}
+                self.top_mutual_funds = {f"{key[:3].upper()}MF{i}": f"{key} fund {i}" for i in range(5)}
+                self.industries = pd.DataFrame(
+                    {"name": [f"{key} industry {i}" for i in range(5)], "symbol": None,
+                     "market weight": [0.2] * 5},
+                    index=pd.Index([f"{key}-industry-{i}" for i in range(5)], name="key"))
+                self.top_companies = fake.companies(key, 20)
+
+        class Industry:
+            def __init__(self, key, *args, **kwargs):
+                fake._call("yahoo.industry", fake.latency)
+                self.key = key
+                self.overview = {"name": key, "companies_count": 20}
+                self.top_performing_companies = fake.companies(key, 10)
+                self.top_growth_companies = fake.companies(key + ":growth", 10)
+                self.top_companies = self.top_performing_companies
+
+        class Market:
+            def __init__(self, region, *args, **kwargs):
+                fake._call("yahoo.market", fake.latency)
+                rng = np.random.default_rng(_seed(region))
+                self.summary = {f"^IDX{i}": {"shortName": f"{region} index {i}",
+                                             "regularMarketPrice": round(float(rng.uniform(1000, 40000)), 2),
+                                             "regularMarketChangePercent": round(float(rng.normal(0, 1)), 2)}
+                                for i in range(6)}
+                self.status = {"id": region.lower(), "status": "open", "timezone": {"short": "UTC"}}
+
+        class Search:
+            def __init__(self, query, news_count=8, *args, **kwargs):
+                fake._call("yahoo.search", fake.latency)
+                self.news = fake.news(query, news_count)
+
+        def download(symbols, period=None, interval="1m", start=None, **kwargs):
+            fake._call("yahoo.download", fake.latency)
+            symbols = [symbols] if isinstance(symbols, str) else list(symbols)
+            frames = {sym: fake.history(sym, interval, start) for sym in symbols}
+            return pd.concat(frames, axis=1)
+
+        self._patch(yf, "Ticker", Ticker)
+        self._patch(yf, "Sector", Sector)
+        self._patch(yf, "Industry", Industry)
+        self._patch(yf, "Market", Market)
+        self._patch(yf, "Search", Search)
+        self._patch(yf, "download", download)
+        return self
+
+    def info(self, symbol):
+        rng = np.random.default_rng(_seed(symbol))
+        return {
+            "symbol": symbol, "shortName": f"{symbol} Corp", "longName": f"{symbol} Corporation",
+            "sectorKey": "technology", "industryKey": "semiconductors", "country": "United States",
+            "currency": "USD", "marketCap": int(rng.uniform(1e9, 3e12)),
+            "regularMarketPrice": round(float(rng.uniform(10, 900)), 2),
+            "trailingPE": round(float(rng.uniform(5, 80)), 2), "fiftyTwoWeekHigh": 1000.0,
+            "fiftyTwoWeekLow": 5.0, "longBusinessSummary": _text(rng, self.news_chars),
+        }
+
+    def news(self, query, count):
+        rng = np.random.default_rng(_seed(query, count))
+        now = int(time.time())
+        return [{
+            "uuid": f"{_seed(query, i):08x}",
+            "title": f"{query}: {_text(rng, 60)}",
+            "publisher": f"Publisher {i % 4}",
+            "link": f"https://news.example.com/{_seed(query, i):08x}",
+            "providerPublishTime": now - int(rng.integers(60, 86400)),
+            "type": "STORY",
+            "relatedTickers": [str(query).upper()] if str(query).isalpha() and len(str(query)) <= 5 else [],
+            "summary": _text(rng, self.news_chars),
+        } for i in range(count)]
+
+    def history(self, symbol, interval="1m", start=None):
+        from data_ingestion.history_store import _INTERVAL_SECONDS
+        step = _INTERVAL_SECONDS.get(interval, 60)
+        now = int(time.time()) // step * step
+        bars = self.bars
+        if start is not None:
+            since = int(pd.Timestamp(start).timestamp())
+            bars = max(1, min(bars, (now - since) // step + 1))
+        rng = np.random.default_rng(_seed(symbol, interval))
+        # Prices are a function of the bar's timestamp, so a bar refetched
+        # later has the close it had before (no readjustment).
+        ts = np.arange(now - (bars - 1) * step, now + 1, step)
+        phase, scale = rng.uniform(0, 2 * np.pi), rng.uniform(20, 500)
+        close = scale * (1 + 0.05 * np.sin(ts / step / 50 + phase))
+        index = pd.DatetimeIndex(pd.to_datetime(ts, unit="s", utc=True))
+        return pd.DataFrame({
+            "Open": close * 0.999, "High": close * 1.002, "Low": close * 0.998, "Close": close,
+            "Adj Close": close, "Volume": rng.integers(1_000, 100_000, bars).astype(float),
+        }, index=index)
+
+    def companies(self, key, count):
+        rng = np.random.default_rng(_seed(key))
+        symbols = [f"{key[:2].upper()}{i:02d}" for i in range(count)]
+        return pd.DataFrame({"name": [f"{s} Inc" for s in symbols], "rating": "Buy",
+                             "market weight": rng.uniform(0, 0.1, count)},
+                            index=pd.Index(symbols, name="symbol"))
+
+    def earnings(self, symbol):
+        rng = np.random.default_rng(_seed(symbol, "eps"))
+        estimate = rng.uniform(0.1, 5, 4)
+        actual = estimate * (1 + rng.normal(0.02, 0.08, 4))
+        return pd.DataFrame({"epsEstimate": estimate, "epsActual": actual,
+                             "epsDifference": actual - estimate, "surprisePercent": (actual - estimate) / estimate},
+                            index=pd.date_range(end=pd.Timestamp.now().normalize(), periods=4, freq="QE"))
+
+
+class FakeGemini(_Fake):
+    def __init__(self, latency="lognormal:600,0.3", chunk_latency="const:15", embed_latency="lognormal:60,0.3",
+                 answer_sentences=6, chunk_chars=40, dim=768, recorder=None):
+        super().__init__(recorder)
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency, seed=2)
+        self.chunk_latency = chunk_latency if isinstance(chunk_latency, Latency) else Latency(chunk_latency, seed=3)
+        self.embed_latency = embed_latency if isinstance(embed_latency, Latency) else Latency(embed_latency, seed=4)
+        self.answer_sentences = answer_sentences
+        self.chunk_chars = chunk_chars
+        self.dim = dim
+        # Answers differ from call to call, as real ones do, so repeated
+        # queries don't turn TTS into cache hits.
+        self._calls = itertools.count()
+
+    def install(self):
+        import google.generativeai as genai
+        import langchain_google_genai
+        from agents import retriever_agent
+        fake = self
+
+        class _Response:
+            def __init__(self, text):
+                self.text = text
+
+        class GenerativeModel:
+            def __init__(self, model_name="gemini-1.5-flash", *args, **kwargs):
+                self.model_name = model_name
+
+            def generate_content(self, prompt, stream=False, **kwargs):
+                text = fake.reply(str(prompt))
+                if not stream:
+                    fake._call("gemini.generate", fake.latency)
+                    return _Response(text)
+                return fake.stream(text)
+
+        class Embeddings:
+            def __init__(self, *args, **kwargs):
+                pass
+
+            def embed_documents(self, texts, **kwargs):
+                fake._call("gemini.embed", fake.embed_latency)
+                return [fake.vector(t) for t in texts]
+
+            def embed_query(self, text, **kwargs):
+                fake._call("gemini.embed", fake.embed_latency)
+                return fake.vector(text)
+
+        self._patch(genai, "configure", lambda *args, **kwargs: None)
+        self._patch(genai, "GenerativeModel", GenerativeModel)
+        self._patch(langchain_google_genai, "GoogleGenerativeAIEmbeddings", Embeddings)
+        retriever_agent._embeddings.clear()
+        return self
+
+    def stream(self, text):
+        start = time.perf_counter()
+        self.latency.sleep()
+        for i in range(0, len(text), self.chunk_chars):
+            if i:
+                self.chunk_latency.sleep()
+            yield type("Chunk", (), {"text": text[i:i + self.chunk_chars]})()
+        if self.recorder is not None:
+            self.recorder.record("gemini.stream", time.perf_counter() - start)
+
+    def reply(self, prompt):
+        match = re.search(r'Query: "(.*)"', prompt)
+        if "Extract the following entities" in prompt and match:
+            from agents.entity_index import get_index
+            return json.dumps(get_index().extract(match.group(1))[0])
+        if "Extract the following entities" in prompt:
+            from agents.entity_index import get_index
+            queries = re.findall(r'^\d+\. "(.*)"$', prompt, re.MULTILINE)
+            return json.dumps([get_index().extract(q)[0] for q in queries])
+        query = re.search(r"User query: (.*)", prompt)
+        query = query.group(1).strip() if query else "the market"
+        rng = np.random.default_rng(_seed(query, next(self._calls)))
+        sentences = [f"{_text(rng, 90).capitalize()}." for _ in range(self.answer_sentences)]
+        return json.dumps({
+            "plan": ["extract_entities", "fetch_market_data", "synthesize_answer"],
+            "response": f"Here is the picture for {query}. " + " ".join(sentences),
+            "logs": ["Used fetched market data and news."],
+        })
+
+    def vector(self, text):
+        vector = np.random.default_rng(_seed(text)).standard_normal(self.dim)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_audio(query, size=16000):
+    # Voice upload whose "speech" the fake STT endpoint reads back as text.
+    payload = AUDIO_MARKER + query.encode() + b"\0"
+    return payload + bytes(max(size - len(payload), 0))
+
+
+class FakeElevenLabs(_Fake):
+    def __init__(self, stt_latency="lognormal:300,0.3", tts_latency="lognormal:250,0.3", audio_bytes_per_char=64,
+                 recorder=None):
+        super().__init__(recorder)
+        self.stt_latency = stt_latency if isinstance(stt_latency, Latency) else Latency(stt_latency, seed=5)
+        self.tts_latency = tts_latency if isinstance(tts_latency, Latency) else Latency(tts_latency, seed=6)
+        self.audio_bytes_per_char = audio_bytes_per_char
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def install(self):
+        from agents import voice_agent
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.path == "/v1/speech-to-text":
+                    fake._call("elevenlabs.stt", fake.stt_latency)
+                    start = body.find(AUDIO_MARKER)
+                    text = body[start + len(AUDIO_MARKER):body.find(b"\0", start)].decode() if start >= 0 else ""
+                    self._reply(200, json.dumps({"text": text}).encode(), "application/json")
+                elif self.path.startswith("/v1/text-to-speech/"):
+                    fake._call("elevenlabs.tts", fake.tts_latency)
+                    text = json.loads(body or b"{}").get("text", "")
+                    self._reply(200, b"\xff\xfb" + bytes(len(text) * fake.audio_bytes_per_char), "audio/mpeg")
+                else:
+                    self._reply(404, b"{}", "application/json")
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-elevenlabs", daemon=True).start()
+        self._patch(voice_agent, "ELEVENLABS_BASE_URL", self.url)
+        return self
+
+    def uninstall(self):
+        super().uninstall()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,107 @@
+"""
+earnings_screen.py
+
+Latency benchmark for agents.earnings_screener. Builds a synthetic earnings
+table (companies x quarters) in memory, installs it with its indexes, and
+times typical screens against the same filter done as a pandas boolean mask
+over the whole table.
+
+Usage:
+    python -m benchmarks.earnings_screen [--companies 5000] [--quarters 8] [--repeat 50]
+"""
+
+import time
+import argparse
+import statistics
+import numpy as np
+import pandas as pd
+from agents.earnings_screener import EarningsScreener, DEFAULT_SECTORS, fiscal_period
+
+INDUSTRIES = ["semiconductors", "software-infrastructure", "banks-regional", "biotechnology",
+              "oil-gas-integrated", "auto-manufacturers", "internet-retail", "utilities-regulated-electric"]
+REGIONS = ["US", "ASIA", "EUROPE", "GB"]
+
+SCREENS = {
+    "asian semis, latest": dict(industry="semiconductors", region="ASIA"),
+    "tech beats >5%, latest": dict(sector="technology", min_surprise=5),
+    "europe, one quarter": dict(region="EUROPE", period=None),
+    "all misses, latest": dict(max_surprise=0, ascending=True),
+}
+
+
+def synthetic_table(companies, quarters, seed=0):
+    rng = np.random.default_rng(seed)
+    ends = pd.date_range(end="2025-06-30", periods=quarters, freq="QE")
+    n = companies * quarters
+    estimate = rng.uniform(0.1, 5.0, n)
+    actual = estimate * (1 + rng.normal(0.02, 0.08, n))
+    return pd.DataFrame({
+        "symbol": np.repeat([f"SYM{i:05d}" for i in range(companies)], quarters),
+        "name": None,
+        "sector": np.repeat(rng.choice(DEFAULT_SECTORS, companies), quarters),
+        "industry": np.repeat(rng.choice(INDUSTRIES, companies), quarters),
+        "region": np.repeat(rng.choice(REGIONS, companies), quarters),
+        "period": np.tile(fiscal_period(ends), companies),
+        "quarter_end": np.tile(ends, companies),
+        "eps_estimate": estimate,
+        "eps_actual": actual,
+        "surprise_percent": (actual - estimate) / estimate * 100,
+        "latest": np.tile(np.arange(quarters) == quarters - 1, companies),
+    })
+
+
+def mask_screen(table, sector=None, industry=None, region=None, period="latest", min_surprise=None,
+                max_surprise=None, ascending=False):
+    mask = table["latest"] if period == "latest" else pd.Series(True, index=table.index)
+    if period not in (None, "latest"):
+        mask &= table["period"] == period
+    for column, value in (("sector", sector), ("industry", industry), ("region", region)):
+        if value is not None:
+            mask &= table[column] == value
+    if min_surprise is not None:
+        mask &= table["surprise_percent"] >= min_surprise
+    if max_surprise is not None:
+        mask &= table["surprise_percent"] <= max_surprise
+    return table[mask].sort_values("surprise_percent", ascending=ascending)
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--companies", type=int, default=5000)
+    parser.add_argument("--quarters", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    table = synthetic_table(args.companies, args.quarters)
+    screener = EarningsScreener(path=None)
+    start = time.perf_counter()
+    screener._install(table, time.time())
+    print({"rows": len(table), "install_ms": round((time.perf_counter() - start) * 1000, 1)})
+
+    for label, kwargs in SCREENS.items():
+        if kwargs.get("period", "latest") is None:
+            kwargs = dict(kwargs, period=table["period"].iloc[0])
+        matches = screener.screen(**kwargs)
+        expected = mask_screen(table, **kwargs)
+        assert set(zip(matches["symbol"], matches["period"])) == set(zip(expected["symbol"], expected["period"])), label
+        print({
+            "screen": label,
+            "matches": len(matches),
+            "indexed_ms": round(_time(lambda: screener.screen(**kwargs), args.repeat), 3),
+            "mask_ms": round(_time(lambda: mask_screen(table, **kwargs), args.repeat), 3),
+        })
+    print({"summary_ms": round(_time(lambda: screener.summary(industry="semiconductors", region="ASIA"),
+                                     args.repeat), 3)})
+
+
+if __name__ == "__main__":
+    main()
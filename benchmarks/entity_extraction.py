@@ -0,0 +1,163 @@
+"""
+entity_extraction.py
+
+Offline benchmark for the local entity extractor. Runs a labelled query set
+through agents.entity_index and reports per-field accuracy, how many queries
+resolved locally, and latency percentiles. Pass --gemini-key to run the same
+set through the Gemini path for a side-by-side comparison.
+
+--check exits non-zero if a query resolved locally has a wrong field, or if
+one of FALLBACK_QUERIES (entities the dictionary lacks, common words that
+double as ticker aliases) resolves locally instead of going to Gemini.
+
+Usage:
+    python -m benchmarks.entity_extraction [--repeat 200] [--gemini-key KEY] [--check]
+"""
+
+import sys
+import time
+import argparse
+import statistics
+from agents.entity_index import EntityIndex, ENTITY_FIELDS, LOCAL_CONFIDENCE_THRESHOLD
+
+LABELLED_QUERIES = [
+    ("What's our risk exposure in Asia tech stocks today?",
+     {"sector": "technology", "region": "ASIA", "asset_type": "equity"}),
+    ("How is TSMC doing?", {"ticker": "TSM"}),
+    ("Any earnings surprises from Samsung or SK Hynix?", {"ticker": ["005930.KS", "000660.KS"]}),
+    ("How are NVDA and AMD trading vs the S&P 500", {"ticker": ["NVDA", "AMD"], "index_name": "^GSPC"}),
+    ("Give me a morning brief on European banks", {"region": "EUROPE", "sector": "financial-services"}),
+    ("Latest news on Apple", {"ticker": "AAPL"}),
+    ("How did the Nikkei close?", {"index_name": "^N225"}),
+    ("Convert USD to yen", {"from_currency": "USD", "to_currency": "JPY"}),
+    ("What's the outlook for semiconductors in Taiwan?", {"industry": "semiconductors", "region": "ASIA"}),
+    ("Is Tesla outperforming the Nasdaq this week?", {"ticker": "TSLA", "index_name": "^IXIC"}),
+    ("Summarize the healthcare sector", {"sector": "healthcare"}),
+    ("How are Alibaba and Tencent doing in Hong Kong", {"ticker": ["BABA", "0700.HK"], "region": "ASIA"}),
+    ("Bitcoin price today", {"ticker": "BTC-USD"}),
+    ("What's happening with Microsoft and Nvidia earnings", {"ticker": ["MSFT", "NVDA"]}),
+    ("How is the energy sector in the US doing", {"sector": "energy", "region": "US"}),
+    ("Tell me about Rivian", {"ticker": "RIVN"}),
+    ("Compare Sony and Toyota", {"ticker": ["SONY", "TM"]}),
+    ("Any news on UK utilities?", {"region": "GB", "sector": "utilities"}),
+    ("What's the Hang Seng doing", {"index_name": "^HSI"}),
+    ("How are Japanese chipmakers performing", {"region": "ASIA", "industry": "semiconductors"}),
+    ("How are ARM shares doing", {"ticker": "ARM", "asset_type": "equity"}),
+    ("Visa earnings this quarter", {"ticker": "V"}),
+    ("Is Shell stock a buy", {"ticker": "SHEL", "asset_type": "equity"}),
+    ("What did SAP report", {"ticker": "SAP"}),
+]
+
+# Queries the local index must not resolve on its own: a name it lacks sits
+# next to ones it knows, or an alias is being used as an ordinary word.
+FALLBACK_QUERIES = [
+    "what is our exposure to rivian and tesla",
+    "how are snowflake shares doing",
+    "Snowflake earnings",
+    "the arm of the market",
+    "what does the sap say",
+    "Visa applications",
+    "shell companies in tech",
+]
+
+
+def _normalize(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple)):
+        values = sorted(str(v).upper() for v in value)
+        return values[0] if len(values) == 1 else values
+    return str(value).upper()
+
+
+def _field_accuracy(predicted, expected):
+    correct = sum(
+        1 for field in ENTITY_FIELDS
+        if _normalize((predicted or {}).get(field)) == _normalize(expected.get(field))
+    )
+    return correct / len(ENTITY_FIELDS), correct == len(ENTITY_FIELDS)
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def run_local(repeat):
+    index = EntityIndex()
+    timings, field_scores, exact, resolved = [], [], 0, 0
+    for query, expected in LABELLED_QUERIES:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            entities, confidence, _ = index.extract(query)
+            timings.append(time.perf_counter() - start)
+        score, is_exact = _field_accuracy(entities, expected)
+        field_scores.append(score)
+        exact += is_exact
+        resolved += confidence >= LOCAL_CONFIDENCE_THRESHOLD
+    return {
+        "queries": len(LABELLED_QUERIES),
+        "resolved_locally": resolved,
+        "field_accuracy": round(statistics.mean(field_scores), 4),
+        "exact_match": round(exact / len(LABELLED_QUERIES), 4),
+        "p50_us": round(_percentile(timings, 50) * 1e6, 1),
+        "p99_us": round(_percentile(timings, 99) * 1e6, 1),
+    }
+
+
+def check():
+    # Failures: locally resolved queries with a wrong field, and fallback
+    # queries that resolved locally.
+    index = EntityIndex()
+    failures = []
+    for query, expected in LABELLED_QUERIES:
+        entities, confidence, _ = index.extract(query)
+        if confidence >= LOCAL_CONFIDENCE_THRESHOLD and not _field_accuracy(entities, expected)[1]:
+            failures.append(f"wrong local result for {query!r}: {entities}")
+    for query in FALLBACK_QUERIES:
+        entities, confidence, _ = index.extract(query)
+        if confidence >= LOCAL_CONFIDENCE_THRESHOLD:
+            failures.append(f"resolved locally, should fall back: {query!r} -> {entities}")
+    return failures
+
+
+def run_llm(gemini_api_key):
+    from agents.language_agent import extract_entities_llm
+    timings, field_scores, exact = [], [], 0
+    for query, expected in LABELLED_QUERIES:
+        start = time.perf_counter()
+        entities = extract_entities_llm(query, gemini_api_key)
+        timings.append(time.perf_counter() - start)
+        score, is_exact = _field_accuracy(entities, expected)
+        field_scores.append(score)
+        exact += is_exact
+    return {
+        "queries": len(LABELLED_QUERIES),
+        "field_accuracy": round(statistics.mean(field_scores), 4),
+        "exact_match": round(exact / len(LABELLED_QUERIES), 4),
+        "p50_us": round(_percentile(timings, 50) * 1e6, 1),
+        "p99_us": round(_percentile(timings, 99) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200, help="timed runs per query for the local path")
+    parser.add_argument("--gemini-key", help="also benchmark the Gemini path with this API key")
+    parser.add_argument("--check", action="store_true", help="fail on wrong local results and missed fallbacks")
+    args = parser.parse_args()
+
+    print("local:", run_local(args.repeat))
+    if args.gemini_key:
+        print("gemini:", run_llm(args.gemini_key))
+    if args.check:
+        failures = check()
+        for failure in failures:
+            print("FAIL:", failure)
+        print(f"check: {len(LABELLED_QUERIES) + len(FALLBACK_QUERIES) - len(failures)} passed, "
+              f"{len(failures)} failed")
+        sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
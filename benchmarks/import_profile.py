@@ -0,0 +1,96 @@
+"""
+import_profile.py
+
+Cold-start profile for the API worker. Imports orchestrator.main in fresh
+interpreters under -X importtime and reports the median import time, where
+it goes (self time summed per top-level package, and cumulative time of our
+own modules), which heavy packages were deferred by agents.lazy, and -
+with --warm - how long the warm-up hook takes afterwards.
+
+Usage:
+    python -m benchmarks.import_profile [--module orchestrator.main] [--runs 5] [--top 15]
+        [--warm] [--budget-ms 1000]
+
+With --budget-ms, exits non-zero if the median import time is over budget.
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+FIRST_PARTY = ("agents", "orchestrator", "data_ingestion")
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+import {module}
+result = {{"import_s": time.perf_counter() - start}}
+from agents import lazy
+result["deferred"] = sorted(name for name, state in lazy.stats().items() if not state["loaded"])
+if {warm}:
+    from orchestrator import warmup
+    result["warm_up"] = warmup.warm_up()
+print(json.dumps(result))
+"""
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_child(module, warm=False):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.getenv("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-W", "ignore", "-c",
+                           CHILD.format(module=module, warm=warm)],
+                          capture_output=True, text=True, env=env, check=True)
+    modules = [(m.group(4), int(m.group(1)), int(m.group(2)))
+               for m in map(_LINE.match, proc.stderr.splitlines()) if m]
+    return json.loads(proc.stdout.strip().splitlines()[-1]), modules
+
+
+def by_package(modules):
+    totals = defaultdict(int)
+    for name, self_us, _ in modules:
+        totals[name.split(".")[0]] += self_us
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="orchestrator.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--warm", action="store_true", help="also time the warm-up hook")
+    parser.add_argument("--budget-ms", type=float, help="fail if the median import takes longer")
+    args = parser.parse_args()
+
+    runs = [run_child(args.module) for _ in range(args.runs)]
+    import_ms = statistics.median(result["import_s"] for result, _ in runs) * 1000
+    # Attribute time from the median run.
+    result, modules = sorted(runs, key=lambda run: run[0]["import_s"])[len(runs) // 2]
+    print({"module": args.module, "runs": args.runs, "median_import_ms": round(import_ms, 1),
+           "modules_imported": len(modules), "deferred": result["deferred"]})
+
+    print("self time by package:")
+    for package, us in sorted(by_package(modules).items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"    {package:<28} {us / 1000:>8.1f}ms")
+    print("our modules, cumulative:")
+    ours = [(name, cumulative) for name, _, cumulative in modules if name.split(".")[0] in FIRST_PARTY]
+    for name, us in sorted(ours, key=lambda kv: -kv[1])[:args.top]:
+        print(f"    {name:<28} {us / 1000:>8.1f}ms")
+
+    if args.warm:
+        warm, _ = run_child(args.module, warm=True)
+        print({"warm_up_s": warm["warm_up"]["seconds"], "steps": warm["warm_up"]["steps"],
+               "errors": warm["warm_up"]["errors"]})
+
+    if args.budget_ms is not None and import_ms > args.budget_ms:
+        print(f"median import {import_ms:.0f}ms is over the {args.budget_ms:.0f}ms budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
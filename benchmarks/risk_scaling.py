@@ -0,0 +1,95 @@
+"""
+risk_scaling.py
+
+Scaling benchmark for agents.risk_engine. Times compute_risk on synthetic
+portfolios of increasing size and reports time per position, which should
+stay roughly flat (linear scaling). For comparison it also times a
+per-ticker Python loop computing the same exposure, change, volatility and
+beta figures, up to --loop-max positions.
+
+Usage:
+    python -m benchmarks.risk_scaling [--sizes 500,1000,2000,4000,8000,16000]
+        [--days 252] [--repeat 5] [--loop-max 4000]
+"""
+
+import time
+import argparse
+import statistics
+import numpy as np
+import pandas as pd
+from agents.risk_engine import compute_risk
+
+SECTORS = ["Technology", "Financial Services", "Healthcare", "Energy", "Industrials", "Consumer Cyclical"]
+REGIONS = ["US", "ASIA", "EUROPE", "LATAM"]
+
+
+def synthetic_portfolio(positions, days, seed=0):
+    rng = np.random.default_rng(seed)
+    symbols = [f"SYM{i:05d}" for i in range(positions)]
+    holdings = pd.DataFrame({
+        "symbol": symbols,
+        "quantity": rng.integers(1, 1000, positions),
+        "sector": rng.choice(SECTORS, positions),
+        "region": rng.choice(REGIONS, positions),
+    })
+    market = rng.normal(0.0003, 0.01, days)
+    betas = rng.uniform(0.5, 1.5, positions)
+    returns = market[:, None] * betas + rng.normal(0, 0.015, (days, positions))
+    dates = pd.bdate_range("2024-01-01", periods=days)
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(returns, axis=0)), index=dates, columns=symbols)
+    benchmark = pd.Series(4000 * np.exp(np.cumsum(market)), index=dates)
+    return holdings, prices, benchmark
+
+
+def loop_baseline(holdings, prices, benchmark, sector, region):
+    # What the per-ticker approach looks like: one pass per position.
+    bench = benchmark.pct_change().dropna()
+    total = exposure = change = 0.0
+    stats = {}
+    for _, row in holdings.iterrows():
+        series = prices[row["symbol"]]
+        value = row["quantity"] * series.iloc[-1]
+        total += value
+        returns = series.pct_change().dropna()
+        stats[row["symbol"]] = (returns.std() * 252 ** 0.5, returns.cov(bench) / bench.var())
+        if row["sector"].lower() == sector and row["region"].upper() == region:
+            exposure += value
+            change += value * returns.iloc[-1]
+    return exposure / total, change / exposure if exposure else None, stats
+
+
+def _time(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="500,1000,2000,4000,8000,16000")
+    parser.add_argument("--days", type=int, default=252)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--loop-max", type=int, default=4000, help="largest size to run the loop baseline at")
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(",")):
+        holdings, prices, benchmark = synthetic_portfolio(size, args.days)
+        vectorized = _time(lambda: compute_risk(holdings, prices, benchmark, sector="technology", region="ASIA"),
+                           args.repeat)
+        row = {
+            "positions": size,
+            "vectorized_ms": round(vectorized * 1e3, 2),
+            "us_per_position": round(vectorized / size * 1e6, 2),
+        }
+        if size <= args.loop_max:
+            looped = _time(lambda: loop_baseline(holdings, prices, benchmark, "technology", "ASIA"), 1)
+            row["loop_ms"] = round(looped * 1e3, 1)
+            row["speedup"] = round(looped / vectorized, 1)
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,16 +7,18 @@ It provides a template for robust, scalable API ingestion.
 Currently not used in the main application.
 """
 
-import requests
 import logging
+from agents.clients import http_session
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 class APIClient:
-    def __init__(self, base_url, api_key=None):
+    def __init__(self, base_url, api_key=None, session=None):
         self.base_url = base_url
         self.api_key = api_key
+        # Shared keep-alive pool unless the caller brings its own session.
+        self.session = session or http_session()
 
     def get(self, endpoint, params=None, headers=None):
         url = f"{self.base_url.rstrip('/')}/{endpoint.lstrip('/')}"
@@ -24,7 +26,7 @@ class APIClient:
             params = params or {}
             params['apikey'] = self.api_key
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=10)
+            response = self.session.get(url, params=params, headers=headers, timeout=10)
             response.raise_for_status()
             logger.info("Fetched data from %s", url)
             return response.json()
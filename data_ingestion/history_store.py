@@ -0,0 +1,357 @@
+"""
+history_store.py
+
+Local columnar store for OHLCV bars. Bars are kept as one NumPy .npy file per
+column, partitioned by symbol, interval and UTC day (UTC year for daily and
+coarser bars):
+
+    HISTORY_STORE_DIR/<interval>/<SYMBOL>/<partition>/{ts,open,high,low,close,volume}.npy
+
+Reads memory-map the column files, so serving the bars of a single partition
+copies nothing; ranges spanning several partitions are concatenated once.
+sync() downloads only the bars after the last stored timestamp (the last
+stored bar is refetched, as it may still have been forming) and only goes
+back to Yahoo for a full download when a longer period than has ever been
+stored is requested, or the gap is longer than Yahoo serves at that interval.
+
+Bars are split- and dividend-adjusted (auto_adjust=True), so every stored
+price moves when Yahoo re-adjusts after a corporate action. Delta downloads
+therefore also refetch the last completed stored bar and compare its close:
+if it changed, the store is dropped and the whole period downloaded again,
+rather than appending new bars to a series adjusted on a different basis.
+A full download always replaces what was stored, for the same reason.
+
+The store is shared by every process using HISTORY_STORE_DIR (web workers,
+job workers), so it is locked per symbol and interval with flock() on a
+file under .locks/: sync() and the batch path hold it exclusively from plan
+to ingest, and read() holds it shared, so a read never sees a partition
+half-way through being replaced.
+"""
+
+import os
+import json
+import fcntl
+import shutil
+import time
+import logging
+import tempfile
+import contextlib
+from datetime import datetime, timedelta, timezone
+from agents.lazy import lazy_import
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+logger = logging.getLogger("history_store")
+logger.setLevel(logging.INFO)
+
+HISTORY_STORE_DIR = os.path.expanduser(os.getenv("HISTORY_STORE_DIR", "~/.cache/finance_assistant/history"))
+
+COLUMNS = ("open", "high", "low", "close", "volume")
+# Store column -> yfinance column.
+_SOURCE = {"open": "Open", "high": "High", "low": "Low", "close": "Close", "volume": "Volume"}
+
+_INTERVAL_SECONDS = {
+    "1m": 60, "2m": 120, "5m": 300, "15m": 900, "30m": 1800, "60m": 3600, "90m": 5400,
+    "1h": 3600, "1d": 86400, "5d": 5 * 86400, "1wk": 7 * 86400, "1mo": 30 * 86400, "3mo": 90 * 86400,
+}
+# How far back Yahoo serves each intraday interval; older gaps need a full
+# download of the period instead of a delta.
+_MAX_LOOKBACK_DAYS = {"1m": 7, "2m": 60, "5m": 60, "15m": 60, "30m": 60, "60m": 730, "90m": 60, "1h": 730}
+
+# Relative change in a refetched close taken as a re-adjustment rather than
+# float noise between downloads.
+ADJUSTMENT_TOLERANCE = 1e-4
+
+_PERIOD_DAYS = {"d": 1, "wk": 7, "mo": 31, "y": 366}
+
+
+def period_days(period):
+    # '5d' -> 5, '1mo' -> 31, 'ytd' -> days since Jan 1, 'max' -> inf.
+    if period == "max":
+        return float("inf")
+    if period == "ytd":
+        now = datetime.now(timezone.utc)
+        return (now - datetime(now.year, 1, 1, tzinfo=timezone.utc)).days + 1
+    for unit in ("wk", "mo", "d", "y"):
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            return int(period[:-len(unit)]) * _PERIOD_DAYS[unit]
+    raise ValueError(f"Unsupported period: {period}")
+
+
+def _is_intraday(interval):
+    return _INTERVAL_SECONDS[interval] < 86400
+
+
+def _partition(ts, interval):
+    day = datetime.fromtimestamp(int(ts), tz=timezone.utc)
+    return day.strftime("%Y-%m-%d") if _is_intraday(interval) else day.strftime("%Y")
+
+
+def _replace(path, write, mode="wb"):
+    # Write a file under a unique temporary name in its own directory, then
+    # swap it in, so concurrent writers never share (or clobber) a temp file.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(tmp)
+        raise
+
+
+def frame_to_columns(frame):
+    # yfinance frame -> {"ts": int64 epoch seconds, "open": float64, ...}
+    if frame is None or frame.empty:
+        return None
+    index = pd.DatetimeIndex(frame.index)
+    index = index.tz_localize("UTC") if index.tz is None else index.tz_convert("UTC")
+    columns = {"ts": index.tz_localize(None).values.astype("datetime64[s]").astype(np.int64)}
+    for column, source in _SOURCE.items():
+        values = frame[source] if source in frame else np.full(len(frame), np.nan)
+        columns[column] = np.asarray(values, dtype=np.float64)
+    keep = ~np.isnan(columns["close"])
+    return {k: v[keep] for k, v in columns.items()}
+
+
+def as_frame_columns(columns):
+    # Store columns -> the column names the rest of the app uses for history
+    # (Datetime, Open, High, Low, Close, Volume). Views, not copies.
+    if not columns or not len(columns["ts"]):
+        return {}
+    result = {"Datetime": columns["ts"].view("datetime64[s]")}
+    for column, source in _SOURCE.items():
+        result[source] = columns[column]
+    return result
+
+
+class HistoryStore:
+    def __init__(self, root=HISTORY_STORE_DIR):
+        self.root = root
+        self.counters = {"full_fetches": 0, "delta_fetches": 0, "bars_fetched": 0, "bars_written": 0,
+                         "readjustments": 0}
+
+    @contextlib.contextmanager
+    def _lock(self, symbol, interval, shared=False):
+        # Interprocess lock for symbol/interval. Each use opens its own file
+        # description, so threads of one process exclude each other too.
+        directory = os.path.join(self.root, ".locks")
+        os.makedirs(directory, exist_ok=True)
+        name = f"{interval}-{symbol.upper().replace('/', '_')}.lock"
+        with open(os.path.join(directory, name), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def locked(self, symbols, interval):
+        # Hold the locks of several symbols at once (the batch download path),
+        # taken in sorted order so overlapping batches, in this process or
+        # another, cannot deadlock.
+        with contextlib.ExitStack() as stack:
+            for symbol in sorted({s.upper() for s in symbols}):
+                stack.enter_context(self._lock(symbol, interval))
+            yield
+
+    def _dir(self, symbol, interval):
+        return os.path.join(self.root, interval, symbol.upper().replace("/", "_"))
+
+    def _meta_path(self, symbol, interval):
+        return os.path.join(self._dir(symbol, interval), "meta.json")
+
+    def meta(self, symbol, interval):
+        try:
+            with open(self._meta_path(symbol, interval)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_meta(self, symbol, interval, meta):
+        _replace(self._meta_path(symbol, interval), lambda f: json.dump(meta, f), mode="w")
+
+    def _tail(self, symbol, interval, n):
+        # The last n stored bars (fewer if the store holds fewer).
+        chunks, rows = [], 0
+        for partition in reversed(self.partitions(symbol, interval)):
+            columns = self.read_partition(symbol, interval, partition, mmap=False)
+            if columns is None:
+                continue
+            chunks.insert(0, columns)
+            rows += len(columns["ts"])
+            if rows >= n:
+                break
+        if not chunks:
+            return None
+        return {c: np.concatenate([chunk[c] for chunk in chunks])[-n:] for c in chunks[0]}
+
+    def partitions(self, symbol, interval):
+        directory = self._dir(symbol, interval)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(p for p in os.listdir(directory) if os.path.isfile(os.path.join(directory, p, "ts.npy")))
+
+    def read_partition(self, symbol, interval, partition, mmap=True):
+        directory = os.path.join(self._dir(symbol, interval), partition)
+        mode = "r" if mmap else None
+        try:
+            columns = {c: np.load(os.path.join(directory, c + ".npy"), mmap_mode=mode) for c in ("ts",) + COLUMNS}
+        except (FileNotFoundError, ValueError):
+            return None
+        # Callers that may race a writer hold the symbol's lock (read() takes
+        # it shared), so the columns belong to one version of the partition;
+        # trimming to the shortest only guards against a store left behind
+        # by a writer that died between column replaces.
+        rows = min(len(v) for v in columns.values())
+        return {c: v[:rows] for c, v in columns.items()}
+
+    def _write_partition(self, symbol, interval, partition, columns):
+        directory = os.path.join(self._dir(symbol, interval), partition)
+        os.makedirs(directory, exist_ok=True)
+        for column in COLUMNS + ("ts",):
+            values = np.ascontiguousarray(columns[column])
+            _replace(os.path.join(directory, column + ".npy"), lambda f: np.save(f, values))
+
+    def append(self, symbol, interval, columns, replace=False):
+        # Merge bars into their partitions; stored bars at or after the first
+        # new timestamp of each partition are replaced. With replace, the
+        # partitions the bars fall in are overwritten and older ones dropped.
+        if columns is None or not len(columns["ts"]):
+            return 0
+        order = np.argsort(columns["ts"], kind="stable")
+        columns = {c: v[order] for c, v in columns.items()}
+        keys = np.array([_partition(ts, interval) for ts in columns["ts"]])
+        written = 0
+        for partition in dict.fromkeys(keys):
+            mask = keys == partition
+            new = {c: v[mask] for c, v in columns.items()}
+            old = None if replace else self.read_partition(symbol, interval, partition, mmap=False)
+            if old is not None:
+                keep = old["ts"] < new["ts"][0]
+                new = {c: np.concatenate([old[c][keep], new[c]]) for c in new}
+            self._write_partition(symbol, interval, partition, new)
+            written += int(mask.sum())
+        if replace:
+            # Partition by partition rather than the whole symbol directory,
+            # which another process sharing the store may be writing to.
+            for partition in self.partitions(symbol, interval):
+                if partition < keys[0]:
+                    shutil.rmtree(os.path.join(self._dir(symbol, interval), partition), ignore_errors=True)
+        self.counters["bars_written"] += written
+        return written
+
+    def read(self, symbol, interval="1m", period="1d"):
+        # Bars for period, newest partitions last. For day periods on
+        # intraday data, 'Nd' means the last N stored trading days, as with
+        # yfinance; otherwise bars newer than now minus the period.
+        # Memory-mapped columns keep the files they were opened on, so the
+        # result stays consistent after the lock is released.
+        with self._lock(symbol.upper(), interval, shared=True):
+            return self._read(symbol, interval, period)
+
+    def _read(self, symbol, interval, period):
+        parts = self.partitions(symbol, interval)
+        if not parts:
+            return None
+        days = period_days(period)
+        if _is_intraday(interval) and period.endswith("d") and period[:-1].isdigit():
+            selected = parts[-int(period[:-1]):]
+            cutoff = None
+        else:
+            cutoff = None if days == float("inf") else time.time() - days * 86400
+            first = _partition(max(cutoff, 0), interval) if cutoff is not None else ""
+            selected = [p for p in parts if p >= first]
+        chunks = [c for c in (self.read_partition(symbol, interval, p) for p in selected) if c is not None]
+        if not chunks:
+            return None
+        if len(chunks) == 1:
+            columns = chunks[0]
+        else:
+            columns = {c: np.concatenate([chunk[c] for chunk in chunks]) for c in chunks[0]}
+        if cutoff is not None:
+            start = int(np.searchsorted(columns["ts"], cutoff))
+            columns = {c: v[start:] for c, v in columns.items()}
+        return columns
+
+    def plan(self, symbol, interval="1m", period="1d"):
+        # What it takes to serve period: None if the store is current,
+        # ("full", None) to download the whole period, or ("delta", start)
+        # to download only bars from start onwards.
+        meta = self.meta(symbol, interval)
+        last_ts = meta.get("last_ts")
+        lookback = _MAX_LOOKBACK_DAYS.get(interval)
+        now = time.time()
+        # Stores written before bars were adjusted are downloaded again.
+        if last_ts is None or not meta.get("adjusted") or period_days(period) > meta.get("covered_days", 0) \
+                or (lookback is not None and now - last_ts > lookback * 86400):
+            return "full", None
+        if now - last_ts < _INTERVAL_SECONDS[interval]:
+            return None
+        # Start from the last completed bar, so readjusted() can compare it;
+        # the last stored bar may still have been forming anyway.
+        return "delta", datetime.fromtimestamp(meta.get("check_ts", last_ts), tz=timezone.utc)
+
+    def readjusted(self, symbol, interval, frame):
+        # True if a delta download's copy of the last completed stored bar
+        # has a different close: Yahoo re-adjusted the series since.
+        meta = self.meta(symbol, interval)
+        columns = frame_to_columns(frame)
+        if "check_ts" not in meta or columns is None:
+            return False
+        match = np.flatnonzero(columns["ts"] == meta["check_ts"])
+        if not len(match) or np.isclose(columns["close"][match[0]], meta["check_close"],
+                                         rtol=ADJUSTMENT_TOLERANCE, atol=0):
+            return False
+        self.counters["readjustments"] += 1
+        logger.info("History %s %s was readjusted (close %.4f -> %.4f); refetching", symbol, interval,
+                    meta["check_close"], columns["close"][match[0]])
+        return True
+
+    def ingest(self, symbol, interval, period, frame, full):
+        # Store a downloaded yfinance frame and advance the symbol's metadata.
+        # A full download replaces the store: its adjustment basis may differ
+        # from that of the bars already held.
+        columns = frame_to_columns(frame)
+        fetched = 0 if columns is None else len(columns["ts"])
+        self.counters["full_fetches" if full else "delta_fetches"] += 1
+        self.counters["bars_fetched"] += fetched
+        if fetched:
+            os.makedirs(self._dir(symbol, interval), exist_ok=True)
+            self.append(symbol, interval, columns, replace=full)
+            meta = {"adjusted": True, "covered_days": period_days(period)} if full else self.meta(symbol, interval)
+            meta["last_ts"] = int(max(columns["ts"][-1], meta.get("last_ts") or 0))
+            tail = self._tail(symbol, interval, 2)
+            if len(tail["ts"]) == 2:
+                meta["check_ts"], meta["check_close"] = int(tail["ts"][0]), float(tail["close"][0])
+            self._write_meta(symbol, interval, meta)
+        logger.info("History sync %s %s: %s fetch, %d bars", symbol, interval, "full" if full else "delta", fetched)
+        return fetched
+
+    def sync(self, symbol, interval="1m", period="1d", ticker=None):
+        # Bring the store up to date for symbol/interval, then return the
+        # bars for period. ticker is an optional yf.Ticker to reuse.
+        symbol = symbol.upper()
+        with self._lock(symbol, interval):
+            needed = self.plan(symbol, interval, period)
+            if needed is not None:
+                if ticker is None:
+                    import yfinance as yf
+                    ticker = yf.Ticker(symbol)
+                mode, start = needed
+                if mode == "delta":
+                    frame = ticker.history(start=start, end=datetime.now(timezone.utc) + timedelta(days=1),
+                                           interval=interval, auto_adjust=True)
+                    if self.readjusted(symbol, interval, frame):
+                        mode = "full"
+                if mode == "full":
+                    frame = ticker.history(period=period, interval=interval, auto_adjust=True)
+                self.ingest(symbol, interval, period, frame, full=mode == "full")
+        return self.read(symbol, interval, period)
+
+    def stats(self):
+        return dict(self.counters, root=self.root)
+
+
+history_store = HistoryStore()
@@ -1,9 +1,9 @@
-import requests
 from bs4 import BeautifulSoup
+from agents.clients import http_session, HTTP_TIMEOUT
 
 def get_latest_news(ticker):
     url = f"https://finance.yahoo.com/quote/{ticker}?p={ticker}"
-    resp = requests.get(url)
+    resp = http_session().get(url, timeout=HTTP_TIMEOUT)
     soup = BeautifulSoup(resp.text, "html.parser")
     news = []
     for item in soup.select('li.js-stream-content'):
@@ -0,0 +1,88 @@
+"""
+admission.py
+
+Runs the synchronous orchestration pipeline off the event loop in a bounded
+worker pool. Requests beyond the pool size wait in a queue of limited depth;
+once that queue is full new requests are rejected immediately with 503 so
+clients can back off instead of piling up. Every admitted request has a
+deadline covering both its queue wait and its execution.
+"""
+
+import os
+import asyncio
+import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException
+
+logger = logging.getLogger("admission")
+logger.setLevel(logging.INFO)
+
+ORCHESTRATE_WORKERS = int(os.getenv("ORCHESTRATE_WORKERS", "8"))
+ORCHESTRATE_MAX_QUEUE = int(os.getenv("ORCHESTRATE_MAX_QUEUE", "32"))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "60"))
+
+
+class AdmissionController:
+    def __init__(self, max_workers=ORCHESTRATE_WORKERS, max_queue=ORCHESTRATE_MAX_QUEUE, timeout=REQUEST_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="orchestrate")
+        # Admitted work that has not finished yet (running + queued).
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def capacity(self):
+        return self.max_workers + self.max_queue
+
+    def _release(self, _work):
+        with self._lock:
+            self.in_flight -= 1
+
+    def submit(self, fn, *args, **kwargs):
+        # Admit and start the work, or raise 503 straight away if the pool
+        # and its queue are full.
+        with self._lock:
+            admitted = self.in_flight < self.capacity
+            if admitted:
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+        if not admitted:
+            logger.warning("Rejecting request: %d requests in flight (capacity %d)", self.in_flight, self.capacity)
+            raise HTTPException(status_code=503, detail="Server is busy, please retry shortly.",
+                                headers={"Retry-After": "5"})
+        work = self.executor.submit(functools.partial(fn, *args, **kwargs))
+        # The slot is freed when the work really finishes (or is cancelled
+        # before starting), not when the caller gives up waiting on it, so
+        # abandoned work still counts against capacity.
+        work.add_done_callback(self._release)
+        return work
+
+    def expire(self, work, deadline):
+        self.timed_out += 1
+        work.cancel()
+        logger.warning("Request exceeded its %.1fs deadline", deadline)
+
+    async def run(self, fn, *args, timeout=None, **kwargs):
+        work = self.submit(fn, *args, **kwargs)
+        deadline = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(work)), deadline)
+        except asyncio.TimeoutError:
+            self.expire(work, deadline)
+            raise HTTPException(status_code=504, detail="Request deadline exceeded.")
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
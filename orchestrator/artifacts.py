@@ -0,0 +1,146 @@
+"""
+artifacts.py
+
+Short-lived store for generated audio. API responses carry only an artifact
+ID/URL; the bytes are served separately by the /audio/{id} endpoint (with
+HTTP Range support) so they never pass through JSON as base64.
+
+Artifacts are files in ARTIFACT_DIR rather than process memory, so an
+/audio/{id} URL works whichever server worker the client's next request
+reaches (uvicorn --workers, several containers on one volume). Entries
+expire ARTIFACT_TTL seconds after they were written, and the oldest are
+dropped early if the directory grows past ARTIFACT_MAX_BYTES.
+"""
+
+import os
+import re
+import time
+import uuid
+import tempfile
+import threading
+
+ARTIFACT_DIR = os.path.expanduser(os.getenv("ARTIFACT_DIR", "~/.cache/finance_assistant/artifacts"))
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", "900"))
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(256 * 1024 * 1024)))
+# How often a writer sweeps the directory for expired and excess artifacts.
+ARTIFACT_SWEEP_INTERVAL = float(os.getenv("ARTIFACT_SWEEP_INTERVAL", "30"))
+
+# Content type <-> file suffix; the suffix records the type on disk.
+_SUFFIXES = {"audio/mpeg": ".mp3", "audio/wav": ".wav", "application/octet-stream": ".bin"}
+_TYPES = {suffix: content_type for content_type, suffix in _SUFFIXES.items()}
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class ArtifactStore:
+    def __init__(self, directory=ARTIFACT_DIR, ttl=ARTIFACT_TTL, max_bytes=ARTIFACT_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._swept_at = 0.0
+        # As of the last sweep, plus what this process wrote since.
+        self._count = 0
+        self._bytes = 0
+
+    def _path(self, artifact_id, suffix):
+        return os.path.join(self.directory, artifact_id + suffix)
+
+    def put(self, data, content_type="audio/mpeg"):
+        artifact_id = uuid.uuid4().hex
+        suffix = _SUFFIXES.get(content_type, ".bin")
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(artifact_id, suffix))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._count += 1
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes or time.monotonic() - self._swept_at >= ARTIFACT_SWEEP_INTERVAL:
+                self._sweep()
+        return artifact_id
+
+    def get(self, artifact_id):
+        # (data, content_type), or None if unknown or expired.
+        if not _ID_RE.match(artifact_id or ""):
+            return None
+        for suffix, content_type in _TYPES.items():
+            path = self._path(artifact_id, suffix)
+            try:
+                with open(path, "rb") as f:
+                    if time.time() - os.fstat(f.fileno()).st_mtime > self.ttl:
+                        return None
+                    return f.read(), content_type
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _sweep(self):
+        # Expired artifacts, then the oldest until under the cap; any process
+        # sharing the directory may do this, so files can vanish under it.
+        self._swept_at = time.monotonic()
+        cutoff = time.time() - self.ttl
+        files = []
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            name, suffix = os.path.splitext(entry.name)
+            if suffix not in _TYPES and not (suffix == ".tmp" and entry.name.startswith("tmp")):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if st.st_mtime < cutoff:
+                self._unlink(entry.path)
+            elif suffix in _TYPES:
+                files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        while files and total > self.max_bytes and len(files) > 1:
+            _, size, path = files.pop(0)
+            self._unlink(path)
+            total -= size
+        self._count, self._bytes = len(files), total
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {"artifacts": self._count, "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "directory": self.directory}
+
+
+def parse_range(header, size):
+    # Returns (start, end) inclusive for a single "bytes=" range, None when
+    # there is no usable header, or raises ValueError if unsatisfiable.
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start_s, _, end_s = header[len("bytes="):].strip().partition("-")
+    if start_s:
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    elif end_s:
+        start = max(size - int(end_s), 0)
+        end = size - 1
+    else:
+        return None
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise ValueError("unsatisfiable range")
+    return start, end
+
+
+audio_store = ArtifactStore()
@@ -0,0 +1,317 @@
+"""
+fetch_stage.py
+
+Concurrent fan-out of the independent Yahoo Finance / news fetches needed to
+answer a query. All fetches are submitted to a shared, bounded thread pool so
+end-to-end latency is set by the slowest call rather than the sum of all of
+them. Each call has its own timeout and the whole stage has an overall
+deadline; whatever finished in time is returned.
+"""
+
+import os
+import re
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from agents import api_agent, scraping_agent, analysis_agent, risk_engine
+from agents.cache import yahoo_cache
+from agents.earnings_screener import screen_earnings
+from orchestrator.telemetry import payload_bytes
+
+logger = logging.getLogger("fetch_stage")
+logger.setLevel(logging.INFO)
+
+FETCH_MAX_WORKERS = int(os.getenv("FETCH_MAX_WORKERS", "16"))
+FETCH_CALL_TIMEOUT = float(os.getenv("FETCH_CALL_TIMEOUT", "8"))
+FETCH_DEADLINE = float(os.getenv("FETCH_DEADLINE", "12"))
+NEWS_PER_QUERY = int(os.getenv("NEWS_PER_QUERY", "10"))
+
+# Queries that get the portfolio risk engine's numbers when holdings are set.
+_EXPOSURE_RE = re.compile(r"\b(exposure|exposed|risk|portfolio|holdings?|positions?|var)\b", re.IGNORECASE)
+# Sector/industry/region questions about results that get the earnings screener.
+_EARNINGS_RE = re.compile(r"\b(earnings|eps|beat|beats|missed|misses|surprises?|estimates?)\b", re.IGNORECASE)
+
+_executor = ThreadPoolExecutor(max_workers=FETCH_MAX_WORKERS, thread_name_prefix="fetch")
+
+# Value used for a fetch that failed to finish in time, matching what the
+# agents themselves return on error.
+_EMPTY = {"ticker": dict, "ticker_batch": dict, "sector": dict, "industry": dict, "market": dict, "news": list,
+          "exposure": dict, "earnings": dict}
+
+
+def _as_list(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [v for v in value if v]
+    return [value]
+
+
+def _run_task(kind, arg, logs):
+    if kind == "ticker":
+        return api_agent.fetch_ticker_data(arg, logs)
+    if kind == "ticker_batch":
+        return api_agent.fetch_multiple_tickers_data(list(arg), logs, batched=True)
+    if kind == "sector":
+        return api_agent.fetch_sector_data(arg, logs)
+    if kind == "industry":
+        return api_agent.fetch_industry_data(arg, logs)
+    if kind == "market":
+        return api_agent.fetch_market_summary(arg, logs)
+    if kind == "news":
+        return scraping_agent.get_news(arg, count=NEWS_PER_QUERY, logs=logs)
+    if kind == "exposure":
+        return analysis_agent.calculate_exposure(None, sector=arg[0], region=arg[1], logs=logs)
+    if kind == "earnings":
+        return screen_earnings(sector=arg[0], industry=arg[1], region=arg[2], logs=logs)
+    raise ValueError(f"Unknown fetch kind: {kind}")
+
+
+def _is_batched(ticker):
+    return isinstance(ticker, (list, tuple, set)) and len(_as_list(ticker)) >= api_agent.BATCH_MIN_TICKERS
+
+
+def news_queries_for(query, entities):
+    news_queries = [query]
+    for field in ("ticker", "sector", "industry", "region"):
+        news_queries.extend(_as_list(entities.get(field)))
+    # Preserve order while dropping duplicates.
+    return list(dict.fromkeys(str(nq) for nq in news_queries if nq))
+
+
+def _exposure_arg(entities):
+    return (tuple(_as_list(entities.get("sector"))) or None, tuple(_as_list(entities.get("region"))) or None)
+
+
+def _earnings_arg(entities):
+    return tuple(tuple(_as_list(entities.get(field))) or None for field in ("sector", "industry", "region"))
+
+
+def build_fetch_plan(query, entities):
+    # A plan is an ordered, de-duplicated list of (kind, arg) tasks.
+    plan = []
+    tickers = _as_list(entities.get("ticker"))
+    if _is_batched(entities.get("ticker")):
+        plan.append(("ticker_batch", tuple(tickers)))
+    else:
+        for ticker in tickers:
+            plan.append(("ticker", ticker))
+    for sector in _as_list(entities.get("sector")):
+        plan.append(("sector", sector))
+    for industry in _as_list(entities.get("industry")):
+        plan.append(("industry", industry))
+    for region in _as_list(entities.get("region")):
+        plan.append(("market", region))
+    for nq in news_queries_for(query, entities):
+        plan.append(("news", nq))
+    if risk_engine.PORTFOLIO_HOLDINGS_PATH and _EXPOSURE_RE.search(query or ""):
+        plan.append(("exposure", _exposure_arg(entities)))
+    if any(_earnings_arg(entities)) and _EARNINGS_RE.search(query or ""):
+        plan.append(("earnings", _earnings_arg(entities)))
+    return list(dict.fromkeys(plan))
+
+
+def build_batch_plan(plans):
+    # One plan covering several queries' plans, each task once. Their
+    # ticker_batch tasks are folded into a single bulk download of every
+    # symbol involved, and single "ticker" tasks for symbols that download
+    # already covers are dropped; results_for_plan() maps both back per query.
+    tasks = list(dict.fromkeys(task for plan in plans for task in plan))
+    batches = [arg for kind, arg in tasks if kind == "ticker_batch"]
+    if batches:
+        symbols = tuple(dict.fromkeys(str(t).upper() for arg in batches for t in arg))
+        tasks = [task for task in tasks if task[0] != "ticker_batch"
+                 and not (task[0] == "ticker" and str(task[1]).upper() in symbols)] + [("ticker_batch", symbols)]
+    return tasks
+
+
+def _slice_ticker_batch(result, tickers):
+    wanted = {str(t).upper() for t in tickers}
+    return {field: [s for s in value if s in wanted] if isinstance(value, list)
+            else {s: v for s, v in value.items() if s in wanted}
+            for field, value in result.items()}
+
+
+def _ticker_from_batch(result, ticker):
+    # A single-ticker result (fetch_ticker_data's shape) cut from a bulk
+    # download, or None if the download didn't cover it. The bulk path has
+    # no per-ticker news; the plan's news search for the symbol covers that.
+    symbol = str(ticker).upper()
+    if symbol not in result.get("latest_price", {}):
+        return None
+    return {
+        "info": result.get("info", {}).get(symbol, {}),
+        "latest_price": result["latest_price"][symbol],
+        "history": result.get("history", {}).get(symbol, {}),
+        "news": [],
+    }
+
+
+def results_for_plan(plan, results):
+    # One query's share of the results of a batch plan, keyed by its own
+    # plan's tasks so assemble_fetched_data() can use it as is.
+    own = {}
+    combined = next((r for (kind, _), r in results.items() if kind == "ticker_batch" and r), None)
+    for task in plan:
+        if task in results:
+            own[task] = results[task]
+        elif combined is None:
+            continue
+        elif task[0] == "ticker_batch":
+            own[task] = _slice_ticker_batch(combined, task[1])
+        elif task[0] == "ticker":
+            ticker_result = _ticker_from_batch(combined, task[1])
+            if ticker_result is not None:
+                own[task] = ticker_result
+    return own
+
+
+def _entity_label(arg):
+    if isinstance(arg, (list, tuple, set)):
+        return ",".join(_entity_label(a) for a in arg if a)
+    return str(arg)
+
+
+def run_fetch_plan(plan, logs=None, call_timeout=None, deadline=None, on_result=None, trace=None):
+    # on_result(kind, arg, result) is called as each fetch completes; result
+    # is None for fetches that failed or timed out. With a trace, each fetch
+    # records a span (cache_hit: every cache lookup it made was served).
+    call_timeout = FETCH_CALL_TIMEOUT if call_timeout is None else call_timeout
+    deadline = FETCH_DEADLINE if deadline is None else deadline
+    stage_start = time.monotonic()
+    stage_end = stage_start + deadline
+    started = {}
+    abandoned = set()
+
+    def timed(task):
+        started[task] = time.monotonic()
+        if trace is None:
+            return _run_task(task[0], task[1], logs)
+        result = error = None
+        with yahoo_cache.track() as lookups:
+            try:
+                result = _run_task(task[0], task[1], logs)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                # A fetch that already timed out has had its span recorded.
+                if task not in abandoned:
+                    trace.record(f"fetch.{task[0]}", time.monotonic() - started[task], entity=_entity_label(task[1]),
+                                 bytes_out=None if error else payload_bytes(result),
+                                 cache_hit=all(outcome != "miss" for _, outcome in lookups) if lookups else None,
+                                 error=error, start=started[task])
+        return result
+
+    futures = {_executor.submit(timed, task): task for task in plan}
+    pending = set(futures)
+    results = {}
+    timed_out = []
+
+    while pending:
+        now = time.monotonic()
+        if now >= stage_end:
+            break
+        for fut in list(pending):
+            task = futures[fut]
+            if not fut.done() and task in started and now - started[task] >= call_timeout:
+                pending.discard(fut)
+                timed_out.append(task)
+        if not pending:
+            break
+        expiries = [started[futures[f]] + call_timeout for f in pending if futures[f] in started]
+        wake_at = min(expiries + [stage_end])
+        done, _ = wait(pending, timeout=max(wake_at - now, 0.01), return_when=FIRST_COMPLETED)
+        for fut in done:
+            pending.discard(fut)
+            task = futures[fut]
+            try:
+                results[task] = fut.result()
+            except Exception as e:
+                logger.error("Fetch %s(%s) failed: %s", task[0], task[1], e)
+                if logs is not None:
+                    logs.append(f"Fetch {task[0]}({task[1]}) failed: {e}")
+            if on_result is not None:
+                on_result(task[0], task[1], results.get(task))
+
+    for fut in pending:
+        fut.cancel()
+        timed_out.append(futures[fut])
+    for kind, arg in timed_out:
+        logger.warning("Fetch %s(%s) timed out", kind, arg)
+        if logs is not None:
+            logs.append(f"Fetch {kind}({arg}) timed out")
+        if trace is not None:
+            abandoned.add((kind, arg))
+            begun = started.get((kind, arg), stage_start)
+            trace.record(f"fetch.{kind}", time.monotonic() - begun, entity=_entity_label(arg), error="timeout",
+                         start=begun)
+        if on_result is not None:
+            on_result(kind, arg, None)
+
+    elapsed = time.monotonic() - stage_start
+    logger.info("Fetch stage: %d/%d completed in %.2fs", len(results), len(plan), elapsed)
+    if logs is not None:
+        logs.append(f"Fetch stage: {len(results)}/{len(plan)} completed in {elapsed:.2f}s")
+    return results
+
+
+def _result(results, kind, arg):
+    if (kind, arg) in results:
+        return results[(kind, arg)]
+    return _EMPTY[kind]()
+
+
+def _keyed(results, kind, value):
+    # Single entity -> its result, list of entities -> dict keyed by entity,
+    # mirroring the shape orchestrate has always produced for tickers.
+    if isinstance(value, (list, tuple, set)):
+        return {arg: _result(results, kind, arg) for arg in _as_list(value)}
+    return _result(results, kind, value)
+
+
+def assemble_fetched_data(query, entities, results, logs=None, news_top_n=None):
+    fetched_data = {}
+
+    ticker = entities.get("ticker")
+    if ticker:
+        if _is_batched(ticker):
+            fetched_data["ticker_data"] = _result(results, "ticker_batch", tuple(_as_list(ticker)))
+        else:
+            fetched_data["ticker_data"] = _keyed(results, "ticker", ticker)
+
+    sector = entities.get("sector")
+    if sector:
+        fetched_data["sector_data"] = _keyed(results, "sector", sector)
+
+    industry = entities.get("industry")
+    if industry:
+        fetched_data["industry_data"] = _keyed(results, "industry", industry)
+
+    region = entities.get("region")
+    if region:
+        if isinstance(region, (list, tuple, set)):
+            for reg in _as_list(region):
+                fetched_data[f"market_{reg}"] = _result(results, "market", reg)
+        else:
+            fetched_data["market_summary"] = _result(results, "market", region)
+
+    if ("exposure", _exposure_arg(entities)) in results:
+        fetched_data["portfolio_exposure"] = results[("exposure", _exposure_arg(entities))]
+
+    if ("earnings", _earnings_arg(entities)) in results:
+        fetched_data["earnings_screen"] = results[("earnings", _earnings_arg(entities))]
+
+    news = []
+    for nq in news_queries_for(query, entities):
+        news.extend(_result(results, "news", nq) or [])
+    fetched_data["news"] = scraping_agent.merge_news(news, entities, top_n=news_top_n, logs=logs)
+    return fetched_data
+
+
+def fetch_all(query, entities, logs=None, call_timeout=None, deadline=None, on_result=None, news_top_n=None,
+              trace=None):
+    plan = build_fetch_plan(query, entities)
+    results = run_fetch_plan(plan, logs, call_timeout=call_timeout, deadline=deadline, on_result=on_result,
+                             trace=trace)
+    return assemble_fetched_data(query, entities, results, logs, news_top_n=news_top_n)
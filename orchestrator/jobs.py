@@ -0,0 +1,516 @@
+"""
+jobs.py
+
+Asynchronous jobs for long-running queries. POST /jobs/ queues a query (or
+a batch of them) and returns a job ID straight away; clients poll
+GET /jobs/{id} or follow /jobs/{id}/events rather than holding a request
+open for the whole orchestrate run, so a proxy timeout no longer throws
+finished work away.
+
+Jobs are persisted in SQLite (JOBS_DB_PATH) and run in worker processes,
+off the web workers' threads. Each priority lane has its own process pool -
+"interactive" (JOB_INTERACTIVE_WORKERS) and "batch" (JOB_BATCH_WORKERS) -
+so heavy batch work never holds up interactive jobs; within a lane jobs
+run oldest first. A queued job is cancelled at once, a running one at its
+next pipeline stage. Finished jobs (status, result, events and audio) are
+kept for JOB_RETENTION seconds.
+
+API keys stay in memory: they are never written to the database and are
+scrubbed from stored results and events. So a job only ever runs on the
+server process it was submitted to, which owns it and renews its lease
+every JOB_HEARTBEAT seconds while it is queued or running; any process
+sharing the database can still report on or cancel it. A job whose server
+stops (a restart or a crash) cannot be resumed without its keys: once its
+lease has gone JOB_LEASE seconds without renewal, the next server to look
+fails it, and it has to be submitted again.
+"""
+
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import functools
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from fastapi import HTTPException
+from orchestrator.rag_orchestrator import Cancelled
+
+logger = logging.getLogger("jobs")
+logger.setLevel(logging.INFO)
+
+JOBS_DB_PATH = os.path.expanduser(os.getenv("JOBS_DB_PATH", "~/.cache/finance_assistant/jobs.sqlite3"))
+JOB_INTERACTIVE_WORKERS = int(os.getenv("JOB_INTERACTIVE_WORKERS", "2"))
+JOB_BATCH_WORKERS = int(os.getenv("JOB_BATCH_WORKERS", "1"))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600)))
+# "spawn" keeps worker processes clear of the web process's threads and locks.
+JOB_START_METHOD = os.getenv("JOB_START_METHOD", "spawn")
+# How often a running job checks whether it has been cancelled.
+JOB_CANCEL_POLL = float(os.getenv("JOB_CANCEL_POLL", "0.5"))
+# How often a server renews the lease on the jobs it owns, and how long a
+# lease lasts without renewal before its jobs are given up as lost.
+JOB_HEARTBEAT = float(os.getenv("JOB_HEARTBEAT", "5"))
+JOB_LEASE = float(os.getenv("JOB_LEASE", "60"))
+
+LANES = ("interactive", "batch")
+FINISHED = ("succeeded", "failed", "cancelled")
+REDACTED = "[redacted]"
+LOST = "The server running this job stopped before it finished; submit it again."
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    lane TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, lane, created_at);
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id);
+CREATE TABLE IF NOT EXISTS job_audio (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+
+def _connect(path):
+    if path != ":memory:":
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+def _scrub(text, secrets):
+    for secret in secrets:
+        # Very short values would redact ordinary text.
+        if secret and len(secret) >= 8:
+            text = text.replace(secret, REDACTED)
+    return text
+
+
+def _migrate(db):
+    # Columns added since the first release of the schema.
+    columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+    for column, kind in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+        if column not in columns:
+            try:
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+            except sqlite3.OperationalError as e:
+                # Another process sharing the database got there first.
+                if "duplicate column" not in str(e):
+                    raise
+
+
+def _owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+# --- worker process side ---
+
+def _init_worker():
+    # Settings come from the parent's environment (dotenv included); warm
+    # the heavy imports and clients the way a web worker would.
+    from orchestrator import warmup
+    warmup.start()
+
+
+class _JobEvents:
+    # on_event for a job's run in its worker process: records every stage
+    # except answer tokens for /jobs/{id}/events, and raises Cancelled on the
+    # run's own thread once the job has been cancelled.
+    def __init__(self, path, job_id, secrets):
+        self.job_id = job_id
+        self.secrets = secrets
+        self.thread = threading.current_thread()
+        self._conn = _connect(path)
+        self._lock = threading.Lock()
+        self._checked = time.monotonic()
+
+    def __call__(self, stage, payload):
+        if stage == "audio":
+            payload = {"seq": payload["seq"], "bytes": len(payload["audio_bytes"] or b"")}
+        with self._lock:
+            if stage != "llm_token":
+                with self._conn:
+                    self._conn.execute("INSERT INTO job_events (job_id, stage, payload, at) VALUES (?, ?, ?, ?)",
+                                       (self.job_id, stage, _scrub(json.dumps(payload, default=str), self.secrets),
+                                        time.time()))
+            if threading.current_thread() is not self.thread or time.monotonic() - self._checked < JOB_CANCEL_POLL:
+                return
+            self._checked = time.monotonic()
+            row = self._conn.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (self.job_id,)).fetchone()
+        if row is None or row[0]:
+            raise Cancelled(f"Job {self.job_id} was cancelled")
+
+    def close(self):
+        self._conn.close()
+
+
+def _job_body(job_id, idx, result):
+    from agents.prompt_compactor import to_plain
+    return {
+        "text": result["text"],
+        "audio_url": f"/jobs/{job_id}/audio/{idx}" if result["audio_bytes"] else None,
+        "logs": result.get("logs", []),
+        "plan": result.get("plan", []),
+        "data": to_plain(result.get("data", {})),
+        "cached": result.get("cached", False),
+        "trace": result.get("trace", [])
+    }
+
+
+def _run_job(path, job_id, kind, payload, gemini_api_key, elevenlabs_api_key):
+    # Runs in a worker process; returns the JSON result and the audio of
+    # each answer, in order.
+    from orchestrator.rag_orchestrator import orchestrate, orchestrate_batch
+    on_event = _JobEvents(path, job_id, (gemini_api_key, elevenlabs_api_key))
+    try:
+        if kind == "query":
+            result = orchestrate(payload["query"], gemini_api_key, elevenlabs_api_key, payload["voice_id"],
+                                 on_event=on_event, use_cache=payload["use_cache"])
+            return _job_body(job_id, 0, result), [result["audio_bytes"]]
+        batch = orchestrate_batch(payload["queries"], gemini_api_key, elevenlabs_api_key, payload["voice_id"],
+                                  use_cache=payload["use_cache"], on_event=on_event)
+    finally:
+        on_event.close()
+    results = [{"query": query, **_job_body(job_id, idx, result), "error": result.get("error")}
+               for idx, (query, result) in enumerate(zip(payload["queries"], batch["results"]))]
+    return ({"results": results, "logs": batch["logs"], "trace": batch["trace"]},
+            [result["audio_bytes"] for result in batch["results"]])
+
+
+# --- web process side ---
+
+class JobQueue:
+    def __init__(self, path=JOBS_DB_PATH, workers=None, retention=JOB_RETENTION, max_queued=JOB_MAX_QUEUED):
+        self.path = path
+        self.workers = workers or {"interactive": JOB_INTERACTIVE_WORKERS, "batch": JOB_BATCH_WORKERS}
+        self.retention = retention
+        self.max_queued = max_queued
+        self.counters = {status: 0 for status in FINISHED}
+        self._queued = dict.fromkeys(LANES, 0)
+        # One connection per thread (request threads, completions, the
+        # heartbeat), so database work never waits on _lock, which only
+        # guards the in-memory state below.
+        self._local = threading.local()
+        self._migrated = False
+        self._pools = {}
+        self._running = {lane: {} for lane in LANES}
+        self._keys = {}
+        self._lock = threading.RLock()
+        self._purged_at = 0.0
+        self.owner = _owner_id()
+        self._stop = threading.Event()
+        self._heartbeat = None
+        # Completions are handled here rather than in the process pools' own
+        # management threads, which must not submit work themselves.
+        self._completions = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-completion")
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = _connect(self.path)
+            if not self._migrated:
+                db.executescript(_SCHEMA)
+                _migrate(db)
+                self._migrated = True
+        return db
+
+    def _pool(self, lane):
+        context = multiprocessing.get_context(JOB_START_METHOD)
+        return ProcessPoolExecutor(max_workers=max(1, self.workers[lane]), mp_context=context,
+                                   initializer=_init_worker)
+
+    def start(self):
+        with self._lock:
+            if self._pools:
+                return
+            # A fresh identity, in case this process was forked from one
+            # that had already created the queue.
+            self.owner = _owner_id()
+            self._reap(self._db())
+            self._count_queued(self._db())
+            self._pools = {lane: self._pool(lane) for lane in LANES}
+            self._stop.clear()
+            self._heartbeat = threading.Thread(target=self._renew, name="job-heartbeat", daemon=True)
+            self._heartbeat.start()
+            self._dispatch()
+
+    def shutdown(self):
+        # Jobs still queued or running are lost with their keys, so their
+        # workers are stopped rather than waited for; their leases lapse and
+        # whichever server looks next fails them.
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        self._stop.set()
+        self._completions.shutdown(wait=False)
+        for pool in pools.values():
+            processes = list((getattr(pool, "_processes", None) or {}).values())
+            pool.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                process.terminate()
+
+    def _renew(self):
+        # Heartbeat thread: renew the lease on this process's jobs, give up
+        # the jobs of servers whose leases have lapsed, purge expired jobs
+        # and refresh the queue counts reported by stats().
+        while not self._stop.wait(JOB_HEARTBEAT):
+            try:
+                db = self._db()
+                with db:
+                    db.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                               (time.time(), self.owner))
+                self._reap(db)
+                self._purge(db)
+                self._count_queued(db)
+            except sqlite3.Error as e:
+                logger.error("Renewing job leases failed: %s", e)
+
+    def _count_queued(self, db):
+        queued = dict.fromkeys(LANES, 0)
+        queued.update(db.execute("SELECT lane, COUNT(*) FROM jobs WHERE status = 'queued' GROUP BY lane").fetchall())
+        self._queued = queued
+
+    def _reap(self, db):
+        # Fail the unfinished jobs of other servers whose leases have lapsed
+        # (including jobs from before leases were recorded): their keys are
+        # gone with them.
+        expired = time.time() - JOB_LEASE
+        rows = db.execute("SELECT id, cancel_requested FROM jobs WHERE status IN ('queued', 'running') "
+                          "AND (owner IS NULL OR owner != ?) AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                          (self.owner, expired)).fetchall()
+        lost = 0
+        for job_id, cancel_requested in rows:
+            if cancel_requested:
+                lost += self._finish(job_id, "cancelled", expired=expired)
+            else:
+                lost += self._finish(job_id, "failed", error=LOST, expired=expired)
+        if lost:
+            logger.warning("Gave up %d jobs whose server stopped", lost)
+
+    def _event(self, db, job_id, stage, payload):
+        db.execute("INSERT INTO job_events (job_id, stage, payload, at) VALUES (?, ?, ?, ?)",
+                   (job_id, stage, json.dumps(payload), time.time()))
+
+    def submit(self, kind, payload, gemini_api_key, elevenlabs_api_key, lane="interactive"):
+        if lane not in LANES:
+            raise HTTPException(status_code=400, detail=f"lane must be one of: {', '.join(LANES)}.")
+        job_id = uuid.uuid4().hex
+        db = self._db()
+        queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if queued >= self.max_queued:
+            logger.warning("Rejecting job: %d jobs queued (limit %d)", queued, self.max_queued)
+            raise HTTPException(status_code=503, detail="Job queue is full, please retry shortly.",
+                                headers={"Retry-After": "30"})
+        # Keys first: a dispatch running on another thread may see the row
+        # as soon as it is committed.
+        with self._lock:
+            self._keys[job_id] = (gemini_api_key, elevenlabs_api_key)
+        with db:
+            now = time.time()
+            db.execute("INSERT INTO jobs (id, kind, lane, status, payload, created_at, owner, heartbeat_at) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (job_id, kind, lane, "queued", json.dumps(payload), now, self.owner, now))
+            self._event(db, job_id, "status", {"status": "queued"})
+        logger.info("Queued %s job %s on the %s lane", kind, job_id, lane)
+        self._dispatch()
+        return self.get(job_id)
+
+    def _dispatch(self):
+        # Start the oldest queued jobs this process owns in each lane, while
+        # the lane has free workers. Only small claim statements run under
+        # the lock.
+        with self._lock:
+            if not self._pools:
+                return
+            db = self._db()
+            for lane, pool in self._pools.items():
+                while len(self._running[lane]) < max(1, self.workers[lane]):
+                    row = db.execute("SELECT id, kind, payload FROM jobs WHERE status = 'queued' AND lane = ? "
+                                     "AND owner = ? ORDER BY created_at LIMIT 1", (lane, self.owner)).fetchone()
+                    if row is None:
+                        break
+                    job_id, kind, payload = row
+                    keys = self._keys.pop(job_id, None)
+                    if keys is None:
+                        self._finish(job_id, "failed", error=LOST)
+                        continue
+                    # Claim the job; a cancel may have got to it first.
+                    now = time.time()
+                    with db:
+                        claimed = db.execute("UPDATE jobs SET status = 'running', owner = ?, started_at = ?, "
+                                             "heartbeat_at = ? WHERE id = ? AND status = 'queued'",
+                                             (self.owner, now, now, job_id)).rowcount
+                        if claimed:
+                            self._event(db, job_id, "status", {"status": "running"})
+                    if not claimed:
+                        continue
+                    future = pool.submit(_run_job, self.path, job_id, kind, json.loads(payload), *keys)
+                    self._running[lane][job_id] = future
+                    future.add_done_callback(functools.partial(self._on_done, pool, lane, job_id, keys))
+
+    def _on_done(self, *args):
+        try:
+            self._completions.submit(self._completed, *args)
+        except RuntimeError:
+            # Shutting down; the job is requeued on next start.
+            pass
+
+    def _completed(self, pool, lane, job_id, keys, future):
+        # Runs on the completion thread; the result and its audio are stored
+        # without holding _lock.
+        with self._lock:
+            self._running[lane].pop(job_id, None)
+        try:
+            result, audio = future.result()
+        except Cancelled:
+            self._finish(job_id, "cancelled")
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory), failing every job
+            # in its pool; replace the pool once.
+            logger.error("Worker pool for the %s lane broke running job %s: %s", lane, job_id, e)
+            self._finish(job_id, "failed", error="The worker process running this job exited unexpectedly.")
+            with self._lock:
+                if self._pools.get(lane) is pool:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self._pools[lane] = self._pool(lane)
+        except Exception as e:
+            logger.error("Job %s failed: %s", job_id, e)
+            self._finish(job_id, "failed", error=_scrub(f"{type(e).__name__}: {e}", keys))
+        else:
+            row = self._db().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is not None and row[0]:
+                # Cancelled after its last stage; the answer is discarded.
+                self._finish(job_id, "cancelled")
+            else:
+                self._finish(job_id, "succeeded", result=_scrub(json.dumps(result, default=str), keys),
+                             audio=audio)
+        self._dispatch()
+
+    def _finish(self, job_id, status, result=None, error=None, audio=None, previous=("queued", "running"),
+                expired=None):
+        # Move the job from one of the previous statuses (and, for expired,
+        # only if its lease lapsed before then) to a finished one; returns
+        # whether it did. One short transaction on this thread's connection.
+        db = self._db()
+        marks = ",".join("?" * len(previous))
+        query = (f"UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? "
+                 f"WHERE id = ? AND status IN ({marks})")
+        params = [status, result, error, time.time(), job_id, *previous]
+        if expired is not None:
+            query += " AND (heartbeat_at IS NULL OR heartbeat_at < ?)"
+            params.append(expired)
+        with db:
+            if not db.execute(query, params).rowcount:
+                return False
+            db.executemany("INSERT OR REPLACE INTO job_audio (job_id, idx, data) VALUES (?, ?, ?)",
+                           [(job_id, idx, data) for idx, data in enumerate(audio or []) if data])
+            self._event(db, job_id, "status", {"status": status, "error": error})
+        with self._lock:
+            self._keys.pop(job_id, None)
+            self.counters[status] += 1
+        logger.info("Job %s %s", job_id, status)
+        return True
+
+    def cancel(self, job_id):
+        # Returns the job, or None if there is no such job.
+        # The job may belong to another server process sharing the database;
+        # both transitions are conditional, so a job claimed meanwhile is
+        # asked to stop instead.
+        db = self._db()
+        if db.execute("SELECT 1 FROM jobs WHERE id = ?", (job_id,)).fetchone() is None:
+            return None
+        if not self._finish(job_id, "cancelled", previous=("queued",)):
+            with db:
+                if db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running' "
+                              "AND cancel_requested = 0", (job_id,)).rowcount:
+                    self._event(db, job_id, "status", {"status": "cancelling"})
+        return self.get(job_id)
+
+    def get(self, job_id, include_result=True):
+        db = self._db()
+        row = db.execute("SELECT kind, lane, status, payload, result, error, cancel_requested, created_at, "
+                         "started_at, finished_at FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        kind, lane, status, payload, result, error, cancel_requested, created_at, started_at, finished_at = row
+        job = {"job_id": job_id, "kind": kind, "lane": lane, "status": status,
+               "cancel_requested": bool(cancel_requested), "created_at": created_at, "started_at": started_at,
+               "finished_at": finished_at, "error": error}
+        payload = json.loads(payload)
+        job.update({field: payload[field] for field in ("query", "queries") if field in payload})
+        if status == "queued":
+            job["queue_position"] = db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND lane = ? AND created_at <= ?",
+                (lane, created_at)).fetchone()[0]
+        if include_result and result is not None:
+            job["result"] = json.loads(result)
+        return job
+
+    def events(self, job_id, after=0):
+        # [(event id, stage, payload)] recorded after the given event id.
+        rows = self._db().execute("SELECT id, stage, payload FROM job_events WHERE job_id = ? AND id > ? "
+                                  "ORDER BY id", (job_id, after)).fetchall()
+        return [(event_id, stage, json.loads(payload)) for event_id, stage, payload in rows]
+
+    def audio(self, job_id, idx):
+        row = self._db().execute("SELECT data FROM job_audio WHERE job_id = ? AND idx = ?",
+                                 (job_id, idx)).fetchone()
+        return row[0] if row is not None else None
+
+    def _purge(self, db):
+        # Finished jobs past retention, at most once a minute.
+        now = time.time()
+        if now - self._purged_at < 60:
+            return
+        self._purged_at = now
+        with db:
+            expired = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') AND finished_at < ?",
+                (now - self.retention,)).fetchall()]
+            for start in range(0, len(expired), 500):
+                chunk = expired[start:start + 500]
+                marks = ",".join("?" * len(chunk))
+                for table, column in (("job_audio", "job_id"), ("job_events", "job_id"), ("jobs", "id")):
+                    db.execute(f"DELETE FROM {table} WHERE {column} IN ({marks})", chunk)
+        if expired:
+            logger.info("Purged %d expired jobs", len(expired))
+
+    def stats(self):
+        # No database access: /health and /metrics call this on the event
+        # loop. Queue counts are as of the last heartbeat.
+        with self._lock:
+            return {
+                "started": bool(self._pools),
+                "workers": {lane: max(1, n) for lane, n in self.workers.items()},
+                "queued": dict(self._queued),
+                "running": {lane: len(self._running[lane]) for lane in LANES},
+                "finished": dict(self.counters),
+            }
+
+
+job_queue = JobQueue()
@@ -1,26 +1,219 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from orchestrator.rag_orchestrator import orchestrate
-from agents.voice_agent import speech_to_text
-import base64
+from dotenv import load_dotenv
+# Before the agent imports below: they read their settings at import time.
+load_dotenv()
 
-app = FastAPI()
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from orchestrator.rag_orchestrator import orchestrate, orchestrate_batch
+from agents.voice_agent import speech_to_text, get_tts_cache_stats
+from agents import api_agent, language_agent
+from agents.prompt_compactor import compact_fetched_data, to_plain
+from orchestrator.admission import AdmissionController
+from orchestrator.artifacts import audio_store, parse_range
+from orchestrator.response_cache import response_cache
+from agents.earnings_screener import earnings_screener
+from agents.cache import yahoo_cache
+from orchestrator.telemetry import Trace, metrics, payload_bytes
+from orchestrator import warmup
+from orchestrator.jobs import job_queue, FINISHED as JOB_FINISHED
+from agents import lazy, clients, resilience
+from contextlib import asynccontextmanager
+import asyncio
+import os
+import json
+import math
+import time
+
+@asynccontextmanager
+async def lifespan(app):
+    warmup.start()
+    job_queue.start()
+    yield
+    job_queue.shutdown()
+    clients.close_clients()
+
+app = FastAPI(lifespan=lifespan)
+admission = AdmissionController()
+
+metrics.gauge("admission_in_flight", "Requests admitted and not yet finished.", lambda: admission.in_flight)
+metrics.gauge("admission_capacity", "Requests that may be running or queued at once.", lambda: admission.capacity)
+metrics.gauge("admission_rejected_total", "Requests rejected with 503 because the queue was full.",
+              lambda: admission.rejected, kind="counter")
+metrics.gauge("admission_timed_out_total", "Requests that exceeded the admission deadline.",
+              lambda: admission.timed_out, kind="counter")
+metrics.gauge("yahoo_cache_lookups_total", "Yahoo cache lookups by data kind and result.",
+              lambda: {(kind, result): counters[result] for kind, counters in yahoo_cache.stats()["kinds"].items()
+                       for result in ("hits", "stale_hits", "misses", "coalesced")},
+              labels=("kind", "result"), kind="counter")
+metrics.gauge("upstream_calls_total", "Upstream call attempts and their failures, retries and rejections.",
+              lambda: {(name, event): stats[event] for name, stats in resilience.stats().items()
+                       for event in ("calls", "retries", "failures", "throttled", "short_circuited", "rate_limited")},
+              labels=("upstream", "event"), kind="counter")
+metrics.gauge("upstream_circuit_open", "1 while an upstream's circuit breaker is open or probing.",
+              lambda: {(name,): int(stats["state"] != "closed") for name, stats in resilience.stats().items()},
+              labels=("upstream",))
+metrics.gauge("jobs_queued", "Jobs waiting for a worker, by lane.",
+              lambda: {(lane,): n for lane, n in job_queue.stats()["queued"].items()}, labels=("lane",))
+metrics.gauge("jobs_running", "Jobs running in worker processes, by lane.",
+              lambda: {(lane,): n for lane, n in job_queue.stats()["running"].items()}, labels=("lane",))
+metrics.gauge("jobs_finished_total", "Jobs finished since startup, by outcome.",
+              lambda: {(status,): n for status, n in job_queue.stats()["finished"].items()},
+              labels=("status",), kind="counter")
+metrics.gauge("yahoo_cache_bytes", "Estimated size of the Yahoo cache.", lambda: yahoo_cache.stats()["bytes"])
+
+def _voice_pipeline(audio_bytes, gemini_api_key, elevenlabs_api_key, voice_id, on_event=None, use_cache=True):
+    trace = Trace()
+    with trace.span("stt", bytes_in=payload_bytes(audio_bytes)) as span:
+        query = speech_to_text(audio_bytes, elevenlabs_api_key)
+        span["bytes_out"] = payload_bytes(query)
+        if not query:
+            span["error"] = "empty transcript"
+    if on_event is not None:
+        on_event("transcript", {"text": query})
+    return orchestrate(query, gemini_api_key, elevenlabs_api_key, voice_id, on_event=on_event, use_cache=use_cache,
+                       trace=trace)
+
+AUDIO_STREAM_CHUNK = 64 * 1024
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "50"))
+# A batch takes one admission slot but does many queries' work.
+BATCH_REQUEST_TIMEOUT = float(os.getenv("BATCH_REQUEST_TIMEOUT", "300"))
+JOB_EVENTS_POLL = float(os.getenv("JOB_EVENTS_POLL", "0.5"))
+
+def _publish_audio(audio_bytes):
+    if not audio_bytes:
+        return {"audio_id": None, "audio_url": None}
+    audio_id = audio_store.put(audio_bytes, "audio/mpeg")
+    return {"audio_id": audio_id, "audio_url": f"/audio/{audio_id}"}
+
+def _response_body(result):
+    return {
+        "text": result["text"],
+        **_publish_audio(result["audio_bytes"]),
+        "logs": result.get("logs", []),
+        "plan": result.get("plan", []),
+        "data": to_plain(result.get("data", {})),
+        "cached": result.get("cached", False),
+        "trace": result.get("trace", [])
+    }
+
+def _parse_queries(raw):
+    # A JSON array of strings, or one query per line.
+    try:
+        parsed = json.loads(raw)
+    except ValueError:
+        parsed = raw.splitlines()
+    if isinstance(parsed, str):
+        parsed = [parsed]
+    if not isinstance(parsed, list) or not all(isinstance(q, str) for q in parsed):
+        raise HTTPException(status_code=400, detail="queries must be a JSON array of strings or one query per line.")
+    queries = [q.strip() for q in parsed if q.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="No queries given.")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch.")
+    return queries
+
+def _sse(stage, payload):
+    return f"event: {stage}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+def _stream_pipeline(fn, *args, **kwargs):
+    # Server-sent events: one event per pipeline stage as it completes,
+    # followed by "done" (or "error"). Admission happens before the response
+    # starts so a saturated server still answers 503.
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_event(stage, payload):
+        if stage == "audio":
+            # Segments go to the artifact store; the event carries only a URL.
+            payload = {"seq": payload["seq"], **_publish_audio(payload["audio_bytes"])}
+        loop.call_soon_threadsafe(events.put_nowait, (stage, payload))
+
+    work = admission.submit(fn, *args, on_event=on_event, **kwargs)
+    work.add_done_callback(lambda _: loop.call_soon_threadsafe(events.put_nowait, None))
+
+    async def stream():
+        deadline = loop.time() + admission.timeout
+        while True:
+            try:
+                item = await asyncio.wait_for(events.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                admission.expire(work, admission.timeout)
+                yield _sse("error", {"detail": "Request deadline exceeded."})
+                return
+            if item is None:
+                break
+            yield _sse(*item)
+        try:
+            result = work.result()
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+        yield _sse("done", {
+            "text": result["text"],
+            **_publish_audio(result["audio_bytes"]),
+            "logs": result.get("logs", []),
+            "plan": result.get("plan", []),
+            "data": compact_fetched_data(result.get("data", {})),
+            "cached": result.get("cached", False),
+            "trace": result.get("trace", []),
+        })
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.exception_handler(resilience.UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: resilience.UpstreamUnavailable):
+    # An upstream is throttling or failing: tell the client when to retry
+    # instead of answering 500.
+    headers = {"Retry-After": str(math.ceil(exc.retry_after))} if exc.retry_after else {}
+    return JSONResponse(status_code=503, content={"detail": str(exc), "upstream": exc.upstream}, headers=headers)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not path, so /audio/{audio_id} is one series.
+        route = request.scope.get("route")
+        metrics.observe_request(route.path if route is not None else "unmatched", request.method, status,
+                                time.perf_counter() - start)
 
 @app.post("/process-query/")
 async def process_query(
     query: str = Form(...),
     gemini_api_key: str = Form(...),
     elevenlabs_api_key: str = Form(...),
-    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV")
+    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV"),
+    use_cache: bool = Form(True)
 ):
-    result = orchestrate(query, gemini_api_key, elevenlabs_api_key, voice_id)
-    # For audio, encode as base64 for JSON transport
-    audio_b64 = base64.b64encode(result["audio_bytes"]).decode() if result["audio_bytes"] else ""
+    result = await admission.run(orchestrate, query, gemini_api_key, elevenlabs_api_key, voice_id, use_cache=use_cache)
+    return _response_body(result)
+
+@app.post("/process-batch/")
+async def process_batch(
+    queries: str = Form(...),
+    gemini_api_key: str = Form(...),
+    elevenlabs_api_key: str = Form(...),
+    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV"),
+    use_cache: bool = Form(True)
+):
+    queries = _parse_queries(queries)
+    batch = await admission.run(orchestrate_batch, queries, gemini_api_key, elevenlabs_api_key, voice_id,
+                                use_cache=use_cache, timeout=BATCH_REQUEST_TIMEOUT)
+    # Repeated queries share one result; publish its audio once.
+    bodies = {}
+    for result in batch["results"]:
+        if id(result) not in bodies:
+            bodies[id(result)] = {**_response_body(result), "error": result.get("error")}
     return {
-        "text": result["text"],
-        "audio_b64": audio_b64,
-        "logs": result.get("logs", []),
-        "plan": result.get("plan", []),
-        "data": result.get("data", {})
+        "results": [{"query": query, **bodies[id(result)]} for query, result in zip(queries, batch["results"])],
+        "logs": batch["logs"],
+        "trace": batch["trace"]
     }
 
 @app.post("/process-voice/")
@@ -28,16 +221,151 @@ async def process_voice(
     audio: UploadFile = File(...),
     gemini_api_key: str = Form(...),
     elevenlabs_api_key: str = Form(...),
-    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV")
+    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV"),
+    use_cache: bool = Form(True)
 ):
     audio_bytes = await audio.read()
-    query = speech_to_text(audio_bytes, elevenlabs_api_key)
-    result = orchestrate(query, gemini_api_key, elevenlabs_api_key, voice_id)
-    audio_b64 = base64.b64encode(result["audio_bytes"]).decode() if result["audio_bytes"] else ""
+    result = await admission.run(_voice_pipeline, audio_bytes, gemini_api_key, elevenlabs_api_key, voice_id,
+                                 use_cache=use_cache)
+    return _response_body(result)
+
+@app.post("/process-query-stream/")
+async def process_query_stream(
+    query: str = Form(...),
+    gemini_api_key: str = Form(...),
+    elevenlabs_api_key: str = Form(...),
+    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV"),
+    use_cache: bool = Form(True)
+):
+    return _stream_pipeline(orchestrate, query, gemini_api_key, elevenlabs_api_key, voice_id, use_cache=use_cache)
+
+@app.post("/process-voice-stream/")
+async def process_voice_stream(
+    audio: UploadFile = File(...),
+    gemini_api_key: str = Form(...),
+    elevenlabs_api_key: str = Form(...),
+    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV"),
+    use_cache: bool = Form(True)
+):
+    audio_bytes = await audio.read()
+    return _stream_pipeline(_voice_pipeline, audio_bytes, gemini_api_key, elevenlabs_api_key, voice_id,
+                            use_cache=use_cache)
+
+@app.post("/jobs/", status_code=202)
+async def submit_job(
+    gemini_api_key: str = Form(...),
+    elevenlabs_api_key: str = Form(...),
+    query: str = Form(None),
+    queries: str = Form(None),
+    voice_id: str = Form("tnSpp4vdxKPjI9w0GnoV"),
+    use_cache: bool = Form(True),
+    lane: str = Form(None)
+):
+    # One query, or a batch (as for /process-batch/); batches default to
+    # the batch lane.
+    if (query is None) == (queries is None):
+        raise HTTPException(status_code=400, detail="Give either query or queries.")
+    if query is not None:
+        kind, payload = "query", {"query": query}
+    else:
+        kind, payload = "batch", {"queries": _parse_queries(queries)}
+    payload.update(voice_id=voice_id, use_cache=use_cache)
+    # The job queue does blocking SQLite work; keep it off the event loop.
+    job = await asyncio.to_thread(job_queue.submit, kind, payload, gemini_api_key, elevenlabs_api_key,
+                                  lane=lane or ("interactive" if kind == "query" else "batch"))
+    return {**job, "status_url": f"/jobs/{job['job_id']}", "events_url": f"/jobs/{job['job_id']}/events"}
+
+def _job_or_404(job):
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired.")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return _job_or_404(await asyncio.to_thread(job_queue.get, job_id))
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    return _job_or_404(await asyncio.to_thread(job_queue.cancel, job_id))
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    # Server-sent events: the job's status changes and pipeline stages,
+    # from the start, then "done" with the finished job.
+    _job_or_404(await asyncio.to_thread(job_queue.get, job_id, include_result=False))
+
+    async def stream():
+        after = 0
+        while True:
+            job = await asyncio.to_thread(job_queue.get, job_id)
+            for after, stage, payload in await asyncio.to_thread(job_queue.events, job_id, after):
+                yield _sse(stage, payload)
+            if job is None:
+                yield _sse("error", {"detail": "Job not found or expired."})
+                return
+            if job["status"] in JOB_FINISHED:
+                yield _sse("done", job)
+                return
+            await asyncio.sleep(JOB_EVENTS_POLL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/jobs/{job_id}/audio/{idx}")
+async def get_job_audio(job_id: str, idx: int, range_header: str = Header(None, alias="Range")):
+    data = await asyncio.to_thread(job_queue.audio, job_id, idx)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Audio not found or expired.")
+    return _audio_response(data, "audio/mpeg", range_header)
+
+@app.get("/audio/{audio_id}")
+async def get_audio(audio_id: str, range_header: str = Header(None, alias="Range")):
+    artifact = await asyncio.to_thread(audio_store.get, audio_id)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Audio not found or expired.")
+    return _audio_response(*artifact, range_header)
+
+def _audio_response(data, content_type, range_header):
+    size = len(data)
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable.",
+                            headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size - 1)
+    view = memoryview(data)[start:end + 1]
+
+    def chunks():
+        for offset in range(0, len(view), AUDIO_STREAM_CHUNK):
+            yield bytes(view[offset:offset + AUDIO_STREAM_CHUNK])
+
+    headers = {"Accept-Ranges": "bytes", "Content-Length": str(len(view)), "Cache-Control": "private, max-age=900"}
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return StreamingResponse(chunks(), status_code=206 if byte_range else 200,
+                             media_type=content_type, headers=headers)
+
+@app.get("/cache-stats/")
+async def cache_stats():
     return {
-        "text": result["text"],
-        "audio_b64": audio_b64,
-        "logs": result.get("logs", []),
-        "plan": result.get("plan", []),
-        "data": result.get("data", {})
+        "yahoo": api_agent.get_cache_stats(),
+        "entities": language_agent.get_entity_cache_stats(),
+        "tts": get_tts_cache_stats(),
+        "responses": response_cache.stats(),
+        "earnings_screener": earnings_screener.stats(),
     }
+
+@app.post("/response-cache/invalidate/")
+async def invalidate_response_cache(query: str = Form(None), entity: str = Form(None)):
+    # Drop cached answers for a query and/or mentioning an entity (ticker,
+    # sector, region...); with neither, clear the whole cache.
+    return {"invalidated": response_cache.invalidate(query=query, entity=entity)}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/")
+async def health():
+    return {"status": "ok", "admission": admission.stats(), "warm_up": warmup.report, "imports": lazy.stats(),
+            "clients": clients.stats(), "upstreams": resilience.stats(), "jobs": job_queue.stats()}
@@ -0,0 +1,176 @@
+"""
+news_rag.py
+
+Retrieval stage between fetching and prompting. Instead of passing every
+fetched article to the LLM, articles are split into chunks and only the
+chunks closest to the user query and to each extracted entity are kept. The
+prompt therefore carries at most NEWS_RAG_MAX_CHUNKS chunks however many news
+queries were fanned out.
+
+Only the current request's chunks are candidates, so each request ranks them
+in a small flat index of its own. Their vectors come from the shared
+embedding cache (keyed by model, not API key), so an article seen before is
+not embedded again. Any failure (no embedding key, embedding API errors)
+falls back to the ranked news list.
+"""
+
+import os
+import re
+import time
+import logging
+from agents import ann_index
+from agents.ann_index import IndexConfig
+from agents.embedding_cache import content_hash
+from agents.retriever_agent import get_embeddings
+from orchestrator.fetch_stage import news_queries_for
+
+logger = logging.getLogger("news_rag")
+logger.setLevel(logging.INFO)
+
+NEWS_RAG_ENABLED = os.getenv("NEWS_RAG_ENABLED", "1") == "1"
+# Articles considered per request (after de-duplication) before retrieval.
+NEWS_RAG_CANDIDATES = int(os.getenv("NEWS_RAG_CANDIDATES", "200"))
+NEWS_RAG_TOP_K = int(os.getenv("NEWS_RAG_TOP_K", "6"))
+NEWS_RAG_ENTITY_K = int(os.getenv("NEWS_RAG_ENTITY_K", "2"))
+NEWS_RAG_MAX_CHUNKS = int(os.getenv("NEWS_RAG_MAX_CHUNKS", "12"))
+NEWS_CHUNK_CHARS = int(os.getenv("NEWS_CHUNK_CHARS", "600"))
+NEWS_CHUNK_OVERLAP = int(os.getenv("NEWS_CHUNK_OVERLAP", "80"))
+
+_TAGS = re.compile(r"<[^>]+>")
+
+
+def _news_text(item):
+    # Same two yfinance layouts that scraping_agent._news_fields handles.
+    content = item.get("content") if isinstance(item.get("content"), dict) else item
+    provider = content.get("provider") if isinstance(content.get("provider"), dict) else {}
+    link = item.get("link") or (content.get("canonicalUrl") or {}).get("url") \
+        or (content.get("clickThroughUrl") or {}).get("url")
+    published = item.get("providerPublishTime") or content.get("pubDate")
+    body = content.get("summary") or content.get("description") or ""
+    return {
+        "key": item.get("uuid") or item.get("id") or content.get("id") or link or content.get("title"),
+        "title": (content.get("title") or "").strip(),
+        "body": " ".join(_TAGS.sub(" ", body).split()),
+        "publisher": item.get("publisher") or provider.get("displayName"),
+        "link": link,
+        "published": published,
+        "tickers": [t.upper() for t in item.get("relatedTickers") or []],
+    }
+
+
+def _split(text, size, overlap):
+    if len(text) <= size:
+        return [text] if text else []
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(start + size, len(text))
+        if end < len(text):
+            # Prefer to break at a sentence, then a word boundary.
+            cut = max(text.rfind(". ", start, end), text.rfind(" ", start, end))
+            if cut > start + size // 2:
+                end = cut + 1
+        chunks.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def chunk_news(news):
+    # Returns (docs, articles): documents (id, content, meta), one per chunk,
+    # and the parsed article fields keyed by article key.
+    docs, articles = [], {}
+    for item in news or []:
+        if not isinstance(item, dict):
+            continue
+        fields = _news_text(item)
+        if not fields["key"] or not (fields["title"] or fields["body"]):
+            continue
+        key = content_hash(str(fields["key"]), "news")[:24]
+        articles[key] = fields
+        for i, chunk in enumerate(_split(fields["body"], NEWS_CHUNK_CHARS, NEWS_CHUNK_OVERLAP) or [""]):
+            # The title is repeated in every chunk so each one embeds with
+            # its article's subject.
+            docs.append({
+                "id": f"{key}:{i}:{content_hash(chunk, 'chunk')[:8]}",
+                "content": f"{fields['title']}\n{chunk}".strip(),
+                "meta": {"article": key, "chunk": i, "text": chunk, "tickers": fields["tickers"],
+                         "published": fields["published"]},
+            })
+    return docs, articles
+
+
+def _to_news_items(chunks, articles):
+    # Regroup the selected chunks into per-article items in the usual news
+    # layout, keeping retrieval order, so the prompt format is unchanged.
+    items = {}
+    for doc in chunks:
+        key = doc["meta"]["article"]
+        if key not in items:
+            fields = articles[key]
+            items[key] = {
+                "title": fields["title"],
+                "publisher": fields["publisher"],
+                "link": fields["link"],
+                "providerPublishTime": fields["published"],
+                "relatedTickers": fields["tickers"],
+                "chunks": [],
+            }
+        items[key]["chunks"].append((doc["meta"]["chunk"], doc["meta"]["text"]))
+    selected = []
+    for item in items.values():
+        item["summary"] = " … ".join(text for _, text in sorted(item.pop("chunks")) if text)
+        selected.append({k: v for k, v in item.items() if v})
+    return selected
+
+
+def _nearest(doc_vectors, query_vectors, k):
+    # Positions of the k nearest documents for each query, by exact search
+    # over this request's chunks only.
+    index = IndexConfig("flat", pq_m=0).build(len(doc_vectors[0]))
+    index.add(ann_index.as_matrix(doc_vectors))
+    _, positions = ann_index.search(index, query_vectors, k)
+    return [[int(pos) for pos in row if pos >= 0] for row in positions]
+
+
+def select_news(query, entities, news, gemini_api_key, logs=None, top_k=None, entity_k=None, max_chunks=None):
+    # Returns the retrieved news items, or None if retrieval isn't possible
+    # and the caller should keep its own news list.
+    top_k = NEWS_RAG_TOP_K if top_k is None else top_k
+    entity_k = NEWS_RAG_ENTITY_K if entity_k is None else entity_k
+    max_chunks = NEWS_RAG_MAX_CHUNKS if max_chunks is None else max_chunks
+    if not news or not gemini_api_key:
+        return None
+    start = time.monotonic()
+    try:
+        docs, articles = chunk_news(news)
+        if not docs:
+            return None
+        embeddings = get_embeddings(gemini_api_key)
+        entity_queries = [q for q in news_queries_for(query, entities) if q != query]
+        doc_vectors = embeddings.embed_documents([d["content"] for d in docs])
+        query_vectors = embeddings.embed_queries([query] + entity_queries)
+        hits = [docs[pos] for pos in _nearest(doc_vectors, query_vectors[:1], top_k)[0]]
+        if entity_queries and entity_k:
+            for row in _nearest(doc_vectors, query_vectors[1:], entity_k):
+                hits.extend(docs[pos] for pos in row)
+    except Exception as e:
+        logger.error("News retrieval failed, using ranked news instead: %s", e)
+        if logs is not None:
+            logs.append(f"News retrieval failed, using ranked news instead: {e}")
+        return None
+
+    chunks, seen = [], set()
+    for doc in hits:
+        chunk_id = (doc["meta"]["article"], doc["meta"]["chunk"])
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            chunks.append(doc)
+    selected = _to_news_items(chunks[:max_chunks], articles)
+    elapsed = time.monotonic() - start
+    logger.info("News RAG: %d chunks from %d of %d articles (%d chunks ranked) in %.2fs",
+                min(len(chunks), max_chunks), len(selected), len(articles), len(docs), elapsed)
+    if logs is not None:
+        logs.append(f"News RAG: {min(len(chunks), max_chunks)} chunks from {len(selected)} of "
+                    f"{len(articles)} articles ({len(docs)} chunks ranked) in {elapsed:.2f}s")
+    return selected
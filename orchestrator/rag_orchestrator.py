@@ -1,69 +1,200 @@
+import os
+import queue
 import logging
-from agents import api_agent, scraping_agent, llm_orchestrator, voice_agent
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agents import api_agent, llm_orchestrator, voice_agent
+from agents.prompt_compactor import compact_fetched_data
+from agents.scraping_agent import NEWS_TOP_N
+from agents.retriever_agent import get_embeddings
+from orchestrator import fetch_stage, news_rag
+from orchestrator.response_cache import response_cache, RESPONSE_CACHE_ENABLED
+from orchestrator.telemetry import Trace, payload_bytes
 
 logger = logging.getLogger("rag_orchestrator")
 logger.setLevel(logging.INFO)
 
-def orchestrate(query, gemini_api_key, elevenlabs_api_key, voice_id="tnSpp4vdxKPjI9w0GnoV", logs=None):
+TTS_PIPELINED = os.getenv("TTS_PIPELINED", "1") == "1"
+FALLBACK_RESPONSE = "Here are the latest insights based on available data and news."
+FETCH_EVENT_TOKEN_BUDGET = 250
+# Queries of a batch whose LLM and TTS steps run at once, across all batches.
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+
+_FETCH_EVENT_KEYS = {
+    "ticker": "ticker_data", "ticker_batch": "ticker_data", "sector": "sector_data",
+    "industry": "industry_data", "market": "market_summary", "news": "news",
+    "exposure": "portfolio_exposure", "earnings": "earnings_screen",
+}
+
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch-answer")
+
+class Cancelled(Exception):
+    # Raised by an on_event callback to stop the run at that stage.
+    pass
+
+def _emit(on_event, stage, payload):
+    if on_event is None:
+        return
+    try:
+        on_event(stage, payload)
+    except Cancelled:
+        raise
+    except Exception as e:
+        logger.error("Event callback failed for %s: %s", stage, e)
+
+def _fetch_event(kind, arg, result):
+    payload = {"kind": kind, "arg": list(arg) if isinstance(arg, tuple) else arg, "ok": result is not None}
+    if result:
+        payload["data"] = compact_fetched_data({_FETCH_EVENT_KEYS[kind]: result}, FETCH_EVENT_TOKEN_BUDGET)
+    return payload
+
+def _traced_tts(trace):
+    # text_to_speech with one "tts" span per call.
+    def synthesize(text, elevenlabs_api_key, voice_id, previous_text=None):
+        with trace.span("tts", bytes_in=payload_bytes(text)) as span:
+            span["cache_hit"] = voice_agent.is_tts_cached(text, voice_id, previous_text)
+            audio = voice_agent.text_to_speech(text, elevenlabs_api_key, voice_id, previous_text=previous_text)
+            span["bytes_out"] = payload_bytes(audio)
+            if not audio:
+                span["error"] = "no audio"
+        return audio
+    return synthesize
+
+def _traced_llm(trace, query, entities, fetched_data, gemini_api_key, logs, on_token):
+    with trace.span("llm", bytes_in=payload_bytes(fetched_data)) as span:
+        llm_result = llm_orchestrator.llm_orchestrate(query, entities, fetched_data, gemini_api_key, logs, on_token=on_token)
+        span["bytes_out"] = payload_bytes(llm_result.get("response"))
+    return llm_result
+
+def _answer_with_pipelined_tts(query, entities, fetched_data, gemini_api_key, elevenlabs_api_key, voice_id, logs, on_event,
+                               trace):
+    # Streams the LLM answer into a sentence splitter and synthesizes each
+    # sentence as soon as it is complete, so TTS overlaps generation and the
+    # first audio segment is ready before the answer is finished.
+    sentences = queue.Queue()
+    splitter = voice_agent.SentenceSplitter()
+    streamed = []
+    segments = []
+
+    def on_token(text):
+        streamed.append(text)
+        _emit(on_event, "llm_token", {"text": text})
+        for sentence in splitter.feed(text):
+            sentences.put(sentence)
+
+    def speak():
+        for seq, audio in voice_agent.text_to_speech_pipelined(iter(sentences.get, None), elevenlabs_api_key, voice_id,
+                                                               synthesize=_traced_tts(trace)):
+            segments.append(audio)
+            if audio:
+                _emit(on_event, "audio", {"seq": seq, "audio_bytes": audio})
+
+    speaker = threading.Thread(target=speak, name="tts-pipeline", daemon=True)
+    speaker.start()
+    try:
+        llm_result = _traced_llm(trace, query, entities, fetched_data, gemini_api_key, logs, on_token)
+        response_text = llm_result.get("response", FALLBACK_RESPONSE)
+        _emit(on_event, "answer", {"text": response_text, "plan": llm_result.get("plan", [])})
+        # The model didn't answer in the expected JSON shape, so nothing was
+        # streamed; speak the parsed response instead.
+        remaining = splitter.flush() if streamed else voice_agent.split_sentences(response_text)
+        for sentence in remaining:
+            sentences.put(sentence)
+    finally:
+        sentences.put(None)
+        speaker.join()
+
+    ok = sum(1 for audio in segments if audio)
+    logger.info("Pipelined TTS: %d/%d segments synthesized", ok, len(segments))
+    logs.append(f"Pipelined TTS: {ok}/{len(segments)} segments synthesized")
+    return llm_result, b"".join(audio for audio in segments if audio) or None
+
+def _cached_response(entry, logs, on_event, trace):
+    cached = entry.result
+    logs.append(f"Served from response cache (cached query: '{entry.query}')")
+    _emit(on_event, "answer", {"text": cached["text"], "plan": cached["plan"]})
+    if cached["audio_bytes"]:
+        _emit(on_event, "audio", {"seq": 0, "audio_bytes": cached["audio_bytes"]})
+    return {**cached, "logs": logs, "cached": True, "trace": trace.to_list()}
+
+def orchestrate(query, gemini_api_key, elevenlabs_api_key, voice_id="tnSpp4vdxKPjI9w0GnoV", logs=None, on_event=None,
+                use_cache=True, trace=None):
+    # on_event(stage, payload), when given, receives progress as each stage
+    # completes: entities, every fetch, answer tokens, answer and audio
+    # segments (raw MP3 bytes under "audio_bytes"). Timing spans for every
+    # stage are collected in trace (a new one if not given) and returned
+    # under "trace".
     if logs is None:
         logs = []
+    trace = Trace() if trace is None else trace
     logs.append(f"Received query: {query}")
     logger.info("Received query: %s", query)
 
-    entities = api_agent.extract_market_entities(query, gemini_api_key, logs)
+    use_cache = use_cache and RESPONSE_CACHE_ENABLED
+    if use_cache:
+        with trace.span("response_cache.exact", bytes_in=payload_bytes(query)) as span:
+            entry = response_cache.lookup_exact(query, voice_id)
+            span["cache_hit"] = entry is not None
+        if entry is not None:
+            return _cached_response(entry, logs, on_event, trace)
+
+    with trace.span("entities", bytes_in=payload_bytes(query)) as span:
+        entities = api_agent.extract_market_entities(query, gemini_api_key, logs)
+        span["bytes_out"] = payload_bytes(entities)
     logs.append(f"Entities extracted: {entities}")
     logger.info("Entities extracted: %s", entities)
+    _emit(on_event, "entities", entities)
 
-    fetched_data = {}
+    query_vector = None
+    if use_cache:
+        embed = lambda text: get_embeddings(gemini_api_key).embed_queries([text])[0]
+        with trace.span("response_cache.semantic", bytes_in=payload_bytes(query)) as span:
+            entry, query_vector = response_cache.lookup(query, entities, voice_id, embed)
+            span["cache_hit"] = entry is not None
+        if entry is not None:
+            return _cached_response(entry, logs, on_event, trace)
+
+    on_result = None
+    if on_event is not None:
+        on_result = lambda kind, arg, result: _emit(on_event, "fetch", _fetch_event(kind, arg, result))
+    news_top_n = news_rag.NEWS_RAG_CANDIDATES if news_rag.NEWS_RAG_ENABLED else None
+    with trace.span("fetch") as span:
+        fetched_data = fetch_stage.fetch_all(query, entities, logs, on_result=on_result, news_top_n=news_top_n,
+                                             trace=trace)
+        span["bytes_out"] = payload_bytes(fetched_data)
+    return _answer(query, entities, fetched_data, gemini_api_key, elevenlabs_api_key, voice_id, logs, on_event,
+                   trace, use_cache, query_vector)
+
+def _answer(query, entities, fetched_data, gemini_api_key, elevenlabs_api_key, voice_id, logs, on_event, trace,
+            use_cache, query_vector):
+    # Everything after the fetch: news retrieval, the LLM answer and its
+    # audio, and storing the result in the response cache.
+    if news_rag.NEWS_RAG_ENABLED:
+        # Keep every de-duplicated article for retrieval to choose from; if
+        # retrieval fails, fall back to the usual top NEWS_TOP_N by rank.
+        with trace.span("news_rag", bytes_in=payload_bytes(fetched_data["news"])) as span:
+            selected = news_rag.select_news(query, entities, fetched_data["news"], gemini_api_key, logs)
+            fetched_data["news"] = selected if selected is not None else fetched_data["news"][:NEWS_TOP_N]
+            span["bytes_out"] = payload_bytes(fetched_data["news"])
+            if selected is None:
+                span["error"] = "fell back to ranked news"
 
-    ticker = entities.get("ticker")
-    if ticker:
-        if isinstance(ticker, list):
-            fetched_data["ticker_data"] = api_agent.fetch_multiple_tickers_data(ticker, logs)
-        else:
-            fetched_data["ticker_data"] = api_agent.fetch_ticker_data(ticker, logs)
-
-    sector = entities.get("sector")
-    if sector:
-        fetched_data["sector_data"] = api_agent.fetch_sector_data(sector, logs)
-
-    industry = entities.get("industry")
-    if industry:
-        fetched_data["industry_data"] = api_agent.fetch_industry_data(industry, logs)
-
-    region = entities.get("region")
-    if region:
-        if isinstance(region, list):
-            for reg in region:
-                fetched_data[f"market_{reg}"] = api_agent.fetch_market_summary(reg, logs)
-        else:
-            fetched_data["market_summary"] = api_agent.fetch_market_summary(region, logs)
-
-    news_queries = [query]
-    if ticker:
-        if isinstance(ticker, list):
-            news_queries.extend(ticker)
-        else:
-            news_queries.append(ticker)
-    if sector:
-        news_queries.append(sector)
-    if industry:
-        news_queries.append(industry)
-    if region:
-        if isinstance(region, list):
-            news_queries.extend(region)
-        else:
-            news_queries.append(region)
-    news = []
-    for nq in set(news_queries):
-        news.extend(scraping_agent.get_news(nq, count=10, logs=logs))
-    fetched_data["news"] = news
-
-    llm_result = llm_orchestrator.llm_orchestrate(query, entities, fetched_data, gemini_api_key)
+    if TTS_PIPELINED and elevenlabs_api_key:
+        llm_result, audio_bytes = _answer_with_pipelined_tts(
+            query, entities, fetched_data, gemini_api_key, elevenlabs_api_key, voice_id, logs, on_event, trace)
+        response_text = llm_result.get("response", FALLBACK_RESPONSE)
+    else:
+        on_token = None
+        if on_event is not None:
+            on_token = lambda text: _emit(on_event, "llm_token", {"text": text})
+        llm_result = _traced_llm(trace, query, entities, fetched_data, gemini_api_key, logs, on_token)
+        response_text = llm_result.get("response", FALLBACK_RESPONSE)
+        _emit(on_event, "answer", {"text": response_text, "plan": llm_result.get("plan", [])})
+        audio_bytes = _traced_tts(trace)(response_text, elevenlabs_api_key, voice_id)
+        if audio_bytes:
+            _emit(on_event, "audio", {"seq": 0, "audio_bytes": audio_bytes})
     logs.extend(llm_result.get("logs", []))
 
-    response_text = llm_result.get("response", "Here are the latest insights based on available data and news.")
-    audio_bytes = voice_agent.text_to_speech(response_text, elevenlabs_api_key, voice_id)
     if audio_bytes:
         logs.append("Audio generated successfully.")
         logger.info("Audio generated successfully.")
@@ -71,10 +202,120 @@ def orchestrate(query, gemini_api_key, elevenlabs_api_key, voice_id="tnSpp4vdxKP
         logs.append("Audio generation failed.")
         logger.error("Audio generation failed.")
 
+    if use_cache and audio_bytes and response_text != FALLBACK_RESPONSE:
+        response_cache.store(query, entities, voice_id, {
+            "text": response_text,
+            "audio_bytes": audio_bytes,
+            "plan": llm_result.get("plan", []),
+            "data": fetched_data,
+        }, query_vector)
+
     return {
         "text": response_text,
         "audio_bytes": audio_bytes,
         "logs": logs,
         "plan": llm_result.get("plan", []),
-        "data": fetched_data
+        "data": fetched_data,
+        "trace": trace.to_list()
+    }
+
+
+def orchestrate_batch(queries, gemini_api_key, elevenlabs_api_key, voice_id="tnSpp4vdxKPjI9w0GnoV", logs=None,
+                      use_cache=True, trace=None, on_event=None):
+    # Answers many queries together. Entities are extracted for the whole
+    # batch at once, the queries' fetch plans are merged so each ticker,
+    # sector, market and news search is fetched a single time, and the
+    # per-query LLM and TTS steps then run BATCH_CONCURRENCY at a time.
+    # Returns one orchestrate()-shaped result per query, in order, under
+    # "results"; trace holds the shared stages and each result's own trace
+    # its cache lookups and answer. on_event, when given, receives the
+    # batch's entities, a summary of the shared fetch and each answer.
+    if logs is None:
+        logs = []
+    trace = Trace() if trace is None else trace
+    unique = list(dict.fromkeys(queries))
+    logs.append(f"Received batch of {len(queries)} queries ({len(unique)} unique)")
+    logger.info("Received batch of %d queries (%d unique)", len(queries), len(unique))
+
+    use_cache = use_cache and RESPONSE_CACHE_ENABLED
+    query_logs = {query: [f"Received query: {query}"] for query in unique}
+    query_traces = {query: Trace() for query in unique}
+    results = {}
+
+    pending = unique
+    if use_cache:
+        for query in pending:
+            with query_traces[query].span("response_cache.exact", bytes_in=payload_bytes(query)) as span:
+                entry = response_cache.lookup_exact(query, voice_id)
+                span["cache_hit"] = entry is not None
+            if entry is not None:
+                results[query] = _cached_response(entry, query_logs[query], None, query_traces[query])
+        pending = [query for query in pending if query not in results]
+
+    entities = {}
+    if pending:
+        with trace.span("entities", bytes_in=payload_bytes(pending)) as span:
+            extracted = api_agent.extract_market_entities_batch(pending, gemini_api_key, logs)
+            span["bytes_out"] = payload_bytes(extracted)
+        entities = dict(zip(pending, extracted))
+        for query in pending:
+            query_logs[query].append(f"Entities extracted: {entities[query]}")
+        _emit(on_event, "entities", {"entities": entities})
+
+    query_vectors = {}
+    if use_cache and pending:
+        embed = None
+        with trace.span("response_cache.embed", bytes_in=payload_bytes(pending)) as span:
+            try:
+                vectors = dict(zip(pending, get_embeddings(gemini_api_key).embed_queries(pending)))
+                embed = vectors.__getitem__
+            except Exception as e:
+                logger.warning("Batch query embedding failed, matching on text only: %s", e)
+                span["error"] = f"{type(e).__name__}: {e}"
+        for query in pending:
+            with query_traces[query].span("response_cache.semantic", bytes_in=payload_bytes(query)) as span:
+                entry, query_vectors[query] = response_cache.lookup(query, entities[query], voice_id, embed)
+                span["cache_hit"] = entry is not None
+            if entry is not None:
+                results[query] = _cached_response(entry, query_logs[query], None, query_traces[query])
+        pending = [query for query in pending if query not in results]
+
+    fetched_data = {}
+    if pending:
+        plans = {query: fetch_stage.build_fetch_plan(query, entities[query]) for query in pending}
+        batch_plan = fetch_stage.build_batch_plan(plans.values())
+        planned = sum(len(plan) for plan in plans.values())
+        logs.append(f"Batch fetch plan: {len(batch_plan)} fetches for {planned} planned across {len(pending)} queries")
+        logger.info("Batch fetch plan: %d fetches for %d planned across %d queries", len(batch_plan), planned,
+                    len(pending))
+        news_top_n = news_rag.NEWS_RAG_CANDIDATES if news_rag.NEWS_RAG_ENABLED else None
+        with trace.span("fetch") as span:
+            fetched = fetch_stage.run_fetch_plan(batch_plan, logs, trace=trace)
+            for query in pending:
+                fetched_data[query] = fetch_stage.assemble_fetched_data(
+                    query, entities[query], fetch_stage.results_for_plan(plans[query], fetched), query_logs[query],
+                    news_top_n=news_top_n)
+            span["bytes_out"] = payload_bytes(fetched_data)
+        _emit(on_event, "fetch", {"fetches": len(batch_plan), "planned": planned, "completed": len(fetched)})
+
+    def answer(query):
+        # One query failing leaves the rest of the batch intact.
+        try:
+            return _answer(query, entities[query], fetched_data[query], gemini_api_key, elevenlabs_api_key,
+                           voice_id, query_logs[query], None, query_traces[query], use_cache,
+                           query_vectors.get(query))
+        except Exception as e:
+            logger.error("Batch answer failed for '%s': %s", query, e)
+            query_logs[query].append(f"Answer failed: {e}")
+            return {"text": FALLBACK_RESPONSE, "audio_bytes": None, "logs": query_logs[query], "plan": [],
+                    "data": fetched_data[query], "trace": query_traces[query].to_list(), "error": str(e)}
+
+    for query, result in zip(pending, _batch_executor.map(answer, pending)):
+        results[query] = result
+        _emit(on_event, "answer", {"query": query, "text": result["text"], "plan": result.get("plan", [])})
+
+    return {
+        "results": [results[query] for query in queries],
+        "logs": logs,
+        "trace": trace.to_list()
     }
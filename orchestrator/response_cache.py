@@ -0,0 +1,215 @@
+"""
+response_cache.py
+
+Whole-answer cache for orchestrate. A query is answered from the cache when
+an earlier query, asked with the same voice, either normalizes to the same
+text or extracts the same entities and has an embedding (cosine) similarity
+of at least RESPONSE_CACHE_SIMILARITY. If embeddings are unavailable, a
+token-overlap threshold is used instead.
+
+An entry only lives as long as the data behind it would: its freshness window
+is the shortest TTL plus stale window (see agents.cache.DEFAULT_POLICIES) of
+the fetches its query plans, capped at RESPONSE_CACHE_MAX_AGE. Entries hold
+text, plan, data and audio bytes, are LRU-evicted against a byte cap, and can
+be invalidated explicitly by query or by entity.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from agents.cache import estimate_size, yahoo_cache
+from agents.entity_index import ENTITY_FIELDS, normalize_query
+from orchestrator.fetch_stage import build_fetch_plan
+from agents.lazy import lazy_import
+np = lazy_import("numpy")
+
+logger = logging.getLogger("response_cache")
+logger.setLevel(logging.INFO)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.92"))
+RESPONSE_CACHE_LEXICAL_SIMILARITY = float(os.getenv("RESPONSE_CACHE_LEXICAL_SIMILARITY", "0.8"))
+RESPONSE_CACHE_MAX_AGE = float(os.getenv("RESPONSE_CACHE_MAX_AGE", "600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+
+# Fetch kind -> the yahoo_cache policy that governs how fresh its data is.
+_POLICY_FOR_FETCH = {
+    "ticker": "history", "ticker_batch": "history", "sector": "sector",
+    "industry": "industry", "market": "market", "news": "news", "exposure": "market",
+    "earnings": "sector",
+}
+
+
+def entity_signature(entities):
+    # Order- and case-insensitive fingerprint of the extracted entities.
+    signature = []
+    for field in ENTITY_FIELDS:
+        value = (entities or {}).get(field)
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        values = tuple(sorted({str(v).upper() for v in values if v}))
+        if values:
+            signature.append((field, values))
+    return tuple(signature)
+
+
+def freshness_window(query, entities):
+    window = RESPONSE_CACHE_MAX_AGE
+    for kind, _ in build_fetch_plan(query, entities):
+        ttl, stale = yahoo_cache.policies.get(_POLICY_FOR_FETCH[kind], (60, 0))
+        window = min(window, ttl + stale)
+    return window
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def _words(text):
+    return set(normalize_query(text).split())
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class _Entry:
+    __slots__ = ("key", "query", "tokens", "vector", "signature", "voice_id", "result", "size", "expires", "hits")
+
+    def __init__(self, key, query, vector, signature, voice_id, result, size, expires):
+        self.key = key
+        self.query = query
+        self.tokens = _words(query)
+        self.vector = vector
+        self.signature = signature
+        self.voice_id = voice_id
+        self.result = result
+        self.size = size
+        self.expires = expires
+        self.hits = 0
+
+
+class ResponseCache:
+    def __init__(self, similarity=RESPONSE_CACHE_SIMILARITY, lexical_similarity=RESPONSE_CACHE_LEXICAL_SIMILARITY,
+                 max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_BYTES):
+        self.similarity = similarity
+        self.lexical_similarity = lexical_similarity
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {
+            "exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0,
+            "evictions": 0, "expirations": 0, "invalidations": 0,
+        }
+
+    def _drop(self, key, counter):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        self.counters[counter] += 1
+        return entry
+
+    def _expire(self):
+        now = time.monotonic()
+        for key in [k for k, e in self._entries.items() if e.expires <= now]:
+            self._drop(key, "expirations")
+
+    def _hit(self, entry, counter, similarity=None):
+        self._entries.move_to_end(entry.key)
+        entry.hits += 1
+        self.counters[counter] += 1
+        logger.info("Response cache %s for '%s'%s", counter[:-1].replace("_", " "), entry.query,
+                    f" (similarity {similarity:.3f})" if similarity is not None else "")
+        return entry
+
+    def lookup_exact(self, query, voice_id):
+        # Cheap check before entity extraction: the same normalized question.
+        # Misses aren't counted here; lookup() counts them.
+        key = (normalize_query(query), voice_id)
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            return self._hit(entry, "exact_hits") if entry is not None else None
+
+    def lookup(self, query, entities, voice_id, embed=None):
+        # embed(text) -> vector, or None to match on token overlap only.
+        signature = entity_signature(entities)
+        with self._lock:
+            self._expire()
+            exact = self._entries.get((normalize_query(query), voice_id))
+            if exact is not None:
+                return self._hit(exact, "exact_hits"), None
+            candidates = [e for e in self._entries.values() if e.signature == signature and e.voice_id == voice_id]
+        vector = None
+        if embed is not None:
+            try:
+                vector = _unit(embed(query))
+            except Exception as e:
+                logger.warning("Query embedding failed, matching on text only: %s", e)
+        best, best_score = None, 0.0
+        for entry in candidates:
+            if vector is not None and entry.vector is not None and len(entry.vector) == len(vector):
+                score, needed = float(np.dot(vector, entry.vector)), self.similarity
+            else:
+                score, needed = _jaccard(_words(query), entry.tokens), self.lexical_similarity
+            if score >= needed and score > best_score:
+                best, best_score = entry, score
+        with self._lock:
+            if best is not None and best.key in self._entries:
+                return self._hit(best, "semantic_hits", best_score), vector
+            self.counters["misses"] += 1
+        return None, vector
+
+    def store(self, query, entities, voice_id, result, vector=None):
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        key = (normalize_query(query), voice_id)
+        entry = _Entry(key, query, vector, entity_signature(entities), voice_id, result, size,
+                       time.monotonic() + freshness_window(query, entities))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += size
+            self.counters["stores"] += 1
+            while self._entries and (self._bytes > self.max_bytes or len(self._entries) > self.max_entries):
+                self._drop(next(iter(self._entries)), "evictions")
+
+    def invalidate(self, query=None, entity=None):
+        # No arguments clears everything; otherwise drops entries for the
+        # given query text and/or mentioning the given entity value (e.g. a
+        # ticker or sector) in any field.
+        query_key = normalize_query(query) if query else None
+        entity = str(entity).upper() if entity else None
+        with self._lock:
+            doomed = [
+                key for key, e in self._entries.items()
+                if (query_key is None or key[0] == query_key)
+                and (entity is None or any(entity in values for _, values in e.signature))
+            ]
+            for key in doomed:
+                self._drop(key, "invalidations")
+        logger.info("Invalidated %d cached responses (query=%s, entity=%s)", len(doomed), query, entity)
+        return len(doomed)
+
+    def stats(self):
+        with self._lock:
+            hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+            lookups = hits + self.counters["misses"]
+            return dict(
+                self.counters,
+                entries=len(self._entries),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hit_rate=round(hits / lookups, 4) if lookups else 0.0,
+            )
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,224 @@
+"""
+telemetry.py
+
+Structured timing for the answer pipeline. A Trace collects one span per
+agent call made for a request: stage, entity, start offset and duration,
+bytes in and out, whether it was served from a cache, and the error if it
+failed. The spans are returned with the response, and every finished span is
+also folded into process-wide histograms and counters that /metrics exposes
+in the Prometheus text format.
+
+Entities only appear in traces; metric labels are limited to stage names
+(and route/method/status for HTTP) to keep label cardinality bounded.
+"""
+
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from agents.cache import estimate_size
+
+logger = logging.getLogger("telemetry")
+logger.setLevel(logging.INFO)
+
+METRIC_PREFIX = "finance_assistant"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def payload_bytes(value):
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode())
+    return estimate_size(value)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.values = {}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def lines(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        # values[labels] = [per-bucket counts..., +Inf count, sum]
+        series = self.values.setdefault(labels, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def lines(self):
+        for labels, series in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(series[-1])}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}"
+
+
+class Gauge(_Metric):
+    # Value read at scrape time: read() returns a number or {labels: number}.
+    # kind="counter" exposes a monotonic count kept elsewhere.
+    def __init__(self, name, help_text, read, labels=(), kind="gauge"):
+        super().__init__(name, help_text, labels)
+        self.read = read
+        self.kind = kind
+
+    def lines(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.warning("Gauge %s failed: %s", self.name, e)
+            return
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, number in sorted(values.items()):
+            labels = labels if isinstance(labels, tuple) else (labels,)
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(number)}"
+
+
+class MetricsRegistry:
+    def __init__(self, prefix=METRIC_PREFIX):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.stage_duration = self.histogram("stage_duration_seconds", "Duration of pipeline stages.", ("stage",))
+        self.stage_calls = self.counter("stage_calls_total", "Pipeline stage calls by outcome.", ("stage", "outcome"))
+        self.stage_cache = self.counter("stage_cache_lookups_total", "Stage calls that consulted a cache, by result.",
+                                        ("stage", "result"))
+        self.stage_bytes_in = self.counter("stage_bytes_in_total", "Bytes passed into pipeline stages.", ("stage",))
+        self.stage_bytes_out = self.counter("stage_bytes_out_total", "Bytes returned by pipeline stages.", ("stage",))
+        self.http_duration = self.histogram("http_request_duration_seconds", "HTTP request latency.",
+                                            ("route", "method"))
+        self.http_requests = self.counter("http_requests_total", "HTTP requests by status.",
+                                          ("route", "method", "status"))
+
+    def _add(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(f"{self.prefix}_{name}", help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DURATION_BUCKETS):
+        return self._add(Histogram(f"{self.prefix}_{name}", help_text, labels, buckets))
+
+    def gauge(self, name, help_text, read, labels=(), kind="gauge"):
+        return self._add(Gauge(f"{self.prefix}_{name}", help_text, read, labels, kind))
+
+    def observe_span(self, span):
+        stage = span["stage"]
+        with self._lock:
+            self.stage_duration.observe((stage,), span["duration_ms"] / 1000)
+            self.stage_calls.inc((stage, "error" if span["error"] else "ok"))
+            if span["cache_hit"] is not None:
+                self.stage_cache.inc((stage, "hit" if span["cache_hit"] else "miss"))
+            if span["bytes_in"]:
+                self.stage_bytes_in.inc((stage,), span["bytes_in"])
+            if span["bytes_out"]:
+                self.stage_bytes_out.inc((stage,), span["bytes_out"])
+
+    def observe_request(self, route, method, status, seconds):
+        with self._lock:
+            self.http_duration.observe((route, method), seconds)
+            self.http_requests.inc((route, method, str(status)))
+
+    def render(self):
+        with self._lock:
+            out = []
+            for metric in self._metrics.values():
+                lines = list(metric.lines())
+                if not lines and isinstance(metric, Gauge):
+                    continue
+                out.append(f"# HELP {metric.name} {metric.help}")
+                out.append(f"# TYPE {metric.name} {metric.kind}")
+                out.extend(lines)
+            return "\n".join(out) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class Trace:
+    # Spans for one request. Safe to record into from the fetch and TTS
+    # worker threads.
+    def __init__(self, registry=metrics):
+        self.registry = registry
+        self.started = time.monotonic()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration, entity=None, bytes_in=None, bytes_out=None, cache_hit=None, error=None,
+               start=None):
+        # duration in seconds; start is a time.monotonic() value.
+        start = time.monotonic() - duration if start is None else start
+        span = {
+            "stage": stage,
+            "entity": None if entity is None else str(entity),
+            "start_ms": round((start - self.started) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "cache_hit": cache_hit,
+            "error": error,
+        }
+        with self._lock:
+            self.spans.append(span)
+        if self.registry is not None:
+            self.registry.observe_span(span)
+        return span
+
+    @contextmanager
+    def span(self, stage, entity=None, bytes_in=None):
+        # Yields a dict the caller may fill with bytes_out, cache_hit and,
+        # for failures reported without raising, error.
+        fields = {"bytes_out": None, "cache_hit": None, "error": None}
+        start = time.monotonic()
+        try:
+            yield fields
+        except Exception as e:
+            fields["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.record(stage, time.monotonic() - start, entity=entity, bytes_in=bytes_in, start=start, **fields)
+
+    def to_list(self):
+        with self._lock:
+            return sorted((dict(span) for span in self.spans), key=lambda span: span["start_ms"])
@@ -0,0 +1,86 @@
+"""
+warmup.py
+
+Optional warm start for a new worker. Heavy packages load lazily (see
+agents.lazy), so the app can take traffic as soon as FastAPI is up and the
+first requests pay for pandas, yfinance, Gemini and langchain instead.
+warm_up() moves that cost off the request path: it imports every deferred
+package and pre-builds the clients (agents.clients) and caches requests
+share.
+
+WARM_START chooses when it runs on startup:
+
+- "background" (default): in a daemon thread, so the worker is ready at
+  once and warms while it serves;
+- "blocking": before the worker accepts requests;
+- "off": not at all.
+
+The report (seconds per step, and any failures) is served by /health.
+"""
+
+import os
+import time
+import logging
+import threading
+from agents import lazy
+from agents.clients import http_session, gemini_model
+from agents.entity_index import get_index
+from agents.earnings_screener import earnings_screener
+
+logger = logging.getLogger("warmup")
+logger.setLevel(logging.INFO)
+
+WARM_START = os.getenv("WARM_START", "background")
+WARM_START_MODES = ("background", "blocking", "off")
+
+report = {"mode": WARM_START, "state": "pending", "steps": {}, "errors": {}}
+
+
+def _gemini():
+    # Model handles and the embeddings client (with its on-disk vector cache)
+    # for the server's own key, if it has one; requests with other keys build
+    # theirs on first use.
+    api_key = os.getenv("GEMINI_API_KEY")
+    if api_key:
+        from agents.retriever_agent import get_embeddings
+        gemini_model(api_key)
+        get_embeddings(api_key)
+
+
+STEPS = (
+    ("imports", lazy.preload),
+    ("entity_index", get_index),
+    ("http_session", http_session),
+    ("gemini", _gemini),
+    ("earnings_table", earnings_screener.load),
+)
+
+
+def warm_up():
+    report["state"] = "running"
+    start = time.perf_counter()
+    for name, step in STEPS:
+        step_start = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            report["errors"][name] = str(e)
+            logger.error("Warm-up step %s failed: %s", name, e)
+        report["steps"][name] = round(time.perf_counter() - step_start, 3)
+    report["state"] = "done"
+    report["seconds"] = round(time.perf_counter() - start, 3)
+    logger.info("Warm-up finished in %.2fs: %s", report["seconds"], report["steps"])
+    return report
+
+
+def start(mode=WARM_START):
+    if mode not in WARM_START_MODES:
+        logger.warning("Unknown WARM_START %r; expected one of %s", mode, ", ".join(WARM_START_MODES))
+        mode = "off"
+    report["mode"] = mode
+    if mode == "off":
+        report["state"] = "off"
+    elif mode == "blocking":
+        warm_up()
+    else:
+        threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
@@ -1,11 +1,35 @@
 import streamlit as st
-import base64
 import pandas as pd
 import plotly.express as px
 from audio_recorder_streamlit import audio_recorder
-from utils import process_text_query, process_voice_query
+from utils import stream_text_query, stream_voice_query, collect_stream
 from audio_utils import ensure_wav_format
 
+def stream_and_render(events):
+    # Show progress and the answer text as the backend streams them in.
+    status = st.empty()
+    answer = st.empty()
+    fetched = []
+
+    def on_event(stage, payload, partial):
+        if stage == "transcript":
+            status.info(f"Heard: {payload.get('text', '')}")
+        elif stage == "entities":
+            found = ", ".join(f"{k}: {v}" for k, v in payload.items() if v)
+            status.info(f"Entities: {found or 'none'}")
+        elif stage == "fetch":
+            fetched.append(f"{payload['kind']} {payload['arg']}" + ("" if payload.get("ok") else " (timed out)"))
+            status.info("Fetched: " + ", ".join(fetched))
+        elif stage in ("llm_token", "answer"):
+            answer.markdown(partial["text"])
+        elif stage == "audio":
+            status.info(f"Audio ready: {len(partial['audio_segment_urls'])} segment(s)")
+
+    result = collect_stream(events, on_event)
+    status.empty()
+    answer.empty()
+    return result
+
 # --- Sidebar for API Keys ---
 st.sidebar.header("🔑 Enter API Keys to Start")
 if "GEMINI_API_KEY" not in st.session_state:
@@ -75,15 +99,15 @@ if st.session_state["GEMINI_API_KEY"] and st.session_state["ELEVENLABS_API_KEY"]
             st.session_state.processing = True
             with st.spinner("Analyzing your voice query..."):
                 processed_audio = ensure_wav_format(st.session_state.audio_bytes)
-                result = process_voice_query(
+                result = stream_and_render(stream_voice_query(
                     processed_audio,
                     st.session_state["GEMINI_API_KEY"],
                     st.session_state["ELEVENLABS_API_KEY"],
                     st.session_state["ELEVENLABS_VOICE_ID"]
-                )
+                ))
                 st.session_state.last_audio_result = result
                 st.session_state.response_text = result["text"]
-                st.session_state.response_audio = result["audio_bytes"]
+                st.session_state.response_audio = result["audio_url"]
                 st.session_state.data_insights = result.get("data", {})
             st.session_state.processing = False
             st.session_state.audio_bytes = None  # Reset for next recording
@@ -94,15 +118,15 @@ if st.session_state["GEMINI_API_KEY"] and st.session_state["ELEVENLABS_API_KEY"]
         if st.button("Analyze Text Query") and query:
             st.session_state.processing = True
             with st.spinner("Analyzing your text query..."):
-                result = process_text_query(
+                result = stream_and_render(stream_text_query(
                     query,
                     st.session_state["GEMINI_API_KEY"],
                     st.session_state["ELEVENLABS_API_KEY"],
                     st.session_state["ELEVENLABS_VOICE_ID"]
-                )
+                ))
                 st.session_state.last_text_result = result
                 st.session_state.response_text = result["text"]
-                st.session_state.response_audio = result["audio_bytes"]
+                st.session_state.response_audio = result["audio_url"]
                 st.session_state.data_insights = result.get("data", {})
             st.session_state.processing = False
 
@@ -116,9 +140,8 @@ if st.session_state["GEMINI_API_KEY"] and st.session_state["ELEVENLABS_API_KEY"]
         )
 
         if st.session_state.response_audio:
-            audio_base64 = base64.b64encode(st.session_state.response_audio).decode()
             audio_html = f"""
-            <audio id="ai-audio" src="data:audio/mp3;base64,{audio_base64}" autoplay controls style="width:100%; outline:none; border-radius:8px; background:#181c24;">
+            <audio id="ai-audio" src="{st.session_state.response_audio}" preload="auto" autoplay controls style="width:100%; outline:none; border-radius:8px; background:#181c24;">
             Your browser does not support the audio element.
             </audio>
             <script>
@@ -1,8 +1,12 @@
 import requests
-import base64
+import json
 
 BACKEND_URL = "https://finance-assisstant.onrender.com"
 
+def _absolute_url(path):
+    # Audio is served by the backend; the browser fetches it directly.
+    return f"{BACKEND_URL}{path}" if path else None
+
 def process_text_query(query, gemini_api_key, elevenlabs_api_key, voice_id):
     data = {
         "query": query,
@@ -13,10 +17,9 @@ def process_text_query(query, gemini_api_key, elevenlabs_api_key, voice_id):
     response = requests.post(f"{BACKEND_URL}/process-query/", data=data)
     response.raise_for_status()
     result = response.json()
-    audio_bytes = base64.b64decode(result["audio_b64"]) if result.get("audio_b64") else None
     return {
         "text": result["text"],
-        "audio_bytes": audio_bytes,
+        "audio_url": _absolute_url(result.get("audio_url")),
         "logs": result.get("logs", []),
         "plan": result.get("plan", []),
         "data": result.get("data", {}),
@@ -32,11 +35,69 @@ def process_voice_query(audio_bytes, gemini_api_key, elevenlabs_api_key, voice_i
     response = requests.post(f"{BACKEND_URL}/process-voice/", files=files, data=data)
     response.raise_for_status()
     result = response.json()
-    audio_bytes = base64.b64decode(result["audio_b64"]) if result.get("audio_b64") else None
     return {
         "text": result["text"],
-        "audio_bytes": audio_bytes,
+        "audio_url": _absolute_url(result.get("audio_url")),
         "logs": result.get("logs", []),
         "plan": result.get("plan", []),
         "data": result.get("data", {}),
     }
+
+def _iter_sse(response):
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if event:
+                yield event, json.loads("\n".join(data)) if data else {}
+            event, data = None, []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+def stream_text_query(query, gemini_api_key, elevenlabs_api_key, voice_id):
+    data = {
+        "query": query,
+        "gemini_api_key": gemini_api_key,
+        "elevenlabs_api_key": elevenlabs_api_key,
+        "voice_id": voice_id,
+    }
+    with requests.post(f"{BACKEND_URL}/process-query-stream/", data=data, stream=True) as response:
+        response.raise_for_status()
+        yield from _iter_sse(response)
+
+def stream_voice_query(audio_bytes, gemini_api_key, elevenlabs_api_key, voice_id):
+    files = {"audio": ("voice_query.wav", audio_bytes, "audio/wav")}
+    data = {
+        "gemini_api_key": gemini_api_key,
+        "elevenlabs_api_key": elevenlabs_api_key,
+        "voice_id": voice_id,
+    }
+    with requests.post(f"{BACKEND_URL}/process-voice-stream/", files=files, data=data, stream=True) as response:
+        response.raise_for_status()
+        yield from _iter_sse(response)
+
+def collect_stream(events, on_event=None):
+    # Consume a stream_*_query generator, calling on_event(stage, payload,
+    # partial_result) for incremental rendering, and return the same shape
+    # as process_text_query.
+    result = {"text": "", "audio_url": None, "audio_segment_urls": [], "logs": [], "plan": [], "data": {}}
+    for stage, payload in events:
+        if stage == "llm_token":
+            result["text"] += payload.get("text", "")
+        elif stage == "answer":
+            result["text"] = payload.get("text", result["text"])
+            result["plan"] = payload.get("plan", [])
+        elif stage == "audio":
+            result["audio_segment_urls"].append(_absolute_url(payload.get("audio_url")))
+        elif stage == "done":
+            result["text"] = payload.get("text", result["text"])
+            result["logs"] = payload.get("logs", [])
+            result["plan"] = payload.get("plan", result["plan"])
+            result["data"] = payload.get("data", {})
+            result["audio_url"] = _absolute_url(payload.get("audio_url"))
+        elif stage == "error":
+            raise RuntimeError(payload.get("detail", "Streaming request failed."))
+        if on_event is not None:
+            on_event(stage, payload, result)
+    return result